@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Book, Reservation
+from .models import Book, IsbnAvailability, Reservation
 
 admin.site.register(Book)
 admin.site.register(Reservation)
+admin.site.register(IsbnAvailability)
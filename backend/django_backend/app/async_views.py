@@ -0,0 +1,183 @@
+"""
+Async versions of the read-only endpoints, for ASGI servers
+(uvicorn django_backend.asgi:application).
+
+They answer the same data as their DRF counterparts in app.views, but run on the event
+loop instead of a worker thread per request: rows are read with the async ORM and
+external libraries are queried through a pooled aiohttp session of AvailabilityService.
+Under WSGI they still work, each one in its own event loop.
+"""
+import logging
+from types import SimpleNamespace
+from contextlib import asynccontextmanager
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from requests.exceptions import RequestException
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from django_backend.db_router import (
+    enable_replica_reads,
+    reset_replica_reads,
+    is_pinned_to_primary,
+    user_pin_scope,
+    )
+from services.book_availability_service import AvailabilityService
+from app.models import Book, IsbnAvailability, Reservation
+from app.serializers import BookProjection, IsbnAvailabilitySerializer, ReservationProjection
+from app.throttling import TokenBucketThrottle
+from app.utils import aget_external_availability
+
+logger = logging.getLogger(__name__)
+
+_jwt_authentication = JWTAuthentication()
+
+
+async def authenticate(request):
+    """User of the request's Bearer token, AnonymousUser without a token.
+
+    Raises:
+    - AuthenticationFailed: the token is invalid or its user does not exist or is inactive.
+    """
+    header = _jwt_authentication.get_header(request)
+    raw_token = _jwt_authentication.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        return AnonymousUser()
+    validated_token = _jwt_authentication.get_validated_token(raw_token)
+    try:
+        user = await User.objects.aget(
+            **{jwt_settings.USER_ID_FIELD: validated_token[jwt_settings.USER_ID_CLAIM]})
+    except (KeyError, User.DoesNotExist):
+        raise AuthenticationFailed('User not found', code='user_not_found')
+    if not user.is_active:
+        raise AuthenticationFailed('User is inactive', code='user_inactive')
+    return user
+
+
+def authentication_failed(exc):
+    data = exc.detail if isinstance(exc.detail, dict) else {'detail': exc.detail}
+    return JsonResponse(data, status=401)
+
+
+def throttle_wait(request, throttle_scope):
+    """Seconds to wait if a token bucket of throttle_scope is empty, None if the request
+    is allowed. Same buckets as the DRF views, see app.throttling.
+    """
+    throttle = TokenBucketThrottle()
+    if throttle.allow_request(request, SimpleNamespace(throttle_scope=throttle_scope)):
+        return None
+    return throttle.wait()
+
+
+@asynccontextmanager
+async def replica_reads_unless_pinned(*scopes):
+    """Async counterpart of app.views.ReplicaReadMixin."""
+    token = None
+    if settings.DATABASE_REPLICAS and not await sync_to_async(is_pinned_to_primary)(*scopes):
+        token = enable_replica_reads()
+    try:
+        yield
+    finally:
+        if token is not None:
+            reset_replica_reads(token)
+
+
+@require_GET
+async def book_list(request):
+    """List all books, see BookViewSet.list."""
+    async with replica_reads_unless_pinned('books'):
+        books = await BookProjection.aserialize(Book.objects.all())
+    return JsonResponse(books, safe=False)
+
+
+@require_GET
+async def book_search_by_isbn(request):
+    """Search internally for a book based on ISBN, see BookViewSet.search_by_isbn."""
+    isbn = request.GET.get('isbn', None)
+
+    if isbn is None:
+        return JsonResponse({"error": "Please provide correct ISBN"}, status=400)
+
+    async with replica_reads_unless_pinned('books'):
+        books = await BookProjection.aserialize(Book.objects.filter(isbn=isbn))
+
+    if len(books) < 1:
+        return JsonResponse({"error": "No books found with provided ISBN"}, status=400)
+
+    return JsonResponse(books, safe=False)
+
+
+@require_GET
+async def book_check_availability(request, pk):
+    """Availability of a book in internal and external libraries, see
+    BookViewSet.check_availability. Throttled with the same token buckets.
+    """
+    try:
+        request.user = await authenticate(request)
+    except AuthenticationFailed as exc:
+        return authentication_failed(exc)
+
+    wait = await sync_to_async(throttle_wait)(request, 'check_availability')
+    if wait is not None:
+        response = JsonResponse({'detail': 'Request was throttled.'}, status=429)
+        response['Retry-After'] = str(int(wait) + 1)
+        return response
+
+    # Same scopes as BookViewSet, see app.views.ReplicaReadMixin
+    pin_scopes = ['books']
+    if request.user.is_authenticated:
+        pin_scopes.append(user_pin_scope(request.user))
+
+    try:
+        async with replica_reads_unless_pinned(*pin_scopes):
+            try:
+                book = await Book.objects.aget(pk=pk)
+            except Book.DoesNotExist:
+                return JsonResponse({'detail': 'No Book matches the given query.'}, status=404)
+
+            # Check availability in all external library networks, cached briefly
+            external_availability = await aget_external_availability(AvailabilityService(),
+                                                                     book.isbn)
+
+            # Copies in all local libraries, their totals come from the indexed summary row
+            local_availability_data = [
+                local_book async for local_book in Book.objects.filter(isbn=book.isbn).order_by(
+                    'pk').values('book_id', 'library', 'count_in_library')
+            ]
+            network_summary = await IsbnAvailability.objects.filter(isbn=book.isbn).afirst()
+
+        return JsonResponse({
+            'book_title': book.title,
+            'author': book.author,
+            'isbn': book.isbn,
+            'local_library_network_availability': local_availability_data,
+            'local_library_network_summary': (IsbnAvailabilitySerializer(network_summary).data
+                                              if network_summary else None),
+            'external_availability': external_availability['availability'],
+            'external_availability_partial': external_availability['partial'],
+        })
+    except (RequestException, KeyError, ValueError) as e:
+        logger.error(f"Error while checking external availability': {str(e)}")
+        return JsonResponse(
+            ["An error occurred while checking internal and external availability"],
+            safe=False, status=400)
+
+
+@require_GET
+async def user_reservations(request):
+    """List all reservations of the current user, see UserReservationListView."""
+    try:
+        user = await authenticate(request)
+    except AuthenticationFailed as exc:
+        return authentication_failed(exc)
+    if not user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                            status=401)
+
+    async with replica_reads_unless_pinned(user_pin_scope(user)):
+        reservations = await ReservationProjection.aserialize(
+            Reservation.objects.filter(user=user))
+    return JsonResponse(reservations, safe=False)
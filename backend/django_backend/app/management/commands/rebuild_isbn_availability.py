@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from app.models import IsbnAvailability
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the IsbnAvailability summary table from Book rows with one GROUP BY, "
+            "or only report differences with --verify")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Compare the summaries with Book rows without writing')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Summaries written per INSERT')
+
+    def handle(self, *args, **options):
+        expected = IsbnAvailability.objects.summarize()
+        rows = IsbnAvailability.objects.values_list('isbn', 'total_copies', 'libraries_with_stock')
+        stored = {
+            isbn: (total_copies, libraries_with_stock)
+            for isbn, total_copies, libraries_with_stock in rows.iterator(
+                chunk_size=options['batch_size'])
+        }
+        changed = {
+            isbn: summary for isbn, summary in expected.items() if stored.get(isbn) != summary
+        }
+        orphaned = set(stored) - set(expected)
+
+        if options['verify']:
+            for isbn, summary in changed.items():
+                self.stdout.write(f"{isbn}: stored {stored.get(isbn)}, expected {summary}")
+            for isbn in orphaned:
+                self.stdout.write(f"{isbn}: stored {stored[isbn]}, no books")
+            mismatches = len(changed) + len(orphaned)
+            if mismatches:
+                raise CommandError(
+                    f"{mismatches} of {len(expected)} ISBN summaries are out of date")
+            self.stdout.write(self.style.SUCCESS(
+                f"All {len(expected)} ISBN summaries are up to date"))
+            return
+
+        with transaction.atomic():
+            IsbnAvailability.objects.filter(isbn__in=orphaned).delete()
+            IsbnAvailability.objects.write(changed, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated {len(changed)} and removed {len(orphaned)} "
+            f"of {len(expected)} ISBN summaries"))
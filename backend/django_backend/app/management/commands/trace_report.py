@@ -0,0 +1,83 @@
+import os
+import glob
+import json
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def read_spans(directory):
+    """Spans of all services' OTLP/JSON lines files in directory."""
+    spans = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.jsonl'))):
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                for resource_spans in json.loads(line)['resourceSpans']:
+                    service = next((attribute['value']['stringValue']
+                                    for attribute in resource_spans['resource']['attributes']
+                                    if attribute['key'] == 'service.name'), 'unknown')
+                    for scope_spans in resource_spans['scopeSpans']:
+                        for span in scope_spans['spans']:
+                            spans.append(dict(span, service=service))
+    return spans
+
+
+class Command(BaseCommand):
+    help = ("Print the span tree of recent traces (or of one trace) with the offset and "
+            "duration of every span, from the files written to TRACING_EXPORT_DIR")
+
+    def add_arguments(self, parser):
+        parser.add_argument('trace_id', nargs='?',
+                            help='Trace to print, default: the most recent ones')
+        parser.add_argument('--dir', default=settings.TRACING_EXPORT_DIR,
+                            help='Directory with the exported *.jsonl files')
+        parser.add_argument('--limit', type=int, default=5, help='Number of recent traces')
+
+    def handle(self, *args, **options):
+        if not options['dir']:
+            raise CommandError("Set TRACING_EXPORT_DIR or pass --dir")
+        traces = defaultdict(list)
+        for span in read_spans(options['dir']):
+            traces[span['traceId']].append(span)
+
+        if options['trace_id']:
+            if options['trace_id'] not in traces:
+                raise CommandError(f"Trace {options['trace_id']} not found")
+            trace_ids = [options['trace_id']]
+        else:
+            trace_ids = sorted(traces, key=lambda trace_id: min(
+                int(span['startTimeUnixNano']) for span in traces[trace_id]))[-options['limit']:]
+
+        for trace_id in trace_ids:
+            self.print_trace(trace_id, traces[trace_id])
+
+    def print_trace(self, trace_id, spans):
+        span_ids = {span['spanId'] for span in spans}
+        children = defaultdict(list)
+        for span in spans:
+            # Spans whose parent is missing (not exported or from an untraced caller) are roots
+            parent_id = span.get('parentSpanId') if span.get('parentSpanId') in span_ids else None
+            children[parent_id].append(span)
+        for siblings in children.values():
+            siblings.sort(key=lambda span: int(span['startTimeUnixNano']))
+
+        trace_start = min(int(span['startTimeUnixNano']) for span in spans)
+        trace_end = max(int(span['endTimeUnixNano']) for span in spans)
+        self.stdout.write(self.style.SUCCESS(
+            f"Trace {trace_id}: {len(spans)} spans, {(trace_end - trace_start) / 1e6:.1f} ms"))
+        self.stdout.write(f"{'start':>10} {'duration':>10}  span")
+
+        def write(span, depth):
+            start = int(span['startTimeUnixNano'])
+            duration = int(span['endTimeUnixNano']) - start
+            failed = ' [error]' if span.get('status', {}).get('code') == 2 else ''
+            self.stdout.write(f"{(start - trace_start) / 1e6:>7.1f} ms {duration / 1e6:>7.1f} ms  "
+                              f"{'  ' * depth}{span['service']}: {span['name']}{failed}")
+            for child in children[span['spanId']]:
+                write(child, depth + 1)
+
+        for root in children[None]:
+            write(root, 0)
+        self.stdout.write('')
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from app.tasks import warm_caches
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the cached catalog views and fetch the external availability of the "
+            "most reserved ISBNs, e.g. after a deploy or a Redis flush")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--async', action='store_true', dest='run_async',
+                            help='Queue the warm-up as a Celery task instead of running it here')
+        parser.add_argument('--no-catalog', action='store_true',
+                            help='Do not rebuild the cached catalog views')
+        parser.add_argument('--no-availability', action='store_true',
+                            help='Do not fetch external availability')
+        parser.add_argument('--top', type=int, default=None,
+                            help='Number of most reserved ISBNs, '
+                                 'defaults to CACHE_WARMUP_TOP_ISBNS')
+
+    def handle(self, *args, **options):
+        kwargs = {
+            'catalog': not options['no_catalog'],
+            'availability': not options['no_availability'],
+            'top': options['top'],
+        }
+        if options['run_async']:
+            result = warm_caches.delay(**kwargs)
+            self.stdout.write(self.style.SUCCESS(f"Queued cache warm-up task {result.id}"))
+            return
+
+        result = warm_caches(**kwargs)
+        self.stdout.write(self.style.SUCCESS(
+            f"Warmed {len(result.get('catalog', []))} catalog views and the availability "
+            f"of {result.get('availability', 0)} ISBNs"))
@@ -0,0 +1,257 @@
+import math
+import time
+import threading
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from services.metrics import registry
+from services.tracing import tracer, SPAN_KIND_SERVER
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    'django_http_request_duration_seconds',
+    'Duration of requests by view, method and status code.',
+    ('view', 'method', 'status'),
+)
+ADMISSION_SHED = registry.counter(
+    'admission_control_shed_total',
+    'Requests rejected with 503 by AdmissionControlMiddleware.',
+    ('endpoint_class',),
+)
+
+
+class EndpointClassState:
+    """In-flight requests and latency (EWMA) of one endpoint class in this process."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.latency = None
+        self.admitted = 0
+        self.shed = 0
+
+    def concurrency_limit(self, config):
+        """max_in_flight while the class is fast, scaled down in proportion to how far its
+        latency is above target_latency, but never below min_in_flight.
+        """
+        limit = config['max_in_flight']
+        target_latency = config.get('target_latency')
+        if target_latency and self.latency and self.latency > target_latency:
+            limit = max(config.get('min_in_flight', 1), int(limit * target_latency / self.latency))
+        return limit
+
+    def try_acquire(self, config):
+        with self._lock:
+            if self.in_flight >= self.concurrency_limit(config):
+                self.shed += 1
+                return False
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self, duration, smoothing):
+        with self._lock:
+            self.in_flight -= 1
+            if self.latency is None:
+                self.latency = duration
+            else:
+                self.latency += smoothing * (duration - self.latency)
+
+    def retry_after(self):
+        return max(1, math.ceil(self.latency or 0))
+
+    def stats(self, config):
+        return {
+            'in_flight': self.in_flight,
+            'limit': self.concurrency_limit(config),
+            'latency': self.latency,
+            'admitted': self.admitted,
+            'shed': self.shed,
+        }
+
+
+class AdmissionController:
+    """Per-process state of the endpoint classes in ADMISSION_CONTROL_CLASSES."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def get_state(self, endpoint_class):
+        state = self._states.get(endpoint_class)
+        if state is None:
+            with self._lock:
+                state = self._states.setdefault(endpoint_class, EndpointClassState())
+        return state
+
+    def stats(self):
+        return {
+            endpoint_class: state.stats(settings.ADMISSION_CONTROL_CLASSES[endpoint_class])
+            for endpoint_class, state in list(self._states.items())
+            if endpoint_class in settings.ADMISSION_CONTROL_CLASSES
+        }
+
+    def reset(self):
+        with self._lock:
+            self._states = {}
+
+
+admission_controller = AdmissionController()
+
+registry.gauge(
+    'admission_control_in_flight',
+    'Requests in flight per endpoint class in this process.',
+    ('endpoint_class',),
+    callback=lambda: {
+        (name,): stats['in_flight'] for name, stats in admission_controller.stats().items()},
+)
+registry.gauge(
+    'admission_control_limit',
+    'Current concurrency limit per endpoint class in this process.',
+    ('endpoint_class',),
+    callback=lambda: {
+        (name,): stats['limit'] for name, stats in admission_controller.stats().items()},
+)
+
+
+class AdmissionControlMiddleware:
+    """Sheds excess requests of expensive endpoints with 503 before the view runs.
+
+    Endpoints are grouped into classes by URL name (ADMISSION_CONTROL_ENDPOINTS), each
+    class has a concurrency limit per process (ADMISSION_CONTROL_CLASSES) that shrinks
+    while its recent latency is above target. Requests over the limit are answered
+    immediately with a Retry-After header instead of queueing behind slow calls to
+    external libraries. Endpoints outside of any class (cached lists, searches) are
+    never shed.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            # Only touches in-process state, run it on the event loop
+            self.process_view = self._aprocess_view
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        self.release(request)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        self.release(request)
+        return response
+
+    def release(self, request):
+        admission = getattr(request, '_admission', None)
+        if admission is not None:
+            state, started = admission
+            state.release(time.monotonic() - started, settings.ADMISSION_CONTROL_LATENCY_SMOOTHING)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        return self.admit(request)
+
+    async def _aprocess_view(self, request, view_func, view_args, view_kwargs):
+        return self.admit(request)
+
+    def admit(self, request):
+        """Return a 503 response if the request's endpoint class is over its limit."""
+        endpoint_class = settings.ADMISSION_CONTROL_ENDPOINTS.get(request.resolver_match.url_name)
+        if endpoint_class is None:
+            return None
+        state = admission_controller.get_state(endpoint_class)
+        if not state.try_acquire(settings.ADMISSION_CONTROL_CLASSES[endpoint_class]):
+            ADMISSION_SHED.inc(endpoint_class)
+            response = JsonResponse({'detail': 'Server is busy, please retry later.'}, status=503)
+            response['Retry-After'] = str(state.retry_after())
+            return response
+        request._admission = (state, time.monotonic())
+        return None
+
+
+class MetricsMiddleware:
+    """Records the duration of every request, labelled with the resolved view name."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = time.monotonic()
+        response = self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.monotonic()
+        response = await self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    def observe(self, request, response, started):
+        resolver_match = getattr(request, 'resolver_match', None)
+        view = resolver_match.view_name if resolver_match is not None else 'unresolved'
+        HTTP_REQUEST_SECONDS.observe(time.monotonic() - started, view, request.method,
+                                     response.status_code)
+
+
+class TracingMiddleware:
+    """Runs every request in a server span, continuing the trace of an incoming
+    traceparent header (e.g. Flask verifying a token during an external reservation).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        span = self.begin(request)
+        if span is None:
+            return self.get_response(request)
+        token = tracer.activate(span)
+        try:
+            response = self.get_response(request)
+            self.end(request, response, span)
+            return response
+        finally:
+            tracer.finish(span, token)
+
+    async def __acall__(self, request):
+        span = self.begin(request)
+        if span is None:
+            return await self.get_response(request)
+        token = tracer.activate(span)
+        try:
+            response = await self.get_response(request)
+            self.end(request, response, span)
+            return response
+        finally:
+            tracer.finish(span, token)
+
+    def begin(self, request):
+        return tracer.begin(f'{request.method} {request.path}', SPAN_KIND_SERVER,
+                            traceparent=request.META.get('HTTP_TRACEPARENT'),
+                            attributes={'http.method': request.method,
+                                        'http.target': request.path})
+
+    def end(self, request, response, span):
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is not None:
+            span.name = f'{request.method} {resolver_match.view_name}'
+        span.set_attribute('http.status_code', response.status_code)
+        if response.status_code >= 500:
+            span.set_error(f'HTTP {response.status_code}')
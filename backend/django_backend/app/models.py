@@ -1,5 +1,8 @@
-from django.db import models
+import uuid
+from django.db import connection, models
+from django.db.models import Count, Q, Sum
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 class Book(models.Model):
@@ -13,11 +16,81 @@ class Book(models.Model):
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Values as stored, lets app.signals refresh the IsbnAvailability of a previous ISBN
+        if 'isbn' in field_names and 'count_in_library' in field_names:
+            instance._loaded_stock = (instance.isbn, instance.count_in_library)
+        return instance
+
     class Meta:
         # Prevents multiple reservations of the same book by the same user.
         unique_together = ('isbn', 'library')
 
 
+class IsbnAvailabilityManager(models.Manager):
+    def summarize(self, isbns=None):
+        """Compute summaries from Book rows, of the given ISBNs or of all books.
+        Returns a dict isbn -> (total_copies, libraries_with_stock).
+        """
+        books = Book.objects.all()
+        if isbns is not None:
+            books = books.filter(isbn__in=isbns)
+        rows = books.order_by().values('isbn').annotate(
+            total_copies=Sum('count_in_library'),
+            libraries_with_stock=Count('book_id', filter=Q(count_in_library__gt=0)),
+        ).values_list('isbn', 'total_copies', 'libraries_with_stock')
+        return {isbn: (total_copies, libraries_with_stock)
+                for isbn, total_copies, libraries_with_stock in rows}
+
+    def refresh(self, isbns, batch_size=1000):
+        """Recompute the summaries of the given ISBNs, e.g. after bulk updates of Book
+        which bypass the Book signals.
+        """
+        isbns = set(isbns)
+        summaries = self.summarize(isbns)
+        self.filter(isbn__in=isbns - set(summaries)).delete()
+        self.write(summaries, batch_size=batch_size)
+
+    def write(self, summaries, batch_size=1000):
+        """Insert or update summaries given as isbn -> (total_copies, libraries_with_stock)."""
+        if not summaries:
+            return
+        now = timezone.now()
+        # MySQL's ON DUPLICATE KEY UPDATE takes no conflict target
+        supports_target = connection.features.supports_update_conflicts_with_target
+        unique_fields = ['isbn'] if supports_target else None
+        self.bulk_create(
+            [IsbnAvailability(isbn=isbn,
+                              total_copies=total_copies,
+                              libraries_with_stock=libraries_with_stock,
+                              updated_at=now)
+             for isbn, (total_copies, libraries_with_stock) in summaries.items()],
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=unique_fields,
+            update_fields=['total_copies', 'libraries_with_stock', 'updated_at'],
+        )
+
+
+class IsbnAvailability(models.Model):
+    """Denormalized stock of one ISBN across all local libraries.
+
+    Kept up to date from Book signals in the same transaction as the Book change, see
+    app.signals. Rebuild or verify with `python manage.py rebuild_isbn_availability`.
+    """
+    isbn = models.CharField(max_length=13, primary_key=True)
+    total_copies = models.IntegerField(default=0, null=False, blank=False)
+    libraries_with_stock = models.IntegerField(default=0, null=False, blank=False)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    objects = IsbnAvailabilityManager()
+
+    def __str__(self):
+        return f"{self.isbn}: {self.total_copies} copies in {self.libraries_with_stock} libraries"
+
+
 class Reservation(models.Model):
     reservation_id = models.AutoField(primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -30,6 +103,47 @@ class Reservation(models.Model):
                                            null=False,
                                            blank=False)
     is_external = models.BooleanField(default=False, null=False, blank=False)
+    # Reminder notification tracking, see app.tasks.check_reservation_deadlines
+    reminder_stage = models.PositiveSmallIntegerField(default=0, null=False, blank=False)
+    reminder_sent_at = models.DateTimeField(null=True, blank=True)
+    # Set when the reservation was closed by app.tasks.expire_overdue_reservations
+    expired_at = models.DateTimeField(null=True, blank=True)
+
+    REMINDER_STAGE_NONE = 0
+    REMINDER_STAGE_DUE_SOON = 1
+
+    EXTERNAL_STATUS_NONE = ''
+    EXTERNAL_STATUS_PENDING = 'pending'
+    EXTERNAL_STATUS_CONFIRMED = 'confirmed'
+    EXTERNAL_STATUS_FAILED = 'failed'
+    EXTERNAL_STATUS_CHOICES = [
+        (EXTERNAL_STATUS_NONE, 'Not external'),
+        (EXTERNAL_STATUS_PENDING, 'Pending'),
+        (EXTERNAL_STATUS_CONFIRMED, 'Confirmed'),
+        (EXTERNAL_STATUS_FAILED, 'Failed'),
+    ]
+    # Progress of an external reservation, see app.tasks.complete_external_reservation
+    external_status = models.CharField(max_length=16,
+                                       choices=EXTERNAL_STATUS_CHOICES,
+                                       default=EXTERNAL_STATUS_NONE,
+                                       blank=True)
+    # Library asked for the external copy, recorded before the call so the copy can be
+    #   released again, see app.tasks.release_external_hold
+    external_provider = models.CharField(max_length=64, default='', blank=True)
+    external_book_id = models.CharField(max_length=64, default='', blank=True)
+    # Idempotency-Key of the external reservation and its release, None for copies
+    #   reserved before keys were recorded
+    external_request_key = models.UUIDField(default=uuid.uuid4, null=True, editable=False)
 
     def __str__(self):
         return f"{self.user.username} reserved {self.book.title}"
+
+    class Meta:
+        indexes = [
+            # Lets the deadline scan read only reservations still waiting for a reminder
+            models.Index(fields=['reservation_status', 'reminder_stage', 'reserved_until'],
+                         name='reservation_reminder_idx'),
+            # Lets the expiry sweeper range-scan overdue active reservations
+            models.Index(fields=['reservation_status', 'reserved_until'],
+                         name='reservation_overdue_idx'),
+        ]
@@ -1,8 +1,13 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
+from django.db import transaction
+from django.db.models import F
 from datetime import datetime, timezone, timedelta
-from .models import Book, Reservation
+from .models import Book, IsbnAvailability, Reservation
+from .signals import book_stock_changed
+from .tasks import queue_external_release
 
 
 class BookSerializer(serializers.ModelSerializer):
@@ -12,6 +17,65 @@ class BookSerializer(serializers.ModelSerializer):
         read_only_fields = ['book_id']
 
 
+class ValuesProjection:
+    """Fast read-only serialization of large listings, the output of `model_serializer`
+    built from values_list() rows instead of model instances.
+
+    `fields` maps output names to ORM lookups (in output order, joins allowed), e.g.
+    'user': 'user__username'. Values are output as read, except for the fields in
+    `converters`, whose function is applied to non-null values. Output must stay
+    identical to `model_serializer`, see ProjectionContractTest.
+    """
+    model_serializer = None
+    fields = {}
+    converters = {}
+
+    @classmethod
+    def _to_dicts(cls, rows):
+        names = list(cls.fields)
+        converters = [(index, cls.converters[name])
+                      for index, name in enumerate(names) if name in cls.converters]
+        if not converters:
+            return [dict(zip(names, row)) for row in rows]
+        data = []
+        for row in rows:
+            row = list(row)
+            for index, convert in converters:
+                if row[index] is not None:
+                    row[index] = convert(row[index])
+            data.append(dict(zip(names, row)))
+        return data
+
+    @classmethod
+    def serialize(cls, queryset):
+        """List of dicts of the queryset's rows, read with one query."""
+        return cls._to_dicts(queryset.values_list(*cls.fields.values()))
+
+    @classmethod
+    async def aserialize(cls, queryset):
+        """Async version of serialize, for async views."""
+        return cls._to_dicts([row async for row in queryset.values_list(*cls.fields.values())])
+
+
+class BookProjection(ValuesProjection):
+    model_serializer = BookSerializer
+    fields = {
+        'book_id': 'book_id',
+        'title': 'title',
+        'author': 'author',
+        'isbn': 'isbn',
+        'count_in_library': 'count_in_library',
+        'library': 'library',
+    }
+
+
+class IsbnAvailabilitySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = IsbnAvailability
+        fields = ['total_copies', 'libraries_with_stock', 'updated_at']
+        read_only_fields = fields
+
+
 class ReservationSerializer(serializers.ModelSerializer):
     user = serializers.ReadOnlyField(source='user.username')
     book_id = serializers.PrimaryKeyRelatedField(
@@ -44,6 +108,47 @@ class ReservationSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class ReservationProjection(ValuesProjection):
+    model_serializer = ReservationSerializer
+    fields = {
+        'reservation_id': 'reservation_id',
+        'user': 'user__username',
+        'book_id': 'book_id',
+        'reserved_at': 'reserved_at',
+        'reserved_until': 'reserved_until',
+        'reservation_status': 'reservation_status',
+        'is_external': 'is_external',
+    }
+    # Same format and time zone handling as the serializer's fields
+    converters = {
+        'reserved_at': serializers.DateTimeField().to_representation,
+        'reserved_until': serializers.DateTimeField().to_representation,
+    }
+
+
+class BulkReservationSerializer(serializers.Serializer):
+    book_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_RESERVATION_MAX_BOOKS,
+    )
+
+    def validate_book_ids(self, value):
+        # A book listed twice is reserved once
+        return list(dict.fromkeys(value))
+
+
+class ReservationStatusSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Reservation
+        fields = ['reservation_id',
+                  'reservation_status',
+                  'reservation_library',
+                  'is_external',
+                  'external_status']
+        read_only_fields = fields
+
+
 class ReturnBookSerializer(serializers.ModelSerializer):
     reservation_id = serializers.IntegerField(required=True)
 
@@ -67,13 +172,36 @@ class ReturnBookSerializer(serializers.ModelSerializer):
         if not reservation.reservation_status or reservation is None:
             raise serializers.ValidationError("Reservation does not exist or already returned.")
 
+        # The external copy is still being reserved, see app.tasks.complete_external_reservation
+        if reservation.external_status == Reservation.EXTERNAL_STATUS_PENDING:
+            raise serializers.ValidationError(
+                "Reservation is still being processed, the book cannot be returned yet.")
+
         return data
 
     def update(self, instance, validated_data):
-        instance.reservation_status = False  # Set the reservation as inactive
-        instance.book.count_in_library += 1  # Increment the count of the book in the library
-        instance.book.save()  # Save the updated book count
-        instance.save()  # Save the reservation update
+        # Closed only while active, of concurrent returns of one reservation a single one wins
+        closed = Reservation.objects.filter(
+            reservation_id=instance.reservation_id, reservation_status=True
+        ).update(reservation_status=False)
+        if not closed:
+            raise serializers.ValidationError("Reservation does not exist or already returned.")
+        instance.reservation_status = False
+
+        if instance.is_external:
+            # The copy never came from local stock, it is given back to the external library
+            if instance.external_provider:
+                queue_external_release(instance.user_id, instance.external_provider,
+                                       instance.external_book_id, instance.external_request_key)
+            return instance
+
+        # Increment in the database, concurrent changes of the stock are not overwritten
+        Book.objects.filter(book_id=instance.book_id).update(
+            count_in_library=F('count_in_library') + 1)
+        # Conditional updates bypass the Book signals
+        isbns = {instance.book.isbn}
+        IsbnAvailability.objects.refresh(isbns)
+        transaction.on_commit(lambda: book_stock_changed.send(sender=Book, isbns=isbns))
         return instance
 
 
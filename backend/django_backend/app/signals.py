@@ -1,9 +1,87 @@
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
-from django.core.cache import cache
-from .models import Book
+from django.dispatch import receiver, Signal
+from django_backend.db_router import pin_to_primary
+from services.book_search_index import book_search_index
+from services.availability_events import publish_events
+from app.utils import invalidate_cached_view
+from .models import Book, IsbnAvailability
+
+# Sent once for a set of ISBNs whose stock was changed by bulk updates, which bypass
+# the post_save/post_delete signals. Arguments: isbns (set of str)
+book_stock_changed = Signal()
 
 
 @receiver([post_save, post_delete], sender=Book)
 def invalidate_books_cache(sender, **kwargs):
-    cache.delete('books_list')
+    invalidate_cached_view('books_list')
+    # Rebuild the catalog from the primary, a lagging replica would be cached for minutes
+    pin_to_primary('books')
+
+
+@receiver(post_save, sender=Book)
+def update_book_search_index(sender, instance, **kwargs):
+    book_search_index.update(instance.book_id, instance.title, instance.author, instance.isbn)
+
+
+@receiver(post_delete, sender=Book)
+def remove_from_book_search_index(sender, instance, **kwargs):
+    book_search_index.remove(instance.book_id)
+
+
+def availability_events(isbns):
+    """Current IsbnAvailability of the given ISBNs as event dicts, zeros for ISBNs
+    without a summary.
+    """
+    summaries = IsbnAvailability.objects.in_bulk(list(isbns))
+    events = []
+    for isbn in isbns:
+        summary = summaries.get(isbn)
+        events.append({
+            'isbn': isbn,
+            'total_copies': summary.total_copies if summary else 0,
+            'libraries_with_stock': summary.libraries_with_stock if summary else 0,
+            'updated_at': summary.updated_at.isoformat() if summary else None,
+        })
+    return events
+
+
+def publish_availability_on_commit(isbns):
+    """Push the summaries of the ISBNs to SSE clients once the change is committed."""
+    isbns = set(isbns)
+    transaction.on_commit(lambda: publish_events(availability_events(isbns)))
+
+
+@receiver(post_save, sender=Book)
+def update_isbn_availability(sender, instance, created, **kwargs):
+    # Recomputed rather than adjusted by the change of this instance, F() updates of the
+    #   same ISBN bypass this signal and would leave a delta stale
+    stock = (instance.isbn, instance.count_in_library)
+    loaded_stock = getattr(instance, '_loaded_stock', None)
+    isbns = {instance.isbn}
+    if loaded_stock is not None:
+        isbns.add(loaded_stock[0])
+    IsbnAvailability.objects.refresh(isbns)
+    if created or loaded_stock != stock:
+        publish_availability_on_commit(isbns)
+    instance._loaded_stock = stock
+
+
+@receiver(post_delete, sender=Book)
+def remove_from_isbn_availability(sender, instance, **kwargs):
+    isbns = {instance.isbn}
+    loaded_stock = getattr(instance, '_loaded_stock', None)
+    if loaded_stock is not None:
+        isbns.add(loaded_stock[0])
+    IsbnAvailability.objects.refresh(isbns)
+    publish_availability_on_commit(isbns)
+
+
+@receiver(book_stock_changed)
+def invalidate_books_cache_for_isbns(sender, isbns, **kwargs):
+    if not isbns:
+        return
+    invalidate_cached_view('books_list')
+    pin_to_primary('books')
+    # Already sent after commit
+    publish_events(availability_events(isbns))
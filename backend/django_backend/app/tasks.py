@@ -1,13 +1,27 @@
+import time
 import logging
+from collections import Counter, defaultdict
+from smtplib import SMTPRecipientsRefused
 from celery import shared_task
 from django.utils import timezone
 from datetime import timedelta
 from django.contrib.auth.models import User
-from django.core.mail import send_mail
+from django.core.mail import send_mail, get_connection, EmailMessage
 from django.conf import settings
-from django.template.loader import render_to_string
+from django.db import transaction
+from django.db.models import Count, F
+from django.core.cache import cache
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+from django.template.loader import render_to_string, get_template
 from django.template import TemplateDoesNotExist
-from app.models import Reservation
+from requests.exceptions import RequestException
+from rest_framework_simplejwt.tokens import AccessToken
+from services.book_availability_service import AvailabilityService
+from services.library_selection import reserve_with_failover
+from app.models import Book, IsbnAvailability, Reservation
+from app.signals import book_stock_changed
+from app.utils import CACHE_WARMUP_PENDING_KEY, get_external_availability
 
 logger = logging.getLogger(__name__)
 
@@ -46,20 +60,440 @@ def send_notification(user_id, reservation_id):
         raise
 
 
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def send_notifications_batch(self, reservation_ids):
+    """
+    Sending reminder emails for many reservations at once. Reservations and users are
+    fetched with one query, the template is compiled once and all emails are sent over
+    a single mail connection.
+
+    A rejected recipient address is logged and skipped. Only reservations that failed
+    for other (possibly transient) reasons are retried, never the whole batch.
+    """
+    started = time.perf_counter()
+    subject = 'Library Reservation Reminder'
+    email_from = settings.DEFAULT_FROM_EMAIL
+    try:
+        template = get_template('email/reminder_email.txt')
+    except TemplateDoesNotExist as e:
+        logger.error('Template email/reminder_email.txt does not exist')
+        raise TemplateDoesNotExist(f'Template {str(e)} does not exist')
+
+    reservations = Reservation.objects.select_related('user', 'book').filter(
+        reservation_id__in=reservation_ids
+    )
+    sent, rejected, failed = [], [], []
+    missing = set(reservation_ids)
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        logger.error(f'Error opening mail connection: {str(e)}')
+        raise self.retry(exc=e)
+
+    try:
+        for reservation in reservations:
+            missing.discard(reservation.reservation_id)
+            user = reservation.user
+            if not user.email:
+                logger.error(f'User {user.username} has no email address')
+                rejected.append(reservation.reservation_id)
+                continue
+
+            message = EmailMessage(
+                subject,
+                template.render({'user': user, 'reservation': reservation}),
+                email_from,
+                [user.email],
+                connection=connection,
+            )
+            try:
+                message.send()
+                sent.append(reservation.reservation_id)
+            except SMTPRecipientsRefused as e:
+                logger.error(f'Email address of user {user.username} rejected: {str(e)}')
+                rejected.append(reservation.reservation_id)
+            except Exception as e:
+                logger.error(f'Error sending email to user {user.id}: {str(e)}')
+                failed.append(reservation.reservation_id)
+    finally:
+        connection.close()
+
+    for reservation_id in missing:
+        logger.error(f'Reservation with id {reservation_id} does not exist')
+
+    duration = time.perf_counter() - started
+    logger.info(f'Notification batch of {len(reservation_ids)} processed in {duration:.3f}s: '
+                f'{len(sent)} sent, {len(rejected)} rejected, {len(failed)} failed')
+
+    if failed:
+        try:
+            self.retry(args=[failed])
+        except self.MaxRetriesExceededError:
+            logger.error(f'Giving up on notifications for reservations {failed}')
+
+    return {
+        'sent': sent,
+        'rejected': rejected,
+        'failed': failed,
+        'missing': sorted(missing),
+        'duration': duration,
+    }
+
+
 @shared_task
 def check_reservation_deadlines():
     """
-    Periodic task to check for reservations that are about to expire and notify users
+    Periodic task to check for reservations that are about to expire and notify users.
+
+    Runs often and claims at most RESERVATION_REMINDER_MAX_CHUNKS chunks per run, so the
+    work is spread over the day. A reservation is claimed by moving it to the next
+    reminder stage before its email is queued, therefore it is never picked up twice.
+    """
+    chunk_size = settings.RESERVATION_REMINDER_CHUNK_SIZE
+    scheduled = 0
+    for _ in range(settings.RESERVATION_REMINDER_MAX_CHUNKS):
+        reservation_ids = claim_reminder_chunk(chunk_size)
+        if not reservation_ids:
+            break
+        scheduled += len(reservation_ids)
+        logger.info(f'Reminders scheduled for reservations {reservation_ids}')
+        if len(reservation_ids) < chunk_size:
+            break
+    return scheduled
+
+
+def claim_reminder_chunk(chunk_size):
+    """Claim up to chunk_size reservations due within RESERVATION_REMINDER_DAYS that
+    have not been reminded yet, and queue one notification batch for them.
+    """
+    now = timezone.now()
+    reminder_time = now + timedelta(days=settings.RESERVATION_REMINDER_DAYS)
+    with transaction.atomic():
+        reservation_ids = list(
+            Reservation.objects.select_for_update(skip_locked=True).filter(
+                reservation_status=True,
+                reminder_stage=Reservation.REMINDER_STAGE_NONE,
+                reserved_until__gte=now,
+                reserved_until__lte=reminder_time
+            ).order_by('reserved_until').values_list('reservation_id', flat=True)[:chunk_size]
+        )
+        if not reservation_ids:
+            return []
+        Reservation.objects.filter(reservation_id__in=reservation_ids).update(
+            reminder_stage=Reservation.REMINDER_STAGE_DUE_SOON,
+            reminder_sent_at=now,
+        )
+        transaction.on_commit(lambda: send_notifications_batch.delay(reservation_ids))
+    return reservation_ids
+
+
+@shared_task
+def expire_overdue_reservations():
+    """
+    Periodic task closing active reservations whose reserved_until has passed and
+    returning their copies to the library stock.
+
+    Works in chunks of RESERVATION_EXPIRY_CHUNK_SIZE, with at most
+    RESERVATION_EXPIRY_MAX_CHUNKS chunks per run.
+    """
+    chunk_size = settings.RESERVATION_EXPIRY_CHUNK_SIZE
+    expired = 0
+    for _ in range(settings.RESERVATION_EXPIRY_MAX_CHUNKS):
+        count = expire_overdue_chunk(chunk_size)
+        expired += count
+        if count < chunk_size:
+            break
+    if expired:
+        logger.info(f'Expired {expired} overdue reservations')
+    return expired
+
+
+def expire_overdue_chunk(chunk_size):
+    """Expire one chunk of overdue reservations.
+
+    The chunk is read from the (reservation_status, reserved_until) index and closed with
+    a single UPDATE. Local stock is restored with one F() increment per distinct amount,
+    e.g. all books getting one copy back share one UPDATE. The IsbnAvailability summaries
+    of the affected ISBNs are recomputed in the same transaction and stock-dependent caches
+    are invalidated once per chunk. Copies of external reservations are given back to
+    their libraries by release_external_hold tasks, queued once the chunk is committed.
     """
     now = timezone.now()
-    reminder_time = now + timedelta(days=3)
-    reservations = Reservation.objects.filter(
+    with transaction.atomic():
+        rows = list(
+            Reservation.objects.select_for_update(skip_locked=True).filter(
+                reservation_status=True,
+                reserved_until__lt=now
+            ).order_by('reserved_until').values(
+                'reservation_id', 'book_id', 'is_external', 'user_id',
+                'external_provider', 'external_book_id', 'external_request_key'
+            )[:chunk_size]
+        )
+        if not rows:
+            return 0
+
+        Reservation.objects.filter(
+            reservation_id__in=[row['reservation_id'] for row in rows]
+        ).update(reservation_status=False, expired_at=now)
+
+        for row in rows:
+            if row['is_external'] and row['external_provider']:
+                queue_external_release(row['user_id'], row['external_provider'],
+                                       row['external_book_id'], row['external_request_key'])
+
+        # External reservations never took a copy from local stock
+        copies_per_book = Counter(row['book_id'] for row in rows if not row['is_external'])
+        books_per_increment = defaultdict(list)
+        for book_id, copies in copies_per_book.items():
+            books_per_increment[copies].append(book_id)
+        for copies, book_ids in books_per_increment.items():
+            Book.objects.filter(book_id__in=book_ids).update(
+                count_in_library=F('count_in_library') + copies
+            )
+
+        isbns = set(Book.objects.filter(
+            book_id__in=list(copies_per_book)
+        ).values_list('isbn', flat=True))
+        IsbnAvailability.objects.refresh(isbns)
+        transaction.on_commit(lambda: book_stock_changed.send(sender=Book, isbns=isbns))
+    return len(rows)
+
+
+def external_api_token(user):
+    """Short-lived access token of the user for calls to external libraries from tasks,
+    so the user's own JWT never has to travel through the broker.
+    """
+    return str(AccessToken.for_user(user))
+
+
+@shared_task(bind=True, max_retries=5)
+def complete_external_reservation(self, reservation_id):
+    """
+    Completes a pending external reservation created by ReserveBookView in async mode.
+
+    Steps: check availability in all external library providers, reserve a copy in the
+    best ranked library (failing over to the others) and confirm the reservation.
+    Only the availability check is retried (with exponential backoff), nothing is
+    reserved before it succeeds. The library is recorded on the reservation before it
+    is asked and every reservation carries the reservation's idempotency key, so a copy
+    that may have been taken is always released again (compensation) when the
+    reservation fails, is closed meanwhile or a previous run was interrupted.
+    """
+    try:
+        reservation = Reservation.objects.select_related('book', 'user').get(
+            reservation_id=reservation_id)
+    except Reservation.DoesNotExist:
+        logger.error(f'Reservation {reservation_id} does not exist')
+        return None
+    if reservation.external_status != Reservation.EXTERNAL_STATUS_PENDING:
+        # Already completed, e.g. a duplicate delivery of this task
+        return reservation.external_status
+    if reservation.external_provider:
+        # A previous run was interrupted while reserving, its outcome is unknown
+        fail_external_reservation(reservation_id, 'Reservation was interrupted')
+        return release_external_copy(reservation)
+
+    availability_service = AvailabilityService()
+    try:
+        external_availability = availability_service.check_book_availability(
+            reservation.book.isbn)['availability']
+    except RequestException as e:
+        if self.request.retries >= self.max_retries:
+            return fail_external_reservation(reservation_id, str(e))
+        raise self.retry(exc=e, countdown=2 ** self.request.retries)
+    if not external_availability:
+        return fail_external_reservation(reservation_id, 'Book is not available')
+
+    def record_attempt(candidate):
+        reservation.external_provider = candidate['provider']
+        reservation.external_book_id = candidate['book_id']
+        Reservation.objects.filter(reservation_id=reservation_id).update(
+            external_provider=candidate['provider'], external_book_id=candidate['book_id'])
+
+    try:
+        availability_details = reserve_with_failover(
+            availability_service, external_availability, external_api_token(reservation.user),
+            idempotency_key=str(reservation.external_request_key), before_attempt=record_attempt)
+    except (RequestException, KeyError, ValueError) as e:
+        # Not retried, a retry could take a copy in another library
+        fail_external_reservation(reservation_id, str(e))
+        return release_external_copy(reservation)
+    if availability_details is None:
+        return fail_external_reservation(reservation_id, 'External libraries rejected reservation')
+
+    confirmed = Reservation.objects.filter(
+        reservation_id=reservation_id,
         reservation_status=True,
-        reserved_until__gte=now,
-        reserved_until__lte=reminder_time
+        external_status=Reservation.EXTERNAL_STATUS_PENDING
+    ).update(
+        external_status=Reservation.EXTERNAL_STATUS_CONFIRMED,
+        reservation_library=availability_details['library']
+    )
+    if not confirmed:
+        # Reservation was closed meanwhile (returned or expired), give the copy back
+        logger.warning(f'Reservation {reservation_id} is no longer pending, releasing '
+                       f'external book {reservation.external_book_id}')
+        fail_external_reservation(reservation_id, 'Reservation was closed meanwhile')
+        return release_external_copy(reservation)
+    return Reservation.EXTERNAL_STATUS_CONFIRMED
+
+
+def fail_external_reservation(reservation_id, reason):
+    """Close a pending external reservation that could not be completed."""
+    logger.warning(f'External reservation {reservation_id} failed: {reason}')
+    Reservation.objects.filter(
+        reservation_id=reservation_id,
+        external_status=Reservation.EXTERNAL_STATUS_PENDING
+    ).update(
+        external_status=Reservation.EXTERNAL_STATUS_FAILED,
+        reservation_status=False
+    )
+    return Reservation.EXTERNAL_STATUS_FAILED
+
+
+def release_external_copy(reservation):
+    """Queue the release of the external copy the reservation may hold, once the current
+    transaction commits. Returns the reservation's current external status.
+    """
+    if reservation.external_provider:
+        queue_external_release(reservation.user_id, reservation.external_provider,
+                               reservation.external_book_id, reservation.external_request_key)
+    return Reservation.objects.filter(
+        reservation_id=reservation.reservation_id
+    ).values_list('external_status', flat=True).first()
+
+
+def queue_external_release(user_id, provider, book_id, idempotency_key):
+    """Queue release_external_hold once the current transaction commits."""
+    idempotency_key = str(idempotency_key) if idempotency_key else None
+    transaction.on_commit(lambda: release_external_hold.delay(
+        user_id, provider, book_id, idempotency_key))
+
+
+@shared_task(bind=True, max_retries=5)
+def release_external_hold(self, user_id, provider, book_id, idempotency_key=None):
+    """
+    Gives back a copy held in an external library, e.g. of a failed, returned or expired
+    external reservation.
+
+    A keyed release gives back only the copy taken with the key and at most once, so
+    network errors are retried with exponential backoff. Copies reserved without a key
+    are released with a single attempt, a retry could give the copy back twice.
+    """
+    try:
+        user = User.objects.get(id=user_id)
+    except User.DoesNotExist:
+        logger.error(f'User with id {user_id} does not exist')
+        return False
+    try:
+        return AvailabilityService().release_book_external_api(
+            book_id, external_api_token(user), provider=provider or None,
+            idempotency_key=idempotency_key)
+    except RequestException as e:
+        response = getattr(e, 'response', None)
+        if response is not None and 400 <= response.status_code < 500:
+            logger.error(f'External library refused to release book {book_id}: {str(e)}')
+            return False
+        if not idempotency_key or self.request.retries >= self.max_retries:
+            logger.error(f'Giving up releasing external book {book_id} of {provider}: {str(e)}')
+            return False
+        raise self.retry(exc=e, countdown=2 ** self.request.retries)
+    except (KeyError, ValueError) as e:
+        logger.error(f'Could not release external book {book_id}: {str(e)}')
+        return False
+
+
+@shared_task
+def warm_caches(catalog=True, availability=True, top=None):
+    """
+    Fill caches before users hit them cold, e.g. after a deploy or a Redis flush.
+
+    - catalog: rebuild the cached views of CACHE_WARMUP_URL_NAMES.
+    - availability: fetch the external availability of the `top` (default
+      CACHE_WARMUP_TOP_ISBNS) most reserved ISBNs, at most
+      CACHE_WARMUP_AVAILABILITY_RATE fetches per second.
+    """
+    result = {}
+    if catalog:
+        result['catalog'] = warm_catalog_cache()
+    if availability:
+        isbns = top_reserved_isbns(settings.CACHE_WARMUP_TOP_ISBNS if top is None else top)
+        result['availability'] = warm_external_availability(isbns)
+    logger.info(f'Caches warmed: {result}')
+    return result
+
+
+@shared_task
+def warm_invalidated_caches():
+    """
+    Periodic task rebuilding the catalog after invalidate_cached_view, once no other
+    invalidation came for CACHE_WARMUP_DEBOUNCE_SECONDS, so a burst of changes costs
+    one rebuild.
+    """
+    invalidated_at = cache.get(CACHE_WARMUP_PENDING_KEY)
+    if (invalidated_at is None
+            or time.time() - invalidated_at < settings.CACHE_WARMUP_DEBOUNCE_SECONDS):
+        return False
+    # Cleared first, an invalidation during the rebuild is warmed by the next run
+    cache.delete(CACHE_WARMUP_PENDING_KEY)
+    warm_catalog_cache()
+    return True
+
+
+def warm_catalog_cache():
+    """Request the cached views of CACHE_WARMUP_URL_NAMES in-process. A missing or
+    invalidated entry is rebuilt, single-flight with concurrent user requests, a fresh
+    one is only read.
+
+    Returns:
+    - list: URL names answered with 200.
+    """
+    factory = RequestFactory()
+    warmed = []
+    for name in settings.CACHE_WARMUP_URL_NAMES:
+        path = reverse(name)
+        match = resolve(path)
+        # Same cache variant as API clients asking for JSON
+        response = match.func(factory.get(path, HTTP_ACCEPT='application/json'),
+                              *match.args, **match.kwargs)
+        if response.status_code == 200:
+            warmed.append(name)
+        else:
+            logger.warning(f'Warming {name} failed with status {response.status_code}')
+    return warmed
+
+
+def top_reserved_isbns(limit):
+    """ISBNs with the most reservations in the last CACHE_WARMUP_RESERVATION_DAYS."""
+    since = timezone.now() - timedelta(days=settings.CACHE_WARMUP_RESERVATION_DAYS)
+    return list(
+        Reservation.objects.filter(reserved_at__gte=since).values('book__isbn').annotate(
+            reservations=Count('reservation_id')
+        ).order_by('-reservations', 'book__isbn').values_list('book__isbn', flat=True)[:limit]
     )
-    for reservation in reservations:
-        user_id = reservation.user.id
-        reservation_id = reservation.reservation_id
-        send_notification.delay(user_id, reservation_id)
-        logger.info(f'Reminder scheduled for user {reservation.user.username} about reservation {reservation_id}')
+
+
+def warm_external_availability(isbns):
+    """Refresh the cached external availability of the ISBNs, starting at most
+    CACHE_WARMUP_AVAILABILITY_RATE fetches per second so the providers are not flooded.
+
+    Returns:
+    - int: number of ISBNs fetched.
+    """
+    availability_service = AvailabilityService()
+    interval = 1.0 / settings.CACHE_WARMUP_AVAILABILITY_RATE
+    next_start = time.monotonic()
+    warmed = 0
+    for isbn in isbns:
+        delay = next_start - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        next_start = time.monotonic() + interval
+        try:
+            get_external_availability(availability_service, isbn, refresh=True)
+            warmed += 1
+        except RequestException as e:
+            logger.warning(f'Warming external availability of {isbn} failed: {str(e)}')
+    return warmed
@@ -1,5 +1,7 @@
 from django.test import TestCase, Client
 from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from app.models import Book
@@ -25,26 +27,27 @@ class BookListCacheTest(TestCase):
         )
         self.books_url = reverse('book-list')
 
+    def get_books(self, url=None, **extra):
+        """Return the response and the number of queries it took."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url or self.books_url, **extra)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(queries)
+
     def test_books_list_cached(self):
         """
         Test that the books list is cached and invalidated appropriately.
         """
-        cached_books = cache.get('books_list')  # Ensure cache is empty
-        self.assertIsNone(cached_books, "Cache should be empty before the first request.")
-
-        response = self.client.get(self.books_url)
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response, num_queries = self.get_books()
+        self.assertGreater(num_queries, 0, "The first request should read the database.")
         data = response.json()
 
-        cached_books = cache.get('books_list')
-        self.assertIsNotNone(cached_books, "Cache should be populated after the first request.")
-        self.assertEqual(cached_books, data, "Cached data should match the response data.")
-
-        response2 = self.client.get(self.books_url)
-        self.assertEqual(response2.status_code, status.HTTP_200_OK)
-        data2 = response2.json()
+        response2, num_queries = self.get_books()
+        self.assertEqual(num_queries, 0, "The second request should be served from the cache.")
+        self.assertEqual(response2.content, response.content,
+                         "Data from the second request should match the first.")
+        self.assertEqual(response2['Content-Type'], response['Content-Type'])
 
-        self.assertEqual(data2, data, "Data from the second request should match the first.")
         Book.objects.create(
             title='Book 3',
             author='Author 3',
@@ -53,18 +56,12 @@ class BookListCacheTest(TestCase):
             library='Main Library'
         )
 
-        cached_books = cache.get('books_list')
-        self.assertIsNone(cached_books, "Cache should be invalidated after adding a new book.")
-
-        response3 = self.client.get(self.books_url)
-        self.assertEqual(response3.status_code, status.HTTP_200_OK)
+        response3, num_queries = self.get_books()
+        self.assertGreater(num_queries, 0, "Cache should be invalidated after adding a new book.")
         data3 = response3.json()
 
-        cached_books = cache.get('books_list')
-        self.assertIsNotNone(cached_books, "Cache should be repopulated after the request.")
-        self.assertEqual(cached_books,
-                         data3,
-                         "Cached data should match the updated response data.")
+        _, num_queries = self.get_books()
+        self.assertEqual(num_queries, 0, "Cache should be repopulated after the request.")
 
         self.assertEqual(len(data3), 3, "The data should include all three books.")
         titles = [book['title'] for book in data3]
@@ -73,3 +70,21 @@ class BookListCacheTest(TestCase):
         self.assertNotEqual(data3,
                             data,
                             "The data should be updated and not equal to the previous data.")
+
+    def test_books_list_cached_per_query_and_accept(self):
+        """
+        Test that requests differing by query parameters or media type get their own entry,
+        while the order of query parameters does not matter.
+        """
+        self.get_books(f'{self.books_url}?a=1&b=2')
+        _, num_queries = self.get_books(f'{self.books_url}?b=2&a=1')
+        self.assertEqual(num_queries, 0)
+
+        _, num_queries = self.get_books(f'{self.books_url}?a=2&b=2')
+        self.assertGreater(num_queries, 0)
+
+        response, num_queries = self.get_books(HTTP_ACCEPT='text/html')
+        self.assertGreater(num_queries, 0)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        json_response, _ = self.get_books(HTTP_ACCEPT='application/json')
+        self.assertTrue(json_response['Content-Type'].startswith('application/json'))
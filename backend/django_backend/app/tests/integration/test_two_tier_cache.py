@@ -0,0 +1,84 @@
+import time
+from unittest.mock import patch
+from django.conf import settings
+from django.test import SimpleTestCase
+from services.two_tier_cache import LocalLRUCache, LocalTier, TwoTierRedisCache
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class LocalLRUCacheTest(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        l1 = LocalLRUCache(max_entries=2, timeout=30)
+        l1.set('a', 1)
+        l1.set('b', 2)
+        l1.get('a')
+        l1.set('c', 3)
+        self.assertEqual(l1.get('a'), 1)
+        self.assertIsNone(l1.get('b', None))
+        self.assertEqual(len(l1), 2)
+
+    def test_entry_expires(self):
+        l1 = LocalLRUCache(max_entries=2, timeout=0.05)
+        l1.set('a', 1)
+        time.sleep(0.1)
+        self.assertIsNone(l1.get('a', None))
+
+
+class TwoTierRedisCacheTest(SimpleTestCase):
+    def setUp(self):
+        params = dict(settings.CACHES['default'])
+        params['OPTIONS'] = dict(params.get('OPTIONS', {}),
+                                 L1_KEY_PREFIXES=['two_tier_test'],
+                                 INVALIDATION_CHANNEL='two_tier_test_channel')
+        self.cache = TwoTierRedisCache(params['LOCATION'], params)
+        # A second worker process is simulated by a cache with its own local tier
+        self.other_worker = TwoTierRedisCache(params['LOCATION'], params)
+        self.other_worker._tier = LocalTier('two_tier_test_channel', 16, 30,
+                                            self.other_worker._tier.get_client)
+        self.other_worker._l1 = self.other_worker._tier.cache
+        self.assertTrue(wait_for(self.cache._tier.is_ready))
+        self.assertTrue(wait_for(self.other_worker._tier.is_ready))
+        self.cache.delete_many(['two_tier_test_key', 'other_key'])
+
+    def test_hit_is_served_from_l1(self):
+        self.cache.set('two_tier_test_key', {'books': [1, 2]})
+        before = self.cache.stats()['l1_hits']
+        self.assertEqual(self.cache.get('two_tier_test_key'), {'books': [1, 2]})
+        self.assertEqual(self.cache.stats()['l1_hits'], before + 1)
+
+    def test_l2_hit_populates_l1(self):
+        self.other_worker.set('two_tier_test_key', 'value')
+        self.assertTrue(wait_for(
+            lambda: self.cache._l1.get(self.cache.make_key('two_tier_test_key'), None) is None))
+        stats = self.cache.stats()
+        self.assertEqual(self.cache.get('two_tier_test_key'), 'value')
+        self.assertEqual(self.cache.stats()['l2_hits'], stats['l2_hits'] + 1)
+        self.assertEqual(self.cache.get('two_tier_test_key'), 'value')
+        self.assertEqual(self.cache.stats()['l1_hits'], stats['l1_hits'] + 1)
+
+    def test_delete_in_other_worker_invalidates_l1(self):
+        self.cache.set('two_tier_test_key', 'stale')
+        self.assertEqual(self.cache.get('two_tier_test_key'), 'stale')
+        self.other_worker.delete('two_tier_test_key')
+        self.assertTrue(wait_for(lambda: self.cache.get('two_tier_test_key') is None))
+
+    def test_keys_outside_prefixes_skip_l1(self):
+        self.cache.set('other_key', 'value')
+        self.assertIsNone(self.cache._l1.get(self.cache.make_key('other_key'), None))
+        self.assertEqual(self.cache.get('other_key'), 'value')
+
+    def test_writes_outside_prefixes_are_not_published(self):
+        with patch.object(self.cache._tier, 'publish') as publish:
+            self.cache.set('other_key', 'value')
+            self.cache.delete_many(['other_key'])
+            publish.assert_not_called()
+            self.cache.set_many({'two_tier_test_key': 'value', 'other_key': 'value'})
+        publish.assert_called_once_with([self.cache.make_key('two_tier_test_key')])
@@ -0,0 +1,91 @@
+from unittest.mock import patch
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from django.contrib.auth.models import User
+from app.middleware import EndpointClassState, admission_controller
+from app.models import Book
+
+EXTERNAL = {'max_in_flight': 2, 'min_in_flight': 1, 'target_latency': 1.0}
+
+
+@override_settings(ADMISSION_CONTROL_CLASSES={'external': EXTERNAL})
+@patch('app.views.AvailabilityService')
+class AdmissionControlMiddlewareTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        admission_controller.reset()
+        self.addCleanup(admission_controller.reset)
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.book = Book.objects.create(
+            title='Test Book',
+            author='Author A',
+            isbn='1234567890123',
+            count_in_library=5,
+            library='Main Library'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.check_url = reverse('book-check-availability', args=[self.book.book_id])
+
+    def mock_availability(self, mock_availability_service):
+        mock_availability_service.return_value.check_book_availability.return_value = {
+            'availability': {}, 'partial': [], 'providers': {'flask': 'ok'}}
+
+    def test_request_is_admitted_and_released(self, mock_availability_service):
+        self.mock_availability(mock_availability_service)
+        response = self.client.get(self.check_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        state = admission_controller.get_state('external')
+        self.assertEqual(state.in_flight, 0)
+        self.assertEqual(state.admitted, 1)
+        self.assertIsNotNone(state.latency)
+
+    def test_excess_expensive_requests_are_shed(self, mock_availability_service):
+        state = admission_controller.get_state('external')
+        state.in_flight = EXTERNAL['max_in_flight']
+        state.latency = 2.5
+
+        response = self.client.get(self.check_url)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '3')
+        response = self.client.post(reverse('reserve_book'), {'book_id': self.book.book_id},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        mock_availability_service.return_value.check_book_availability.assert_not_called()
+        self.assertEqual(state.shed, 2)
+
+        # Cheap endpoints are still served
+        self.assertEqual(self.client.get(reverse('book-list')).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(reverse('user_reservations')).status_code,
+                         status.HTTP_200_OK)
+
+    def test_slot_is_released_after_view_error(self, mock_availability_service):
+        check_book_availability = mock_availability_service.return_value.check_book_availability
+        check_book_availability.side_effect = ValueError('boom')
+        self.client.get(self.check_url)
+        self.assertEqual(admission_controller.get_state('external').in_flight, 0)
+
+
+class EndpointClassStateTest(TestCase):
+    def test_limit_shrinks_with_latency_above_target(self):
+        config = {'max_in_flight': 32, 'min_in_flight': 2, 'target_latency': 1.0}
+        state = EndpointClassState()
+        self.assertEqual(state.concurrency_limit(config), 32)
+        state.latency = 0.5
+        self.assertEqual(state.concurrency_limit(config), 32)
+        state.latency = 4.0
+        self.assertEqual(state.concurrency_limit(config), 8)
+        state.latency = 100.0
+        self.assertEqual(state.concurrency_limit(config), 2)
+
+    def test_latency_is_smoothed(self):
+        state = EndpointClassState()
+        state.in_flight = 2
+        state.release(1.0, 0.5)
+        state.release(3.0, 0.5)
+        self.assertEqual(state.in_flight, 0)
+        self.assertAlmostEqual(state.latency, 2.0)
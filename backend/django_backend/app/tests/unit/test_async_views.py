@@ -0,0 +1,117 @@
+from datetime import timedelta
+from unittest.mock import AsyncMock, patch
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from app.models import Book, Reservation
+
+EXTERNAL_AVAILABILITY = {
+    'availability': {
+        'flask:3': {'provider': 'flask', 'book_id': '3',
+                    'library': 'External Library', 'count_in_library': 2},
+    },
+    'partial': [],
+    'providers': {'flask': 'ok'},
+}
+
+
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.book = Book.objects.create(title='Test Book', author='Author A', isbn='1234567890123',
+                                        count_in_library=2, library='Main Library')
+        self.other_copy = Book.objects.create(title='Test Book', author='Author A',
+                                              isbn='1234567890123', count_in_library=0,
+                                              library='Branch Library')
+        Book.objects.create(title='Other Book', author='Author B', isbn='9876543210987',
+                            count_in_library=1, library='Main Library')
+        self.sync_client = APIClient()
+        self.auth_header = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    async def test_book_list_matches_sync_view(self):
+        response = await self.async_client.get(reverse('async-book-list'))
+        self.assertEqual(response.status_code, 200)
+        expected = await self.sync_get(reverse('book-list'))
+        self.assertEqual(response.json(), expected)
+
+    async def test_search_by_isbn_matches_sync_view(self):
+        response = await self.async_client.get(reverse('async-book-search-by-isbn'),
+                                               {'isbn': self.book.isbn})
+        self.assertEqual(response.status_code, 200)
+        expected = await self.sync_get(reverse('book-search-by-isbn'), {'isbn': self.book.isbn})
+        self.assertEqual(response.json(), expected)
+        self.assertEqual(len(response.json()), 2)
+
+        response = await self.async_client.get(reverse('async-book-search-by-isbn'))
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.get(reverse('async-book-search-by-isbn'), {'isbn': '0'})
+        self.assertEqual(response.json(), {'error': 'No books found with provided ISBN'})
+
+    @patch('app.async_views.AvailabilityService')
+    async def test_check_availability(self, mock_availability_service):
+        mock_availability_service.return_value.acheck_book_availability = AsyncMock(
+            return_value=EXTERNAL_AVAILABILITY)
+        response = await self.async_client.get(
+            reverse('async-book-check-availability', args=[self.book.book_id]))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['isbn'], self.book.isbn)
+        self.assertEqual(data['external_availability'], EXTERNAL_AVAILABILITY['availability'])
+        self.assertEqual(data['external_availability_partial'], [])
+        self.assertEqual(
+            [entry['library'] for entry in data['local_library_network_availability']],
+            ['Main Library', 'Branch Library'])
+        self.assertEqual(data['local_library_network_summary']['total_copies'], 2)
+
+        # Served from the cache shared with the sync view
+        await self.async_client.get(
+            reverse('async-book-check-availability', args=[self.book.book_id]))
+        mock_availability_service.return_value.acheck_book_availability.assert_awaited_once_with(
+            self.book.isbn)
+
+    @override_settings(DATABASE_REPLICAS=['replica_test'])
+    @patch('app.async_views.is_pinned_to_primary', return_value=True)
+    @patch('app.async_views.AvailabilityService')
+    async def test_check_availability_reads_own_writes(self, mock_availability_service,
+                                                       mock_is_pinned):
+        """A user who just reserved or returned a book reads from the primary"""
+        mock_availability_service.return_value.acheck_book_availability = AsyncMock(
+            return_value=EXTERNAL_AVAILABILITY)
+        response = await self.async_client.get(
+            reverse('async-book-check-availability', args=[self.book.book_id]),
+            headers=self.auth_header)
+        self.assertEqual(response.status_code, 200)
+        mock_is_pinned.assert_called_once_with('books', f'user_{self.user.pk}')
+
+    async def test_check_availability_of_missing_book(self):
+        response = await self.async_client.get(reverse('async-book-check-availability', args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_reservations_need_a_valid_token(self):
+        response = await self.async_client.get(reverse('async_user_reservations'))
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get(reverse('async_user_reservations'),
+                                               headers={'Authorization': 'Bearer invalid'})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_reservations_match_sync_view(self):
+        await Reservation.objects.acreate(user=self.user, book=self.book,
+                                          reserved_until=timezone.now() + timedelta(days=30))
+        response = await self.async_client.get(reverse('async_user_reservations'),
+                                               headers=self.auth_header)
+        self.assertEqual(response.status_code, 200)
+        expected = await self.sync_get(reverse('user_reservations'), user=self.user)
+        self.assertEqual(response.json(), expected)
+        self.assertEqual(response.json()[0]['user'], 'testuser')
+
+    async def sync_get(self, url, params=None, user=None):
+        def get():
+            self.sync_client.force_authenticate(user=user)
+            return self.sync_client.get(url, params).json()
+        return await sync_to_async(get)()
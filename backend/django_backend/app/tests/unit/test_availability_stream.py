@@ -0,0 +1,62 @@
+from unittest.mock import patch
+from django.test import TestCase
+from django.urls import reverse
+from app.models import Book
+from services.availability_events import AvailabilityEventHub, availability_hub
+
+
+@patch.object(AvailabilityEventHub, '_ensure_listener')
+class AvailabilityStreamTest(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(
+            title='Test Book',
+            author='Author A',
+            isbn='1234567890123',
+            count_in_library=5,
+            library='Main Library'
+        )
+
+    async def test_stream_sends_snapshot_and_changes(self, mock_ensure_listener):
+        response = await self.async_client.get(reverse('availability_stream'),
+                                               {'isbns': '1234567890123,3213213213213'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+
+        self.assertIn(b'"total_copies": 5', await anext(stream))
+        self.assertIn(b'"isbn": "3213213213213", "total_copies": 0', await anext(stream))
+
+        availability_hub.dispatch({'isbn': '9999999999999', 'total_copies': 1})
+        availability_hub.dispatch({'isbn': '1234567890123', 'total_copies': 4})
+        event = await anext(stream)
+        self.assertTrue(event.startswith(b'event: availability\ndata: '))
+        self.assertIn(b'"total_copies": 4', event)
+        await stream.aclose()
+
+    async def test_isbns_are_required(self, mock_ensure_listener):
+        response = await self.async_client.get(reverse('availability_stream'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_stock_change_is_published_after_commit(self, mock_ensure_listener):
+        book = Book.objects.get(pk=self.book.pk)
+        book.count_in_library -= 1
+        with patch('app.signals.publish_events') as mock_publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                book.save()
+                mock_publish.assert_not_called()
+        events = mock_publish.call_args.args[0]
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['isbn'], '1234567890123')
+        self.assertEqual(events[0]['total_copies'], 4)
+
+
+class AvailabilityEventHubTest(TestCase):
+    async def test_slow_client_loses_oldest_events(self):
+        hub = AvailabilityEventHub(queue_size=2)
+        with patch.object(hub, '_ensure_listener'):
+            async with hub.subscribe(['1']) as queue:
+                for copies in range(3):
+                    hub.dispatch({'isbn': '1', 'total_copies': copies})
+                self.assertEqual([queue.get_nowait()['total_copies'] for _ in range(2)], [1, 2])
+                self.assertEqual(hub.connections, 1)
+        self.assertEqual(hub.connections, 0)
@@ -0,0 +1,164 @@
+import time
+import asyncio
+import aiohttp
+from unittest.mock import patch
+from django.conf import settings
+from django.test import SimpleTestCase
+from requests.exceptions import ConnectionError, RequestException
+from services.book_availability_service import AvailabilityService, get_provider_session
+
+PROVIDERS = {
+    'flask': {'base_url': 'http://flask:5000', 'timeout': 0.5},
+    'partner': {'base_url': 'http://partner:5000/', 'timeout': 0.1},
+}
+
+
+def fake_fetch(responses, delays=None):
+    def fetch(provider, isbn):
+        time.sleep((delays or {}).get(provider.name, 0))
+        response = responses[provider.name]
+        if isinstance(response, Exception):
+            raise response
+        return response
+    return fetch
+
+
+class FederatedAvailabilityTest(SimpleTestCase):
+    def setUp(self):
+        self.service = AvailabilityService(providers=PROVIDERS)
+
+    def check(self, responses, delays=None):
+        with patch.object(self.service, '_fetch_provider_availability',
+                          side_effect=fake_fetch(responses, delays)):
+            return self.service.check_book_availability('1234567890123')
+
+    def test_results_of_all_providers_are_merged(self):
+        result = self.check({
+            'flask': {'1': {'library': 'Library A', 'count_in_library': 2},
+                      '2': {'library': 'Library B', 'count_in_library': 0}},
+            'partner': {'1': {'library': 'Partner Library', 'count_in_library': 1}},
+        })
+        self.assertEqual(result['availability'], {
+            'flask:1': {'provider': 'flask', 'book_id': '1',
+                        'library': 'Library A', 'count_in_library': 2},
+            'partner:1': {'provider': 'partner', 'book_id': '1',
+                          'library': 'Partner Library', 'count_in_library': 1},
+        })
+        self.assertEqual(result['partial'], [])
+        self.assertEqual(result['providers'], {'flask': 'ok', 'partner': 'ok'})
+
+    def test_late_provider_is_marked_partial(self):
+        started = time.monotonic()
+        result = self.check({
+            'flask': {'1': {'library': 'Library A', 'count_in_library': 2}},
+            'partner': {'1': {'library': 'Partner Library', 'count_in_library': 1}},
+        }, delays={'partner': 0.3})
+        # The partner's 0.1s deadline does not wait for its 0.3s answer
+        self.assertLess(time.monotonic() - started, 0.3)
+        self.assertEqual(list(result['availability']), ['flask:1'])
+        self.assertEqual(result['partial'], ['partner'])
+        self.assertEqual(result['providers']['partner'], 'timeout')
+
+    def test_failing_provider_is_marked_partial(self):
+        result = self.check({
+            'flask': ConnectionError('down'),
+            'partner': {'1': {'library': 'Partner Library', 'count_in_library': 1}},
+        })
+        self.assertEqual(list(result['availability']), ['partner:1'])
+        self.assertEqual(result['providers']['flask'], 'error')
+
+    def test_error_when_no_provider_answers(self):
+        with self.assertRaises(RequestException):
+            self.check({'flask': ConnectionError('down'), 'partner': ConnectionError('down')})
+
+    def test_reserve_uses_provider_base_url(self):
+        with patch.object(self.service.session, 'post') as mock_post:
+            mock_post.return_value.json.return_value = {
+                'message': 'Book with id 1 reserved successfully'}
+            self.assertTrue(
+                self.service.reserve_book_external_api('1', 'token', provider='partner'))
+        mock_post.assert_called_once_with('http://partner:5000/book_reserved_external',
+                                          json={'book_id': '1'}, timeout=5, headers={})
+
+    def test_reserve_and_release_send_idempotency_key(self):
+        with patch.object(self.service.single_attempt_session, 'post') as mock_post:
+            mock_post.return_value.json.return_value = {
+                'message': 'Book with id 1 reserved successfully'}
+            self.assertTrue(self.service.reserve_book_external_api(
+                '1', 'token', provider='partner', retry=False, idempotency_key='key-1'))
+        self.assertEqual(mock_post.call_args.kwargs['headers'], {'Idempotency-Key': 'key-1'})
+        with patch.object(self.service.session, 'post') as mock_post:
+            mock_post.return_value.json.return_value = {
+                'message': 'Book with id 1 released successfully'}
+            self.assertTrue(self.service.release_book_external_api(
+                '1', 'token', provider='partner', idempotency_key='key-1'))
+        mock_post.assert_called_once_with('http://partner:5000/book_released_external',
+                                          json={'book_id': '1'}, timeout=5,
+                                          headers={'Idempotency-Key': 'key-1'})
+
+    def test_bulk_reserve_sends_a_key_per_book(self):
+        with patch.object(self.service.single_attempt_session, 'post') as mock_post:
+            mock_post.return_value.json.return_value = {'results': {'1': True, '2': False}}
+            self.assertEqual(self.service.reserve_books_external_api(
+                ['1', '2'], 'token', provider='partner', idempotency_keys=['key-1', 'key-2']),
+                {'1': True, '2': False})
+        self.assertEqual(mock_post.call_args.kwargs['json'],
+                         {'book_ids': [1, 2], 'idempotency_keys': ['key-1', 'key-2']})
+
+    def test_unknown_provider(self):
+        with self.assertRaises(ValueError):
+            self.service.reserve_book_external_api('1', 'token', provider='unknown')
+
+    def test_provider_session_is_pooled(self):
+        session = get_provider_session('partner')
+        self.assertIs(get_provider_session('partner'), session)
+        self.assertIsNot(get_provider_session('flask'), session)
+        adapter = session.get_adapter('http://partner:5000/books/1/availability')
+        self.assertEqual(adapter._pool_maxsize, settings.EXTERNAL_PROVIDERS_MAX_WORKERS)
+
+
+def fake_afetch(responses, delays=None):
+    async def fetch(session, provider, isbn):
+        await asyncio.sleep((delays or {}).get(provider.name, 0))
+        response = responses[provider.name]
+        if isinstance(response, Exception):
+            raise response
+        return response
+    return fetch
+
+
+class AsyncFederatedAvailabilityTest(SimpleTestCase):
+    def setUp(self):
+        self.service = AvailabilityService(providers=PROVIDERS)
+
+    def check(self, responses, delays=None):
+        with patch.object(self.service, '_afetch_provider_availability',
+                          side_effect=fake_afetch(responses, delays)):
+            return asyncio.run(self.service.acheck_book_availability('1234567890123'))
+
+    def test_late_provider_is_cancelled_and_marked_partial(self):
+        started = time.monotonic()
+        result = self.check({
+            'flask': {'1': {'library': 'Library A', 'count_in_library': 2}},
+            'partner': {'1': {'library': 'Partner Library', 'count_in_library': 1}},
+        }, delays={'partner': 0.3})
+        self.assertLess(time.monotonic() - started, 0.3)
+        self.assertEqual(result['availability'], {
+            'flask:1': {'provider': 'flask', 'book_id': '1',
+                        'library': 'Library A', 'count_in_library': 2},
+        })
+        self.assertEqual(result['partial'], ['partner'])
+        self.assertEqual(result['providers'], {'flask': 'ok', 'partner': 'timeout'})
+
+    def test_failing_provider_is_marked_partial(self):
+        result = self.check({
+            'flask': aiohttp.ClientConnectionError('down'),
+            'partner': {'1': {'library': 'Partner Library', 'count_in_library': 1}},
+        })
+        self.assertEqual(list(result['availability']), ['partner:1'])
+        self.assertEqual(result['providers']['flask'], 'error')
+
+    def test_error_when_no_provider_answers(self):
+        with self.assertRaises(RequestException):
+            self.check({'flask': aiohttp.ClientConnectionError('down'),
+                        'partner': aiohttp.ClientConnectionError('down')})
@@ -0,0 +1,101 @@
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from app.models import Book, IsbnAvailability, Reservation
+
+
+class BulkReservationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.books = [
+            Book.objects.create(title=f'Book {i}', author='Author A', isbn=f'{i:013d}',
+                                count_in_library=2, library='Main Library')
+            for i in range(1, 4)
+        ]
+        self.out_of_stock = [
+            Book.objects.create(title=f'Rare Book {i}', author='Author B', isbn=f'9{i:012d}',
+                                count_in_library=0, library='Main Library')
+            for i in range(1, 3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer testtoken')
+        self.url = reverse('reserve_books_bulk')
+
+    def reserve(self, book_ids):
+        return self.client.post(self.url, {'book_ids': book_ids}, format='json')
+
+    def test_reserves_local_books(self):
+        book_ids = [book.book_id for book in self.books]
+        response = self.reserve(book_ids + [book_ids[0]])
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        results = response.data['results']
+        self.assertEqual([result['book_id'] for result in results], book_ids)
+        self.assertTrue(all(result['reserved'] for result in results))
+        reservations = Reservation.objects.filter(user=self.user)
+        self.assertEqual(sorted(reservations.values_list('reservation_id', flat=True)),
+                         sorted(result['reservation_id'] for result in results))
+        for book in self.books:
+            book.refresh_from_db()
+            self.assertEqual(book.count_in_library, 1)
+            self.assertEqual(IsbnAvailability.objects.get(isbn=book.isbn).total_copies, 1)
+
+    def test_reports_each_book(self):
+        response = self.reserve([self.books[0].book_id, 99999])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        first, missing = response.data['results']
+        self.assertTrue(first['reserved'])
+        self.assertFalse(missing['reserved'])
+        self.assertEqual(missing['detail'], 'Book does not exist')
+
+    def test_nothing_reserved(self):
+        response = self.reserve([99998, 99999])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Reservation.objects.count(), 0)
+
+    @patch('app.views.AvailabilityService')
+    def test_external_books_are_reserved_in_one_batch(self, mock_availability_service):
+        mock_service = mock_availability_service.return_value
+        external_ids = {self.out_of_stock[0].isbn: '7', self.out_of_stock[1].isbn: '8'}
+        mock_service.check_book_availability.side_effect = lambda isbn: {
+            'availability': {f'flask:{external_ids[isbn]}': {
+                'provider': 'flask', 'book_id': external_ids[isbn],
+                'library': 'External Library', 'count_in_library': 1}},
+            'partial': [],
+            'providers': {'flask': 'ok'},
+        }
+        mock_service.reserve_books_external_api.return_value = {'7': True, '8': False}
+
+        response = self.reserve([book.book_id for book in self.out_of_stock]
+                                + [self.books[0].book_id])
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        mock_service.reserve_books_external_api.assert_called_once()
+        self.assertEqual(sorted(mock_service.reserve_books_external_api.call_args.args[0]),
+                         ['7', '8'])
+        rare, rejected, local = response.data['results']
+        self.assertTrue(rare['reserved'])
+        self.assertTrue(rare['is_external'])
+        self.assertEqual(rare['reservation_library'], 'External Library')
+        self.assertFalse(rejected['reserved'])
+        self.assertEqual(rejected['detail'], 'External library rejected the reservation')
+        self.assertTrue(local['reserved'])
+        self.assertEqual(Reservation.objects.filter(is_external=True).count(), 1)
+
+        # Every copy is reserved with its own key, kept for its release
+        call = mock_service.reserve_books_external_api.call_args
+        keys = dict(zip(call.args[0], call.kwargs['idempotency_keys']))
+        self.assertEqual(len(set(keys.values())), 2)
+        reservation = Reservation.objects.get(is_external=True)
+        self.assertEqual(reservation.external_request_key, keys['7'])
+
+    def test_too_many_books(self):
+        response = self.reserve(list(range(1, 30)))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('book_ids', response.data)
@@ -0,0 +1,160 @@
+import time
+import hashlib
+import threading
+from unittest.mock import patch
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+from app.utils import (
+    acquire_lock,
+    cache_api_view,
+    invalidate_cached_view,
+    release_lock,
+    request_cache_key,
+)
+
+CACHE_KEY = 'test_cached_view'
+VARIANT_KEY = f"{CACHE_KEY}:{hashlib.sha256(b'fixed').hexdigest()}"
+
+
+def cached_entry(calls, expires_in=60, delta=0.1):
+    return {
+        'content': f'{{"calls":{calls}}}'.encode(),
+        'status': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'generation': None,
+        'expires_at': time.time() + expires_in,
+        'delta': delta,
+    }
+
+
+class CachedView(APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    delay = 0
+    calls = 0
+    lock = threading.Lock()
+
+    @cache_api_view(CACHE_KEY, 60, key_func=lambda request: 'fixed')
+    def get(self, request):
+        with self.lock:
+            CachedView.calls += 1
+            calls = CachedView.calls
+        time.sleep(self.delay)
+        return Response({'calls': calls})
+
+
+class VaryingView(CachedView):
+    @cache_api_view(CACHE_KEY, 60, key_func=request_cache_key(accept=False))
+    def get(self, request):
+        CachedView.calls += 1
+        return Response({'calls': CachedView.calls, 'page': request.query_params.get('page')})
+
+
+class CacheApiViewStampedeTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        CachedView.calls = 0
+        CachedView.delay = 0
+        self.factory = APIRequestFactory()
+        self.view = CachedView.as_view()
+
+    def get(self, view=None, path='/cached/'):
+        response = (view or self.view)(self.factory.get(path))
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_concurrent_misses_rebuild_once(self):
+        CachedView.delay = 0.2
+        responses = []
+
+        def get():
+            responses.append(self.get())
+
+        threads = [threading.Thread(target=get) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(CachedView.calls, 1)
+        self.assertEqual([response.content for response in responses], [b'{"calls":1}'] * 8)
+
+    def test_previous_value_is_served_during_rebuild(self):
+        cache.set(VARIANT_KEY, cached_entry(0, expires_in=-1))
+        cache.add(f'lock:{VARIANT_KEY}', True)
+
+        self.assertEqual(self.get().content, b'{"calls":0}')
+        self.assertEqual(CachedView.calls, 0)
+
+    def test_waits_for_rebuild_of_another_request(self):
+        cache.add(f'lock:{VARIANT_KEY}', True)
+        threading.Timer(0.1, cache.set, (VARIANT_KEY, cached_entry(0))).start()
+
+        self.assertEqual(self.get().content, b'{"calls":0}')
+        self.assertEqual(CachedView.calls, 0)
+
+    def test_expensive_entry_is_refreshed_before_expiry(self):
+        cache.set(VARIANT_KEY, cached_entry(0, expires_in=30, delta=10))
+
+        with patch('app.utils.random.random', return_value=0.5):
+            self.assertEqual(self.get().content, b'{"calls":0}')
+        with patch('app.utils.random.random', return_value=0.999):
+            self.assertEqual(self.get().content, b'{"calls":1}')
+        self.assertEqual(cache.get(VARIANT_KEY)['content'], b'{"calls":1}')
+        self.assertIsNone(cache.get(f'lock:{VARIANT_KEY}'))
+
+    def test_lock_is_only_released_by_its_owner(self):
+        lock_key = f'lock:{VARIANT_KEY}'
+        token = acquire_lock(lock_key, 30)
+        self.assertIsNotNone(token)
+        self.assertIsNone(acquire_lock(lock_key, 30))
+        # e.g. a request whose lock expired while this one held it
+        release_lock(lock_key, 'expired-token')
+        self.assertIsNone(acquire_lock(lock_key, 30))
+        release_lock(lock_key, token)
+        self.assertIsNotNone(acquire_lock(lock_key, 30))
+
+
+class CacheApiViewVariantsTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        CachedView.calls = 0
+        self.factory = APIRequestFactory()
+        self.view = VaryingView.as_view()
+
+    def get(self, path):
+        response = self.view(self.factory.get(path))
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_hit_returns_stored_bytes_and_headers(self):
+        first = self.get('/cached/?page=1')
+        second = self.get('/cached/?page=1')
+
+        self.assertEqual(CachedView.calls, 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], first['Content-Type'])
+
+    def test_query_params_are_part_of_the_key(self):
+        self.get('/cached/?page=1&size=10')
+        self.get('/cached/?size=10&page=1')
+        self.assertEqual(CachedView.calls, 1)
+
+        self.assertEqual(self.get('/cached/?page=2&size=10').content, b'{"calls":2,"page":"2"}')
+
+    def test_invalidation_drops_all_variants(self):
+        self.get('/cached/?page=1')
+        self.get('/cached/?page=2')
+        invalidate_cached_view(CACHE_KEY)
+
+        self.get('/cached/?page=1')
+        self.get('/cached/?page=2')
+        self.assertEqual(CachedView.calls, 4)
+        self.get('/cached/?page=1')
+        self.assertEqual(CachedView.calls, 4)
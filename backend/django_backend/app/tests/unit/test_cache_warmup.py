@@ -0,0 +1,99 @@
+import time
+from io import StringIO
+from datetime import timedelta
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from requests.exceptions import ConnectionError
+from rest_framework.test import APIClient
+from app.models import Book, Reservation
+from app.tasks import top_reserved_isbns, warm_caches, warm_invalidated_caches
+from app.utils import CACHE_WARMUP_PENDING_KEY, external_availability_cache_key
+
+AVAILABILITY = {'availability': {}, 'partial': [], 'providers': {'flask': 'ok'}}
+
+
+@override_settings(CACHE_WARMUP_AVAILABILITY_RATE=1000)
+@patch('app.tasks.AvailabilityService')
+class CacheWarmupTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.books = [
+            Book.objects.create(title=f'Book {i}', author='Author', isbn=f'{i}' * 13,
+                                count_in_library=1, library='Main Library')
+            for i in range(1, 4)
+        ]
+        self.client = APIClient()
+
+    def reserve(self, book, times, days_ago=0):
+        for _ in range(times):
+            reservation = Reservation.objects.create(
+                user=self.user, book=book, reserved_until=timezone.now() + timedelta(days=7))
+            Reservation.objects.filter(pk=reservation.pk).update(
+                reserved_at=timezone.now() - timedelta(days=days_ago))
+
+    def assert_catalog_cached(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 0)
+
+    def test_catalog_is_served_from_cache_after_warmup(self, mock_availability_service):
+        self.assertEqual(warm_caches(availability=False), {'catalog': ['book-list']})
+        self.assert_catalog_cached()
+
+    def test_most_reserved_isbns_are_fetched(self, mock_availability_service):
+        self.reserve(self.books[1], 3)
+        self.reserve(self.books[0], 2)
+        self.reserve(self.books[2], 5, days_ago=60)
+        self.assertEqual(top_reserved_isbns(2), [self.books[1].isbn, self.books[0].isbn])
+
+        mock_availability_service.return_value.check_book_availability.return_value = AVAILABILITY
+        self.assertEqual(warm_caches(catalog=False, top=1), {'availability': 1})
+        mock_availability_service.return_value.check_book_availability.assert_called_once_with(
+            self.books[1].isbn)
+        self.assertEqual(cache.get(external_availability_cache_key(self.books[1].isbn)),
+                         AVAILABILITY)
+
+    def test_failing_provider_does_not_stop_warmup(self, mock_availability_service):
+        self.reserve(self.books[0], 2)
+        self.reserve(self.books[1], 1)
+        mock_availability_service.return_value.check_book_availability.side_effect = [
+            ConnectionError('down'), AVAILABILITY]
+        self.assertEqual(warm_caches(catalog=False), {'availability': 1})
+
+    @override_settings(CACHE_WARMUP_AVAILABILITY_RATE=20)
+    def test_availability_fetches_are_rate_limited(self, mock_availability_service):
+        for book in self.books:
+            self.reserve(book, 1)
+        mock_availability_service.return_value.check_book_availability.return_value = AVAILABILITY
+        started = time.monotonic()
+        warm_caches(catalog=False)
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+    @override_settings(CACHE_WARMUP_DEBOUNCE_SECONDS=5)
+    def test_catalog_is_warmed_once_invalidations_stop(self, mock_availability_service):
+        Book.objects.create(title='Book 4', author='Author', isbn='4' * 13,
+                            count_in_library=1, library='Main Library')
+        self.assertFalse(warm_invalidated_caches())
+
+        cache.set(CACHE_WARMUP_PENDING_KEY, time.time() - 6, None)
+        self.assertTrue(warm_invalidated_caches())
+        self.assertIsNone(cache.get(CACHE_WARMUP_PENDING_KEY))
+        self.assert_catalog_cached()
+        self.assertFalse(warm_invalidated_caches())
+
+    def test_management_command(self, mock_availability_service):
+        call_command('warm_caches', '--no-availability', stdout=StringIO())
+        self.assert_catalog_cached()
+
+        with patch('app.management.commands.warm_caches.warm_caches.delay') as mock_delay:
+            call_command('warm_caches', '--async', '--top', '5', stdout=StringIO())
+        mock_delay.assert_called_once_with(catalog=True, availability=True, top=5)
@@ -0,0 +1,134 @@
+from contextlib import contextmanager
+from unittest.mock import patch
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+from django.contrib.auth.models import User
+from app.models import Book
+from django_backend.db_router import (
+    PrimaryReplicaRouter,
+    replica_reads,
+    replica_reads_enabled,
+    pin_to_primary,
+    is_pinned_to_primary,
+    )
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1', 'replica_2'])
+class PrimaryReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_go_to_primary_by_default(self):
+        """
+        Test that reads outside of read-only endpoints stay on the primary
+        """
+        self.assertEqual(self.router.db_for_read(Book), 'default')
+
+    def test_marked_reads_go_to_replica(self):
+        """
+        Test that reads marked as safe are routed to one of the replicas
+        """
+        with replica_reads():
+            self.assertIn(self.router.db_for_read(Book), ['replica_1', 'replica_2'])
+        self.assertFalse(replica_reads_enabled())
+
+    def test_writes_always_go_to_primary(self):
+        """
+        Test that writes go to the primary even inside read-only endpoints
+        """
+        with replica_reads():
+            self.assertEqual(self.router.db_for_write(Book), 'default')
+
+    def test_migrations_only_on_primary(self):
+        self.assertTrue(self.router.allow_migrate('default', 'app'))
+        self.assertFalse(self.router.allow_migrate('replica_1', 'app'))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas_configured(self):
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Book), 'default')
+
+
+@contextmanager
+def routed_reads():
+    """Collects the database aliases the router picks for reads."""
+    aliases = []
+    db_for_read = PrimaryReplicaRouter.db_for_read
+
+    def record(router, model, **hints):
+        alias = db_for_read(router, model, **hints)
+        aliases.append(alias)
+        return alias
+
+    with patch.object(PrimaryReplicaRouter, 'db_for_read', record):
+        yield aliases
+
+
+REPLICA = 'replica_test'
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA])
+class ReplicaReadViewTest(APITestCase):
+    """The replica alias is served by the connection of the test database, so reads
+    routed to it see the rows of the test transaction, while their querysets and
+    instances carry the alias the router picked.
+    """
+    def setUp(self):
+        connections[REPLICA] = connections[DEFAULT_DB_ALIAS]
+        self.addCleanup(connections.__delitem__, REPLICA)
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.book = Book.objects.create(
+            title='Test Book',
+            author='Author A',
+            isbn='1234567890123',
+            count_in_library=5,
+            library='Main Library'
+        )
+        cache.clear()  # drop the pin set by the Book signal
+        self.client = APIClient()
+
+    def test_marked_reads_use_replica_connection(self):
+        self.assertEqual(Book.objects.all().db, 'default')
+        with replica_reads():
+            self.assertEqual(Book.objects.all().db, REPLICA)
+            book = Book.objects.get(pk=self.book.pk)
+        self.assertEqual(book._state.db, REPLICA)
+        self.assertEqual(book.title, 'Test Book')
+
+    def test_safe_endpoint_reads_from_replica(self):
+        with routed_reads() as aliases:
+            response = self.client.get(reverse('book-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 1)
+        self.assertIn(REPLICA, aliases)
+        self.assertFalse(replica_reads_enabled())
+
+    def test_user_is_pinned_after_reservation(self):
+        """
+        Test that a user reads their own reservation from the primary
+        """
+        self.client.force_authenticate(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer testtoken')
+        response = self.client.post(reverse('reserve_book'),
+                                    {'book_id': self.book.book_id},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(is_pinned_to_primary(f'user_{self.user.pk}'))
+
+        with routed_reads() as aliases:
+            response = self.client.get(reverse('user_reservations'))
+        self.assertEqual(len(response.json()), 1)
+        self.assertTrue(aliases)
+        self.assertEqual(set(aliases), {'default'})
+
+    def test_catalog_is_pinned_after_book_change(self):
+        pin_to_primary('books')
+        with routed_reads() as aliases:
+            self.client.get(reverse('book-list'))
+        self.assertTrue(aliases)
+        self.assertEqual(set(aliases), {'default'})
@@ -0,0 +1,156 @@
+from datetime import timedelta
+from unittest.mock import patch, MagicMock, ANY
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+from requests.exceptions import ConnectionError, HTTPError, ReadTimeout
+from rest_framework_simplejwt.tokens import AccessToken
+from app.models import Book, Reservation
+from app.tasks import complete_external_reservation, release_external_hold
+
+
+class CompleteExternalReservationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.book = Book.objects.create(
+            title='Test Book',
+            author='Author A',
+            isbn='1234567890123',
+            count_in_library=0,
+            library='Main Library'
+        )
+        self.reservation = Reservation.objects.create(
+            user=self.user,
+            book=self.book,
+            reserved_until=timezone.now() + timedelta(days=30),
+            reservation_library='',
+            is_external=True,
+            external_status=Reservation.EXTERNAL_STATUS_PENDING
+        )
+        patcher = patch('app.tasks.AvailabilityService')
+        self.mock_service = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.mock_service.check_book_availability.return_value = self.availability()
+        self.mock_service.reserve_book_external_api.return_value = True
+
+    @staticmethod
+    def availability():
+        return {
+            'availability': {
+                'flask:7': {'provider': 'flask', 'book_id': '7',
+                            'library': 'External Library', 'count_in_library': 2},
+            },
+            'partial': [],
+            'providers': {'flask': 'ok'},
+        }
+
+    def run_task(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return complete_external_reservation.apply(
+                args=[self.reservation.reservation_id]).get()
+
+    def assert_release_queued(self, mock_release):
+        mock_release.assert_called_once_with(
+            self.user.id, 'flask', '7', str(self.reservation.external_request_key))
+
+    def test_confirms_reservation(self):
+        self.assertEqual(self.run_task(), Reservation.EXTERNAL_STATUS_CONFIRMED)
+        self.reservation.refresh_from_db()
+        self.assertEqual(self.reservation.external_status, Reservation.EXTERNAL_STATUS_CONFIRMED)
+        self.assertEqual(self.reservation.reservation_library, 'External Library')
+        self.assertEqual(self.reservation.external_provider, 'flask')
+        self.assertEqual(self.reservation.external_book_id, '7')
+        self.assertTrue(self.reservation.reservation_status)
+        self.mock_service.reserve_book_external_api.assert_called_once_with(
+            '7', ANY, provider='flask', timeout=ANY, retry=False,
+            idempotency_key=str(self.reservation.external_request_key))
+        # A token of the reservation's user, not one passed through the broker
+        token = self.mock_service.reserve_book_external_api.call_args.args[1]
+        self.assertEqual(AccessToken(token)['user_id'], self.user.id)
+
+    def test_fails_when_not_available(self):
+        self.mock_service.check_book_availability.return_value = {
+            'availability': {}, 'partial': [], 'providers': {'flask': 'ok'}}
+        self.assertEqual(self.run_task(), Reservation.EXTERNAL_STATUS_FAILED)
+        self.reservation.refresh_from_db()
+        self.assertEqual(self.reservation.external_status, Reservation.EXTERNAL_STATUS_FAILED)
+        self.assertFalse(self.reservation.reservation_status)
+        self.mock_service.reserve_book_external_api.assert_not_called()
+
+    @patch('app.tasks.release_external_hold.delay')
+    def test_fails_on_client_error(self, mock_release):
+        self.mock_service.reserve_book_external_api.side_effect = HTTPError(
+            response=MagicMock(status_code=400))
+        self.assertEqual(self.run_task(), Reservation.EXTERNAL_STATUS_FAILED)
+        self.reservation.refresh_from_db()
+        self.assertEqual(self.reservation.external_status, Reservation.EXTERNAL_STATUS_FAILED)
+        mock_release.assert_not_called()
+
+    def test_retries_on_network_error(self):
+        self.mock_service.check_book_availability.side_effect = [
+            ConnectionError('down'),
+            self.availability(),
+        ]
+        with patch('app.tasks.complete_external_reservation.retry',
+                   side_effect=complete_external_reservation.retry) as mock_retry:
+            self.assertEqual(self.run_task(), Reservation.EXTERNAL_STATUS_CONFIRMED)
+        self.assertEqual(mock_retry.call_args.kwargs['countdown'], 1)
+
+    @patch('app.tasks.release_external_hold.delay')
+    def test_ambiguous_reservation_is_released_not_retried(self, mock_release):
+        self.mock_service.reserve_book_external_api.side_effect = ReadTimeout('slow')
+        self.mock_service.release_book_external_api.side_effect = ConnectionError('down')
+        with patch('app.tasks.complete_external_reservation.retry') as mock_retry:
+            self.assertEqual(self.run_task(), Reservation.EXTERNAL_STATUS_FAILED)
+        mock_retry.assert_not_called()
+        self.mock_service.reserve_book_external_api.assert_called_once()
+        self.reservation.refresh_from_db()
+        self.assertFalse(self.reservation.reservation_status)
+        self.assert_release_queued(mock_release)
+
+    @patch('app.tasks.release_external_hold.delay')
+    def test_releases_copy_when_reservation_closed_meanwhile(self, mock_release):
+        def close_reservation(pk, token, **kwargs):
+            Reservation.objects.filter(pk=self.reservation.pk).update(reservation_status=False)
+            return True
+
+        self.mock_service.reserve_book_external_api.side_effect = close_reservation
+        self.assertEqual(self.run_task(), Reservation.EXTERNAL_STATUS_FAILED)
+        self.assert_release_queued(mock_release)
+
+    @patch('app.tasks.release_external_hold.delay')
+    def test_interrupted_run_is_released(self, mock_release):
+        Reservation.objects.filter(pk=self.reservation.pk).update(
+            external_provider='flask', external_book_id='7')
+        self.assertEqual(self.run_task(), Reservation.EXTERNAL_STATUS_FAILED)
+        self.mock_service.check_book_availability.assert_not_called()
+        self.assert_release_queued(mock_release)
+
+    def test_skips_completed_reservation(self):
+        Reservation.objects.filter(pk=self.reservation.pk).update(
+            external_status=Reservation.EXTERNAL_STATUS_CONFIRMED)
+        self.assertEqual(self.run_task(), Reservation.EXTERNAL_STATUS_CONFIRMED)
+        self.mock_service.check_book_availability.assert_not_called()
+
+
+class ReleaseExternalHoldTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password')
+        patcher = patch('app.tasks.AvailabilityService')
+        self.mock_service = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_keyed_release_is_retried(self):
+        self.mock_service.release_book_external_api.side_effect = [ConnectionError('down'), True]
+        with patch('app.tasks.release_external_hold.retry',
+                   side_effect=release_external_hold.retry) as mock_retry:
+            self.assertTrue(release_external_hold.apply(
+                args=[self.user.id, 'flask', '7', 'key-1']).get())
+        mock_retry.assert_called_once()
+        self.mock_service.release_book_external_api.assert_called_with(
+            '7', ANY, provider='flask', idempotency_key='key-1')
+
+    def test_release_without_key_is_not_retried(self):
+        self.mock_service.release_book_external_api.side_effect = ConnectionError('down')
+        self.assertFalse(release_external_hold.apply(args=[self.user.id, 'flask', '7']).get())
+        self.mock_service.release_book_external_api.assert_called_once()
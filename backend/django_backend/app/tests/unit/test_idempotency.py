@@ -0,0 +1,104 @@
+from datetime import timedelta
+from unittest.mock import patch
+from django.core.cache import cache
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+from django.contrib.auth.models import User
+from app.models import Book, Reservation
+
+
+class IdempotencyKeyTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.book = Book.objects.create(
+            title='Available Book',
+            author='Author A',
+            isbn='1111111111111',
+            count_in_library=5,
+            library='Main Library'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer testtoken')
+
+    def reserve(self, key, book_id=None):
+        return self.client.post(reverse('reserve_book'),
+                                {'book_id': book_id or self.book.book_id},
+                                format='json',
+                                HTTP_IDEMPOTENCY_KEY=key)
+
+    @patch('app.views.AvailabilityService')
+    def test_duplicate_reservation_is_replayed(self, mock_availability_service):
+        first = self.reserve('key-1')
+        second = self.reserve('key-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Reservation.objects.count(), 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.count_in_library, 4)
+        self.assertEqual(mock_availability_service.call_count, 1)
+
+    @patch('app.views.AvailabilityService')
+    def test_different_keys_are_separate_requests(self, mock_availability_service):
+        self.reserve('key-1')
+        response = self.reserve('key-2')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Reservation.objects.count(), 2)
+
+    @patch('app.views.AvailabilityService')
+    def test_key_reused_with_different_payload(self, mock_availability_service):
+        other_book = Book.objects.create(title='Other Book', author='Author B',
+                                         isbn='2222222222222', count_in_library=1)
+        self.reserve('key-1')
+        response = self.reserve('key-1', book_id=other_book.book_id)
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    @patch('app.views.AvailabilityService')
+    def test_keys_are_scoped_per_user(self, mock_availability_service):
+        self.reserve('key-1')
+        other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        self.client.force_authenticate(user=other_user)
+        response = self.reserve('key-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Reservation.objects.count(), 2)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+    @patch('app.views.AvailabilityService')
+    def test_concurrent_duplicate_is_rejected_after_lock_timeout(self, mock_availability_service):
+        with patch('app.utils.acquire_lock', return_value=None):
+            response = self.reserve('key-1')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Reservation.objects.count(), 0)
+
+    def test_duplicate_return_is_replayed(self):
+        reservation = Reservation.objects.create(
+            user=self.user,
+            book=self.book,
+            reserved_until=timezone.now() + timedelta(days=30)
+        )
+        data = {'reservation_id': reservation.reservation_id}
+        first = self.client.put(reverse('return_book'), data, format='json',
+                                HTTP_IDEMPOTENCY_KEY='return-1')
+        second = self.client.put(reverse('return_book'), data, format='json',
+                                 HTTP_IDEMPOTENCY_KEY='return-1')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.count_in_library, 6)
+
+    def test_error_response_is_replayed(self):
+        first = self.reserve('key-1', book_id=999)
+        second = self.reserve('key-1', book_id=999)
+        self.assertEqual(first.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(second.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
@@ -0,0 +1,129 @@
+from unittest.mock import MagicMock
+from django.test import SimpleTestCase, override_settings
+from requests.exceptions import ConnectionError, HTTPError, ReadTimeout
+from services.library_selection import (
+    AmbiguousReservationError,
+    LibraryStats,
+    library_stats,
+    rank_candidates,
+    reserve_with_failover,
+)
+
+
+def candidate(provider, library, count=2, book_id='1'):
+    return {'provider': provider, 'book_id': book_id, 'library': library,
+            'count_in_library': count}
+
+
+class RankCandidatesTest(SimpleTestCase):
+    def setUp(self):
+        self.stats = LibraryStats()
+
+    def ranked(self, *candidates):
+        return [c['library'] for c in rank_candidates(list(candidates), stats=self.stats)]
+
+    def test_faster_library_first(self):
+        self.stats.record('flask:Slow', 2.0, True)
+        self.stats.record('flask:Fast', 0.1, True)
+        self.assertEqual(self.ranked(candidate('flask', 'Slow'), candidate('flask', 'Fast')),
+                         ['Fast', 'Slow'])
+
+    def test_failing_library_last(self):
+        for ok in (True, False, False, False):
+            self.stats.record('flask:Flaky', 0.1, ok)
+        self.stats.record('flask:Steady', 0.3, True)
+        self.assertEqual(self.ranked(candidate('flask', 'Flaky'), candidate('flask', 'Steady')),
+                         ['Steady', 'Flaky'])
+
+    def test_more_stock_first_at_equal_latency(self):
+        self.assertEqual(
+            self.ranked(candidate('flask', 'Last copy', 1), candidate('flask', 'Many', 10)),
+            ['Many', 'Last copy'])
+
+    def test_provider_stats_without_library_samples(self):
+        self.stats.record('partner', 3.0, True)
+        self.stats.record('flask', 0.2, True)
+        self.assertEqual(self.ranked(candidate('partner', 'A'), candidate('flask', 'B')),
+                         ['B', 'A'])
+
+    @override_settings(LIBRARY_STATS_MAX_AGE=0)
+    def test_old_samples_are_ignored(self):
+        self.stats.record('flask:A', 1.0, False)
+        self.assertIsNone(self.stats.summary('flask:A'))
+
+
+class ReserveWithFailoverTest(SimpleTestCase):
+    def setUp(self):
+        library_stats.reset()
+        self.addCleanup(library_stats.reset)
+        self.service = MagicMock()
+        self.availability = {
+            'flask:1': candidate('flask', 'A', 5, '1'),
+            'partner:2': candidate('partner', 'B', 1, '2'),
+        }
+
+    def test_first_ranked_library(self):
+        self.service.reserve_book_external_api.return_value = True
+        reserved = reserve_with_failover(self.service, self.availability, 'token')
+        self.assertEqual(reserved['library'], 'A')
+        self.service.reserve_book_external_api.assert_called_once()
+
+    def test_fails_over_to_next_library(self):
+        self.service.reserve_book_external_api.side_effect = [ReadTimeout('slow'), True]
+        reserved = reserve_with_failover(self.service, self.availability, 'token',
+                                         idempotency_key='key-1')
+        self.assertEqual(reserved['library'], 'B')
+        # The timed out attempt may have taken a copy, it is given back first
+        self.service.release_book_external_api.assert_called_once_with(
+            '1', 'token', provider='flask', idempotency_key='key-1')
+        second = self.service.reserve_book_external_api.call_args_list[1]
+        self.assertEqual(second.args, ('2', 'token'))
+        self.assertEqual(second.kwargs['provider'], 'partner')
+        self.assertEqual(second.kwargs['idempotency_key'], 'key-1')
+        self.assertFalse(second.kwargs['retry'])
+        # The failure is remembered, A is tried after B next time
+        self.assertEqual(library_stats.summary('flask:A')[1], 1.0)
+        self.assertEqual([c['library'] for c in rank_candidates(list(self.availability.values()))],
+                         ['B', 'A'])
+
+    def test_all_libraries_rejected(self):
+        self.service.reserve_book_external_api.side_effect = [
+            False, HTTPError(response=MagicMock(status_code=400))]
+        self.assertIsNone(reserve_with_failover(self.service, self.availability, 'token'))
+        self.service.release_book_external_api.assert_not_called()
+
+    def test_network_error_is_raised_when_nothing_reserved(self):
+        self.service.reserve_book_external_api.side_effect = [ConnectionError('down'), False]
+        with self.assertRaises(ConnectionError):
+            reserve_with_failover(self.service, self.availability, 'token',
+                                  idempotency_key='key-1')
+
+    def test_ambiguous_failure_without_key_stops(self):
+        self.service.reserve_book_external_api.side_effect = [
+            HTTPError(response=MagicMock(status_code=502)), True]
+        with self.assertRaises(AmbiguousReservationError) as raised:
+            reserve_with_failover(self.service, self.availability, 'token')
+        self.assertEqual(raised.exception.candidate['library'], 'A')
+        self.service.reserve_book_external_api.assert_called_once()
+        self.service.release_book_external_api.assert_not_called()
+
+    def test_failed_release_stops(self):
+        self.service.reserve_book_external_api.side_effect = [ReadTimeout('slow'), True]
+        self.service.release_book_external_api.side_effect = ConnectionError('down')
+        with self.assertRaises(AmbiguousReservationError):
+            reserve_with_failover(self.service, self.availability, 'token',
+                                  idempotency_key='key-1')
+        self.service.reserve_book_external_api.assert_called_once()
+
+    def test_attempts_stay_within_budget(self):
+        self.service.reserve_book_external_api.side_effect = ReadTimeout('slow')
+        with self.assertRaises(ReadTimeout):
+            reserve_with_failover(self.service, self.availability, 'token', budget=0.5,
+                                  idempotency_key='key-1')
+        for call in self.service.reserve_book_external_api.call_args_list:
+            self.assertLessEqual(call.kwargs['timeout'], 0.5)
+
+    def test_missing_token(self):
+        with self.assertRaises(ValueError):
+            reserve_with_failover(self.service, self.availability, '')
+        self.service.reserve_book_external_api.assert_not_called()
@@ -0,0 +1,101 @@
+import threading
+from unittest.mock import patch, MagicMock
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from requests.exceptions import ConnectionError
+from rest_framework.test import APIClient
+from services.book_availability_service import AvailabilityService
+from services.metrics import SHARDS, MetricsRegistry, registry
+from app.tasks import check_reservation_deadlines
+
+
+class MetricsRegistryTest(TestCase):
+    def test_counter_shards_are_summed(self):
+        counter = MetricsRegistry().counter('test_total', 'Test.', ('kind',))
+
+        def work():
+            for _ in range(1000):
+                counter.inc('a')
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc('b', amount=5)
+        self.assertEqual(counter.collect(), {('a',): 4000, ('b',): 5})
+
+    def test_shards_do_not_grow_with_threads(self):
+        histogram = MetricsRegistry().histogram('test_seconds', 'Test.', buckets=(1.0,))
+        for _ in range(3):
+            threads = [threading.Thread(target=histogram.observe, args=(0.5,))
+                       for _ in range(2 * SHARDS)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(histogram._shards), SHARDS)
+        self.assertEqual(histogram.collect(), {(): [6 * SHARDS, 0, 3.0 * SHARDS]})
+
+    def test_exposition_format(self):
+        metrics = MetricsRegistry()
+        histogram = metrics.histogram('test_seconds', 'Test "latency".', ('op',),
+                                      buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, 'a"b')
+        metrics.gauge('test_open', 'Open things.', callback=lambda: {(): 3})
+
+        lines = metrics.expose().splitlines()
+        self.assertIn('# TYPE test_seconds histogram', lines)
+        self.assertIn('test_seconds_bucket{op="a\\"b",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{op="a\\"b",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{op="a\\"b",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_sum{op="a\\"b"} 5.55', lines)
+        self.assertIn('test_seconds_count{op="a\\"b"} 3', lines)
+        self.assertIn('test_open 3', lines)
+
+
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+        self.client = APIClient()
+
+    def test_metrics_endpoint_reports_views_and_cache(self):
+        self.client.get(reverse('book-list'))
+        self.client.get(reverse('book-list'))
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('django_http_request_duration_seconds_count'
+                      '{view="book-list",method="GET",status="200"} 2', body)
+        self.assertIn('cache_api_view_requests_total{cache_key="books_list",result="miss"} 1',
+                      body)
+        self.assertIn('cache_api_view_requests_total{cache_key="books_list",result="hit"} 1', body)
+
+    @patch('services.book_availability_service.get_provider_session')
+    def test_availability_service_outcomes(self, mock_provider_session):
+        ok_response = MagicMock()
+        ok_response.json.return_value = {'1': {'library': 'Library A', 'count_in_library': 1}}
+        mock_provider_session.return_value.get.side_effect = lambda url, **kwargs: (
+            ok_response if url.startswith('http://a')
+            else (_ for _ in ()).throw(ConnectionError('down')))
+        service = AvailabilityService(providers={
+            'a': {'base_url': 'http://a', 'timeout': 1},
+            'b': {'base_url': 'http://b', 'timeout': 1},
+        })
+        service.check_book_availability('1234567890123')
+
+        results = registry.get('availability_service_provider_results_total').collect()
+        self.assertEqual(results, {('a', 'ok'): 1, ('b', 'error'): 1})
+        calls = registry.get('availability_service_call_duration_seconds').collect()
+        self.assertIn(('check_availability', 'all', 'partial'), calls)
+        self.assertIn(('fetch_availability', 'b', 'error'), calls)
+
+    def test_celery_task_duration(self):
+        check_reservation_deadlines.apply()
+        durations = registry.get('celery_task_duration_seconds').collect()
+        self.assertIn(('app.tasks.check_reservation_deadlines', 'SUCCESS'), durations)
@@ -1,6 +1,10 @@
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import F
 from django.test import TestCase
 from django.contrib.auth.models import User
-from app.models import Book, Reservation
+from app.models import Book, IsbnAvailability, Reservation
 
 
 class BookModelTest(TestCase):
@@ -39,3 +43,69 @@ class ReservationModelTest(TestCase):
     def test_reservation_creation(self):
         self.assertEqual(self.reservation.user.username, 'testuser')
         self.assertEqual(self.reservation.book.title, 'Test Book')
+
+
+class IsbnAvailabilityTest(TestCase):
+    """Test the per-ISBN summary is kept up to date by Book changes
+    """
+    def setUp(self):
+        self.book = Book.objects.create(
+            title="Test Book",
+            author="Author A",
+            isbn="1234567890123",
+            count_in_library=5,
+            library='Main Library'
+        )
+        self.branch_book = Book.objects.create(
+            title="Test Book",
+            author="Author A",
+            isbn="1234567890123",
+            count_in_library=0,
+            library='Branch Library'
+        )
+
+    def assertSummary(self, isbn, total_copies, libraries_with_stock):
+        summary = IsbnAvailability.objects.get(isbn=isbn)
+        self.assertEqual((summary.total_copies, summary.libraries_with_stock),
+                         (total_copies, libraries_with_stock))
+
+    def test_summary_created_with_books(self):
+        self.assertSummary("1234567890123", 5, 1)
+
+    def test_stock_changes_are_applied(self):
+        book = Book.objects.get(pk=self.branch_book.pk)
+        book.count_in_library = 2
+        book.save()
+        self.assertSummary("1234567890123", 7, 2)
+        book.count_in_library = 0
+        book.save()
+        self.assertSummary("1234567890123", 5, 1)
+
+    def test_save_after_bulk_update_of_isbn(self):
+        book = Book.objects.get(pk=self.book.pk)
+        # Bypasses the Book signals, like the conditional updates of reservations
+        Book.objects.filter(pk=self.branch_book.pk).update(
+            count_in_library=F('count_in_library') + 3)
+        book.count_in_library = 4
+        book.save()
+        self.assertSummary("1234567890123", 7, 2)
+
+    def test_isbn_change_moves_stock(self):
+        self.book.isbn = "3213213213213"
+        self.book.save()
+        self.assertSummary("1234567890123", 0, 0)
+        self.assertSummary("3213213213213", 5, 1)
+
+    def test_delete_removes_stock(self):
+        Book.objects.get(pk=self.book.pk).delete()
+        self.assertSummary("1234567890123", 0, 0)
+
+    def test_rebuild_command(self):
+        IsbnAvailability.objects.filter(isbn="1234567890123").update(total_copies=1)
+        IsbnAvailability.objects.create(isbn="9999999999999", total_copies=3)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_isbn_availability', '--verify', stdout=StringIO())
+        call_command('rebuild_isbn_availability', stdout=StringIO())
+        self.assertSummary("1234567890123", 5, 1)
+        self.assertFalse(IsbnAvailability.objects.filter(isbn="9999999999999").exists())
+        call_command('rebuild_isbn_availability', '--verify', stdout=StringIO())
@@ -5,7 +5,10 @@ from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import timedelta
 from app.models import Reservation, Book
-from app.tasks import send_notification, check_reservation_deadlines
+from smtplib import SMTPRecipientsRefused
+from django.core import mail
+from django.core.mail import EmailMessage
+from app.tasks import send_notification, send_notifications_batch, check_reservation_deadlines
 from django.template import TemplateDoesNotExist
 from celery import current_app
 
@@ -66,6 +69,72 @@ class SendNotificationTest(TestCase):
         mock_logger.info.assert_called_with('Email sent to user testuser')
 
 
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class SendNotificationsBatchTest(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(
+            title='Test Book',
+            author='Test Author',
+            isbn='1234567890123',
+            count_in_library=5
+        )
+        self.reservations = []
+        for index in range(3):
+            user = User.objects.create_user(username=f'testuser{index}',
+                                            email=f'testuser{index}@example.com',
+                                            password='password')
+            self.reservations.append(Reservation.objects.create(
+                user=user,
+                book=self.book,
+                reservation_status=True,
+                reserved_until=timezone.now() + timedelta(days=2)
+            ))
+        self.reservation_ids = [reservation.pk for reservation in self.reservations]
+
+    def test_batch_sent_with_single_query(self):
+        with self.assertNumQueries(1):
+            result = send_notifications_batch(self.reservation_ids)
+        self.assertEqual(sorted(result['sent']), self.reservation_ids)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn('Test Book', mail.outbox[0].body)
+        self.assertIn('testuser0', mail.outbox[0].body)
+
+    def test_missing_reservation_is_reported(self):
+        result = send_notifications_batch(self.reservation_ids + [999])
+        self.assertEqual(result['missing'], [999])
+        self.assertEqual(len(mail.outbox), 3)
+
+    @patch('app.tasks.send_notifications_batch.retry')
+    def test_rejected_address_does_not_retry_batch(self, mock_retry):
+        original_send = EmailMessage.send
+
+        def send(message, *args, **kwargs):
+            if message.to == ['testuser1@example.com']:
+                raise SMTPRecipientsRefused({'testuser1@example.com': (550, b'No such user')})
+            return original_send(message, *args, **kwargs)
+
+        with patch.object(EmailMessage, 'send', send):
+            result = send_notifications_batch(self.reservation_ids)
+        self.assertEqual(result['rejected'], [self.reservations[1].pk])
+        self.assertEqual(len(mail.outbox), 2)
+        mock_retry.assert_not_called()
+
+    @patch('app.tasks.send_notifications_batch.retry')
+    def test_only_failed_reservations_are_retried(self, mock_retry):
+        original_send = EmailMessage.send
+
+        def send(message, *args, **kwargs):
+            if message.to == ['testuser2@example.com']:
+                raise Exception('SMTP error')
+            return original_send(message, *args, **kwargs)
+
+        with patch.object(EmailMessage, 'send', send):
+            result = send_notifications_batch(self.reservation_ids)
+        self.assertEqual(result['failed'], [self.reservations[2].pk])
+        self.assertEqual(len(mail.outbox), 2)
+        mock_retry.assert_called_once_with(args=[[self.reservations[2].pk]])
+
+
 class CheckReservationDeadlinesTest(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', email=os.getenv('MY_TEST_NOTIFICATION_EMAIL', 'testuser@example.com'), password='password')
@@ -88,29 +157,63 @@ class CheckReservationDeadlinesTest(TestCase):
             reserved_until=timezone.now() + timedelta(days=10)
         )
 
-    @patch('app.tasks.send_notification.delay')
-    def test_check_reservation_deadlines(self, mock_send_notification_delay):
-        check_reservation_deadlines()
-        mock_send_notification_delay.assert_called_once_with(self.user.id, self.reservation.pk)
+    def run_deadline_check(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return check_reservation_deadlines()
+
+    @patch('app.tasks.send_notifications_batch.delay')
+    def test_check_reservation_deadlines(self, mock_send_batch_delay):
+        self.run_deadline_check()
+        mock_send_batch_delay.assert_called_once_with([self.reservation.pk])
+        self.reservation.refresh_from_db()
+        self.assertEqual(self.reservation.reminder_stage, Reservation.REMINDER_STAGE_DUE_SOON)
+        self.assertIsNotNone(self.reservation.reminder_sent_at)
 
-    @patch('app.tasks.send_notification.delay')
-    def test_check_reservation_deadlines_no_reservations(self, mock_send_notification_delay):
+    @patch('app.tasks.send_notifications_batch.delay')
+    def test_check_reservation_deadlines_no_reservations(self, mock_send_batch_delay):
         Reservation.objects.all().delete()
-        check_reservation_deadlines()
-        mock_send_notification_delay.assert_not_called()
+        self.run_deadline_check()
+        mock_send_batch_delay.assert_not_called()
 
-    @patch('app.tasks.send_notification.delay')
-    def test_check_reservation_deadlines_multiple_reservations(self, mock_send_notification_delay):
+    @patch('app.tasks.send_notifications_batch.delay')
+    def test_check_reservation_deadlines_multiple_reservations(self, mock_send_batch_delay):
         reservation_2 = Reservation.objects.create(
             user=self.user,
             book=self.book,
             reservation_status=True,
             reserved_until=timezone.now() + timedelta(days=2)
         )
-        check_reservation_deadlines()
-        self.assertEqual(mock_send_notification_delay.call_count, 2)
-        mock_send_notification_delay.assert_any_call(self.user.id, self.reservation.pk)
-        mock_send_notification_delay.assert_any_call(self.user.id, reservation_2.pk)
+        self.run_deadline_check()
+        mock_send_batch_delay.assert_called_once()
+        self.assertCountEqual(mock_send_batch_delay.call_args[0][0],
+                              [self.reservation.pk, reservation_2.pk])
+
+    @patch('app.tasks.send_notifications_batch.delay')
+    def test_check_reservation_deadlines_is_idempotent(self, mock_send_batch_delay):
+        """
+        Test that a reservation is reminded once, however often the scan runs
+        """
+        self.assertEqual(self.run_deadline_check(), 1)
+        self.assertEqual(self.run_deadline_check(), 0)
+        mock_send_batch_delay.assert_called_once_with([self.reservation.pk])
+
+    @override_settings(RESERVATION_REMINDER_CHUNK_SIZE=2, RESERVATION_REMINDER_MAX_CHUNKS=2)
+    @patch('app.tasks.send_notifications_batch.delay')
+    def test_check_reservation_deadlines_in_chunks(self, mock_send_batch_delay):
+        """
+        Test that one run handles a bounded number of chunks, the rest waits for the next run
+        """
+        for _ in range(5):
+            Reservation.objects.create(
+                user=self.user,
+                book=self.book,
+                reservation_status=True,
+                reserved_until=timezone.now() + timedelta(days=1)
+            )
+        self.assertEqual(self.run_deadline_check(), 4)
+        self.assertEqual(mock_send_batch_delay.call_count, 2)
+        self.assertEqual(self.run_deadline_check(), 2)
+        self.assertEqual(self.run_deadline_check(), 0)
 
 
 class CeleryWorkerTest(TestCase):
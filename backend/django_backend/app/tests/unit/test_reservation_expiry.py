@@ -0,0 +1,104 @@
+from datetime import timedelta
+from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from app.models import Book, IsbnAvailability, Reservation
+from app.tasks import expire_overdue_reservations, expire_overdue_chunk
+
+
+class ExpireOverdueReservationsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.book = Book.objects.create(
+            title='Test Book',
+            author='Author A',
+            isbn='1234567890123',
+            count_in_library=0,
+            library='Main Library'
+        )
+        self.other_book = Book.objects.create(
+            title='Other Book',
+            author='Author B',
+            isbn='3213213213213',
+            count_in_library=1,
+            library='Main Library'
+        )
+
+    def reserve(self, book, days, is_external=False):
+        return Reservation.objects.create(
+            user=self.user,
+            book=book,
+            reservation_status=True,
+            reserved_until=timezone.now() + timedelta(days=days),
+            is_external=is_external
+        )
+
+    def run_sweeper(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return expire_overdue_reservations()
+
+    def test_overdue_reservations_expire_and_restore_stock(self):
+        overdue = [self.reserve(self.book, -1), self.reserve(self.book, -2),
+                   self.reserve(self.other_book, -1)]
+        active = self.reserve(self.book, 5)
+
+        self.assertEqual(self.run_sweeper(), 3)
+
+        for reservation in overdue:
+            reservation.refresh_from_db()
+            self.assertFalse(reservation.reservation_status)
+            self.assertIsNotNone(reservation.expired_at)
+        active.refresh_from_db()
+        self.assertTrue(active.reservation_status)
+
+        self.book.refresh_from_db()
+        self.other_book.refresh_from_db()
+        self.assertEqual(self.book.count_in_library, 2)
+        self.assertEqual(self.other_book.count_in_library, 2)
+
+    @patch('app.tasks.release_external_hold.delay')
+    def test_external_reservations_do_not_restore_local_stock(self, mock_release):
+        reservation = self.reserve(self.book, -1, is_external=True)
+        Reservation.objects.filter(pk=reservation.pk).update(
+            external_provider='flask', external_book_id='7')
+        self.assertEqual(self.run_sweeper(), 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.count_in_library, 0)
+        # The copy is given back to the external library instead
+        mock_release.assert_called_once_with(
+            self.user.id, 'flask', '7', str(reservation.external_request_key))
+
+    def test_sweeper_is_idempotent(self):
+        self.reserve(self.book, -1)
+        self.assertEqual(self.run_sweeper(), 1)
+        self.assertEqual(self.run_sweeper(), 0)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.count_in_library, 1)
+
+    @override_settings(RESERVATION_EXPIRY_CHUNK_SIZE=2)
+    def test_sweeper_uses_bulk_updates(self):
+        """
+        Test that a chunk costs a fixed number of queries, independent of its size
+        """
+        for _ in range(2):
+            self.reserve(self.book, -1)
+        # savepoint, select chunk, update reservations, increment stock, read ISBNs,
+        # recompute and write availability summaries, release
+        with self.assertNumQueries(8):
+            self.assertEqual(expire_overdue_chunk(2), 2)
+
+    def test_cache_invalidated_once_per_chunk(self):
+        self.reserve(self.book, -1)
+        self.reserve(self.other_book, -1)
+        with patch('app.signals.invalidate_cached_view') as mock_invalidate:
+            self.run_sweeper()
+        mock_invalidate.assert_called_once_with('books_list')
+
+    def test_availability_summary_is_refreshed(self):
+        self.reserve(self.book, -1)
+        self.reserve(self.book, -2)
+        self.run_sweeper()
+        summary = IsbnAvailability.objects.get(isbn=self.book.isbn)
+        self.assertEqual(summary.total_copies, 2)
+        self.assertEqual(summary.libraries_with_stock, 1)
@@ -1,6 +1,12 @@
 from rest_framework.test import APITestCase
+from django.urls import reverse
 from django.contrib.auth.models import User
-from app.serializers import BookSerializer, ReservationSerializer
+from app.serializers import (
+    BookProjection,
+    BookSerializer,
+    ReservationProjection,
+    ReservationSerializer,
+)
 from app.models import Book, Reservation
 from datetime import datetime, timedelta, timezone
 
@@ -110,3 +116,51 @@ class ReservationSerializerTest(APITestCase):
         serializer.context['request'] = self._get_mock_request(user=self.user)
         self.assertFalse(serializer.is_valid())
         self.assertIn('book_id', serializer.errors)
+
+
+class ProjectionContractTest(APITestCase):
+    """The values() based projections must output exactly what their serializers do."""
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'user{i}') for i in range(2)]
+        self.books = [
+            Book.objects.create(title=f'Book {i}', author=f'Author {i % 3}', isbn=f'{i:013d}',
+                                count_in_library=i % 4, library=f'Library {i % 2}')
+            for i in range(10)
+        ]
+        for i, book in enumerate(self.books):
+            Reservation.objects.create(
+                user=self.users[i % 2],
+                book=book,
+                # Microseconds and whole seconds are formatted differently
+                reserved_until=datetime(2030, 1, 1, 12, 0, i, 123456 * (i % 2),
+                                        tzinfo=timezone.utc),
+                reservation_status=bool(i % 3),
+                is_external=bool(i % 2),
+            )
+
+    def assert_same_output(self, projection, queryset):
+        self.assertEqual(projection.serialize(queryset),
+                         projection.model_serializer(queryset, many=True).data)
+
+    def test_book_projection(self):
+        self.assert_same_output(BookProjection, Book.objects.order_by('book_id'))
+        self.assert_same_output(BookProjection, Book.objects.filter(isbn=self.books[3].isbn))
+
+    def test_reservation_projection(self):
+        self.assert_same_output(ReservationProjection,
+                                Reservation.objects.order_by('reservation_id'))
+        self.assert_same_output(ReservationProjection,
+                                Reservation.objects.filter(user=self.users[1]))
+
+    def test_reservation_projection_is_one_query(self):
+        with self.assertNumQueries(1):
+            ReservationProjection.serialize(Reservation.objects.all())
+
+    def test_views_use_projections(self):
+        self.client.force_authenticate(user=self.users[0])
+        response = self.client.get(reverse('user_reservations'))
+        self.assertEqual(response.json(), ReservationSerializer(
+            Reservation.objects.filter(user=self.users[0]), many=True).data)
+        response = self.client.get(reverse('book-search-by-isbn'), {'isbn': self.books[0].isbn})
+        self.assertEqual(response.json(), BookSerializer(
+            Book.objects.filter(isbn=self.books[0].isbn), many=True).data)
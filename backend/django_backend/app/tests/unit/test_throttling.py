@@ -0,0 +1,85 @@
+from unittest.mock import patch
+from django.conf import settings
+from django.core.cache import cache
+from django.test import override_settings
+from django.urls import reverse
+from redis.exceptions import ConnectionError
+from rest_framework import status
+from rest_framework.test import APITestCase, APIClient
+from django.contrib.auth.models import User
+from app.models import Book
+
+
+def throttle_rates(**rates):
+    return dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES=rates)
+
+
+@patch('app.views.AvailabilityService')
+class TokenBucketThrottleTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        self.book = Book.objects.create(
+            title='Available Book',
+            author='Author A',
+            isbn='1111111111111',
+            count_in_library=100,
+            library='Main Library'
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer testtoken')
+
+    def reserve(self, user):
+        self.client.force_authenticate(user=user)
+        return self.client.post(reverse('reserve_book'), {'book_id': self.book.book_id},
+                                format='json')
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(reserve_user='2/min', reserve_ip='100/min'))
+    def test_user_bucket_is_limited(self, mock_availability_service):
+        self.assertEqual(self.reserve(self.user).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.reserve(self.user).status_code, status.HTTP_201_CREATED)
+        response = self.reserve(self.user)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        # One token is refilled every 30 seconds
+        self.assertIn(int(response['Retry-After']), range(29, 31))
+        # Other users have their own bucket
+        self.assertEqual(self.reserve(self.other_user).status_code, status.HTTP_201_CREATED)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(reserve_user='100/min', reserve_ip='2/min'))
+    def test_ip_bucket_is_shared_by_users(self, mock_availability_service):
+        self.assertEqual(self.reserve(self.user).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.reserve(self.other_user).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.reserve(self.user).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(reserve_user='2/min', reserve_ip='1/min'))
+    def test_rejected_request_does_not_use_up_other_bucket(self, mock_availability_service):
+        self.assertEqual(self.reserve(self.user).status_code, status.HTTP_201_CREATED)
+        for _ in range(3):
+            self.assertEqual(self.reserve(self.user).status_code,
+                             status.HTTP_429_TOO_MANY_REQUESTS)
+        # Only the request let through took a token from the user bucket
+        key = cache.make_key(f'throttle_bucket_reserve_user_{self.user.pk}')
+        tokens = float(cache.get_client(key).hget(key, 'tokens'))
+        self.assertGreaterEqual(tokens, 1)
+        self.assertLess(tokens, 1.1)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(check_availability_user='1/min'))
+    def test_only_throttled_actions_are_limited(self, mock_availability_service):
+        mock_availability_service.return_value.check_book_availability.return_value = {
+            'availability': {}, 'partial': [], 'providers': {'flask': 'ok'}}
+        self.client.force_authenticate(user=self.user)
+        url = reverse('book-check-availability', args=[self.book.book_id])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        # Search has no throttle_scope, reserve has no rate configured
+        for _ in range(3):
+            self.assertEqual(self.client.get(reverse('book-search'), {'q': 'book'}).status_code,
+                             status.HTTP_200_OK)
+            self.assertEqual(self.reserve(self.user).status_code, status.HTTP_201_CREATED)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(reserve_user='1/min', reserve_ip='1/min'))
+    def test_requests_are_allowed_when_redis_is_down(self, mock_availability_service):
+        with patch('app.throttling.Script.__call__', side_effect=ConnectionError('down')):
+            self.assertEqual(self.reserve(self.user).status_code, status.HTTP_201_CREATED)
+            self.assertEqual(self.reserve(self.user).status_code, status.HTTP_201_CREATED)
@@ -0,0 +1,92 @@
+import tempfile
+from io import StringIO
+from unittest.mock import patch, MagicMock
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from services.book_availability_service import AvailabilityService
+from services.tracing import (
+    tracer,
+    parse_traceparent,
+    FileSpanExporter,
+    InMemorySpanExporter,
+    SPAN_KIND_SERVER,
+    SPAN_KIND_CLIENT,
+)
+from app.tasks import check_reservation_deadlines
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+TRACEPARENT = f'00-{TRACE_ID}-00f067aa0ba902b7-01'
+
+
+class TraceparentTest(SimpleTestCase):
+    def test_parse(self):
+        self.assertEqual(parse_traceparent(TRACEPARENT), (TRACE_ID, '00f067aa0ba902b7'))
+        self.assertIsNone(parse_traceparent('00-123-456-01'))
+        self.assertIsNone(parse_traceparent(f'00-{"0" * 32}-00f067aa0ba902b7-01'))
+        self.assertIsNone(parse_traceparent(f'ff-{TRACE_ID}-00f067aa0ba902b7-01'))
+        self.assertIsNone(parse_traceparent(None))
+
+
+class TracingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.exporter = InMemorySpanExporter()
+        tracer.set_exporter(self.exporter)
+        self.addCleanup(tracer.set_exporter, None)
+
+    def test_request_continues_incoming_trace(self):
+        response = APIClient().get(reverse('book-list'), HTTP_TRACEPARENT=TRACEPARENT)
+        self.assertEqual(response.status_code, 200)
+
+        span, = self.exporter.spans
+        self.assertEqual(span.name, 'GET book-list')
+        self.assertEqual(span.kind, SPAN_KIND_SERVER)
+        self.assertEqual(span.trace_id, TRACE_ID)
+        self.assertEqual(span.parent_id, '00f067aa0ba902b7')
+        self.assertEqual(span.attributes['http.status_code'], 200)
+
+    @patch('services.book_availability_service.get_provider_session')
+    def test_provider_calls_propagate_context(self, mock_provider_session):
+        mock_get = mock_provider_session.return_value.get
+        mock_get.return_value = MagicMock(json=MagicMock(return_value={}))
+        service = AvailabilityService(
+            providers={'flask': {'base_url': 'http://flask:5000', 'timeout': 1}})
+        with tracer.span('reserve') as parent:
+            service.check_book_availability('1234567890123')
+
+        client_span = next(span for span in self.exporter.spans if span.kind == SPAN_KIND_CLIENT)
+        self.assertEqual(client_span.parent_id, parent.span_id)
+        self.assertEqual(client_span.trace_id, parent.trace_id)
+        self.assertEqual(mock_get.call_args.kwargs['headers'],
+                         {'traceparent': client_span.traceparent})
+
+    def test_celery_task_span(self):
+        with tracer.span('request') as parent:
+            check_reservation_deadlines.apply()
+        task_span = next(span for span in self.exporter.spans if span.name.startswith('task '))
+        self.assertEqual(task_span.name, 'task app.tasks.check_reservation_deadlines')
+        self.assertEqual(task_span.parent_id, parent.span_id)
+        self.assertEqual(task_span.attributes['celery.state'], 'SUCCESS')
+
+
+class TraceReportTest(SimpleTestCase):
+    def test_report_prints_span_tree(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tracer.set_exporter(FileSpanExporter(f'{directory}/django.jsonl'))
+            self.addCleanup(tracer.set_exporter, None)
+            with tracer.span('POST reserve_book', traceparent=TRACEPARENT):
+                with tracer.span('POST /book_reserved_external', SPAN_KIND_CLIENT):
+                    pass
+            tracer.exporter._file.close()
+
+            with override_settings(TRACING_EXPORT_DIR=directory):
+                out = StringIO()
+                call_command('trace_report', TRACE_ID, stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertIn(f'Trace {TRACE_ID}: 2 spans', lines[0])
+        self.assertTrue(lines[2].endswith('django: POST reserve_book'))
+        self.assertTrue(lines[3].endswith('  django: POST /book_reserved_external'))
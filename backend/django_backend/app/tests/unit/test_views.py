@@ -2,10 +2,12 @@ from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 from django.contrib.auth.models import User
-from app.models import Book, Reservation
+from django.core.cache import cache
+from app.models import Book, IsbnAvailability, Reservation
 from app.serializers import BookSerializer, ReservationSerializer
 from datetime import datetime, timedelta
-from unittest.mock import patch
+from unittest.mock import patch, ANY, MagicMock
+from services.book_search_index import book_search_index
 
 
 class BookAPITest(APITestCase):
@@ -142,6 +144,7 @@ class ReturnBookViewTestCase(APITestCase):
         self.assertFalse(self.reservation.reservation_status)
         self.book.refresh_from_db()
         self.assertEqual(self.book.count_in_library, 1)
+        self.assertEqual(IsbnAvailability.objects.get(isbn='1234567890123').total_copies, 1)
 
     def test_return_book_not_authenticated(self):
         """
@@ -193,6 +196,41 @@ class ReturnBookViewTestCase(APITestCase):
             response.data['non_field_errors'][0]
             )
 
+    def test_return_pending_external_reservation(self):
+        """
+        Test that a reservation still being reserved in an external library cannot be returned
+        """
+        Reservation.objects.filter(pk=self.reservation.pk).update(
+            is_external=True, external_status=Reservation.EXTERNAL_STATUS_PENDING)
+        self.client.force_authenticate(user=self.user1)
+        data = {'reservation_id': self.reservation.reservation_id}
+        response = self.client.put(reverse('return_book'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.reservation.refresh_from_db()
+        self.assertTrue(self.reservation.reservation_status)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.count_in_library, 0)
+
+    @patch('app.tasks.release_external_hold.delay')
+    def test_return_external_book(self, mock_release):
+        """
+        Test that an external copy is given back to its library, not to the local stock
+        """
+        Reservation.objects.filter(pk=self.reservation.pk).update(
+            is_external=True,
+            external_status=Reservation.EXTERNAL_STATUS_CONFIRMED,
+            external_provider='flask',
+            external_book_id='7')
+        self.client.force_authenticate(user=self.user1)
+        data = {'reservation_id': self.reservation.reservation_id}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(reverse('return_book'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.count_in_library, 0)
+        mock_release.assert_called_once_with(
+            self.user1.id, 'flask', '7', str(self.reservation.external_request_key))
+
 
 class UserReservationListViewTestCase(APITestCase):
     def setUp(self):
@@ -353,6 +391,7 @@ class UserRegistrationViewTestCase(APITestCase):
 
 class ReservationAPITest(APITestCase):
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(username='testuser', password='testpassword')
         self.book_available = Book.objects.create(
             title='Available Book',
@@ -392,6 +431,26 @@ class ReservationAPITest(APITestCase):
         self.assertEqual(reservation.reservation_library, self.book_available.library)
         self.book_available.refresh_from_db()
         self.assertEqual(self.book_available.count_in_library, 4)
+        self.assertEqual(IsbnAvailability.objects.get(isbn='1111111111111').total_copies, 4)
+
+    @patch('app.views.AvailabilityService')
+    def test_reserve_last_copy_taken_concurrently(self, mock_availability_service):
+        """
+        Test that a copy taken by a concurrent reservation after validation is not oversold
+        """
+        def take_all_copies():
+            Book.objects.filter(pk=self.book_available.pk).update(count_in_library=0)
+            return MagicMock()
+
+        mock_availability_service.side_effect = take_all_copies
+        self.client.force_authenticate(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer testtoken')
+        data = {'book_id': self.book_available.book_id}
+        response = self.client.post(reverse('reserve_book'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Reservation.objects.count(), 0)
+        self.book_available.refresh_from_db()
+        self.assertEqual(self.book_available.count_in_library, 0)
 
     @patch('app.views.AvailabilityService')
     def test_reserve_book_external_library(self, mock_availability_service):
@@ -408,12 +467,18 @@ class ReservationAPITest(APITestCase):
         }
         mock_service = mock_availability_service.return_value
         mock_external_availability = {
-            '3': {  # Simulating external book ID
-                'library': 'External Library',
-                'count_in_library': 2
-            }
+            'availability': {
+                'flask:3': {  # Simulating external book ID
+                    'provider': 'flask',
+                    'book_id': '3',
+                    'library': 'External Library',
+                    'count_in_library': 2
+                }
+            },
+            'partial': [],
+            'providers': {'flask': 'ok'},
         }
-        mock_service.check_book_availability_flask.return_value = mock_external_availability
+        mock_service.check_book_availability.return_value = mock_external_availability
         mock_service.reserve_book_external_api.return_value = True
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
@@ -425,10 +490,19 @@ class ReservationAPITest(APITestCase):
         self.assertEqual(reservation.reservation_library, 'External Library')
         self.book_not_available.refresh_from_db()
         self.assertEqual(self.book_not_available.count_in_library, 0)
-        mock_service.check_book_availability_flask.assert_called_once_with(
+        mock_service.check_book_availability.assert_called_once_with(
             self.book_not_available.isbn
             )
-        mock_service.reserve_book_external_api.assert_called_once_with('3', 'testtoken')
+        mock_service.reserve_book_external_api.assert_called_once_with('3', 'testtoken',
+                                                                       provider='flask',
+                                                                       timeout=ANY,
+                                                                       retry=False,
+                                                                       idempotency_key=ANY)
+        self.assertEqual(reservation.external_provider, 'flask')
+        self.assertEqual(reservation.external_book_id, '3')
+        self.assertEqual(
+            mock_service.reserve_book_external_api.call_args.kwargs['idempotency_key'],
+            str(reservation.external_request_key))
 
     @patch('app.views.AvailabilityService')
     def test_reserve_book_not_available_anywhere(self, mock_availability_service):
@@ -443,12 +517,13 @@ class ReservationAPITest(APITestCase):
             'book_id': self.book_not_available.book_id,
         }
         mock_service = mock_availability_service.return_value
-        mock_service.check_book_availability_flask.return_value = False
+        mock_service.check_book_availability.return_value = {
+            'availability': {}, 'partial': [], 'providers': {'flask': 'ok'}}
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('This book is not available', str(response.data[0]))
         self.assertEqual(Reservation.objects.count(), 0)
-        mock_service.check_book_availability_flask.assert_called_once_with(
+        mock_service.check_book_availability.assert_called_once_with(
             self.book_not_available.isbn
         )
         mock_service.reserve_book_external_api.assert_not_called()
@@ -480,3 +555,152 @@ class ReservationAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('Please provide correct book ID', str(response.data))
         self.assertEqual(Reservation.objects.count(), 0)
+
+    @patch('app.views.complete_external_reservation.delay')
+    @patch('app.views.AvailabilityService')
+    def test_reserve_book_external_library_async(self, mock_availability_service, mock_delay):
+        """
+        Test that with 'Prefer: respond-async' an external reservation is accepted as pending
+            and completed by a Celery task
+        """
+        self.client.force_authenticate(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer testtoken')
+        url = reverse('reserve_book')
+        data = {
+            'book_id': self.book_not_available.book_id,
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data, format='json', HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        reservation = Reservation.objects.get()
+        self.assertTrue(reservation.is_external)
+        self.assertEqual(reservation.external_status, Reservation.EXTERNAL_STATUS_PENDING)
+        self.assertEqual(response.data['reservation_id'], reservation.reservation_id)
+        status_url = reverse('reservation_status', args=[reservation.reservation_id])
+        self.assertEqual(response['Location'], status_url)
+        mock_delay.assert_called_once_with(reservation.reservation_id)
+        mock_availability_service.return_value.check_book_availability.assert_not_called()
+
+        response = self.client.get(status_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['external_status'], Reservation.EXTERNAL_STATUS_PENDING)
+
+    def test_reservation_status_of_other_user(self):
+        """
+        Test that a user cannot see the status of another user's reservation
+        """
+        other_user = User.objects.create_user(username='otheruser', password='testpassword')
+        reservation = Reservation.objects.create(
+            user=other_user,
+            book=self.book_available,
+            reserved_until=datetime.now() + timedelta(days=30)
+        )
+        self.client.force_authenticate(user=self.user)
+        url = reverse('reservation_status', args=[reservation.reservation_id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BookSearchAPITest(APITestCase):
+    def setUp(self):
+        book_search_index.invalidate()
+        self.dune = Book.objects.create(
+            title='Dune',
+            author='Frank Herbert',
+            isbn='9780441013593',
+            count_in_library=2,
+            library='Main Library'
+        )
+        self.dune_messiah = Book.objects.create(
+            title='Dune Messiah',
+            author='Frank Herbert',
+            isbn='9780441172696',
+            count_in_library=1,
+            library='Main Library'
+        )
+        self.dunwich = Book.objects.create(
+            title='The Dunwich Horror',
+            author='H. P. Lovecraft',
+            isbn='9780870540349',
+            count_in_library=1,
+            library='Main Library'
+        )
+        self.client = APIClient()
+
+    def test_search_ranks_exact_matches_first(self):
+        """
+        Test that exact word matches rank above prefix matches
+        """
+        url = reverse('book-search') + '?q=dun'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+
+        url = reverse('book-search') + '?q=dune'
+        response = self.client.get(url)
+        ids = [book['book_id'] for book in response.data['results']]
+        self.assertEqual(ids, [self.dune.book_id, self.dune_messiah.book_id])
+
+    def test_search_by_author_and_isbn_prefix(self):
+        """
+        Test that author words and ISBN prefixes are searchable
+        """
+        response = self.client.get(reverse('book-search') + '?q=lovecraft')
+        self.assertEqual([book['book_id'] for book in response.data['results']],
+                         [self.dunwich.book_id])
+
+        response = self.client.get(reverse('book-search') + '?q=978044')
+        self.assertEqual(response.data['count'], 2)
+
+    def test_search_is_paginated(self):
+        """
+        Test that search results are paginated
+        """
+        response = self.client.get(reverse('book-search') + '?q=dun&page_size=2')
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_search_reflects_book_changes(self):
+        """
+        Test that the index is updated incrementally from Book signals
+        """
+        self.client.get(reverse('book-search') + '?q=dune')
+        Book.objects.create(
+            title='Children of Dune',
+            author='Frank Herbert',
+            isbn='9780441104024',
+            count_in_library=1,
+            library='Main Library'
+        )
+        self.dune_messiah.delete()
+        response = self.client.get(reverse('book-search') + '?q=dune')
+        titles = [book['title'] for book in response.data['results']]
+        self.assertEqual(titles, ['Children of Dune', 'Dune'])
+
+    def test_search_without_query(self):
+        """
+        Test that missing search phrase returns status 400
+        """
+        response = self.client.get(reverse('book-search'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_by_isbns(self):
+        """
+        Test resolving several ISBNs in one request
+        """
+        url = reverse('book-search-by-isbns')
+        url += f'?isbns={self.dune.isbn},{self.dunwich.isbn},0000000000000'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][self.dune.isbn],
+                         BookSerializer([self.dune], many=True).data)
+        self.assertEqual(len(response.data['results'][self.dunwich.isbn]), 1)
+        self.assertEqual(response.data['not_found'], ['0000000000000'])
+
+    def test_search_by_isbns_without_isbns(self):
+        """
+        Test that missing ISBNs return status 400
+        """
+        response = self.client.get(reverse('book-search-by-isbns'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
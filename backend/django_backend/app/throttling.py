@@ -0,0 +1,129 @@
+import logging
+from django.core.cache import cache
+from redis.commands.core import Script
+from redis.exceptions import RedisError
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+logger = logging.getLogger(__name__)
+
+# Refills every bucket for the time elapsed since the last request and takes one token
+# from each of them only if all of them have one, so a bucket is not charged for a
+# request another bucket rejects. Uses the Redis clock, so all workers share one time
+# source.
+# KEYS[i]: bucket key, ARGV[2i - 1]: its capacity, ARGV[2i]: its tokens refilled per second
+# Returns {allowed (0/1), seconds until every bucket has a token (string, Lua numbers
+# are truncated)}
+TOKEN_BUCKET_LUA = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local buckets = {}
+local allowed = 1
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = tonumber(ARGV[2 * i])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1])
+    local ts = tonumber(bucket[2])
+    if tokens == nil or ts == nil then
+        tokens = capacity
+        ts = now
+    end
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    if tokens < 1 then
+        allowed = 0
+        wait = math.max(wait, (1 - tokens) / rate)
+    end
+    buckets[i] = {tokens, math.ceil(capacity / rate) + 1}
+end
+
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'tokens', buckets[i][1] - allowed, 'ts', now)
+    redis.call('EXPIRE', key, buckets[i][2])
+end
+return {allowed, tostring(wait)}
+"""
+
+_token_bucket_script = None
+
+
+def get_token_bucket_script(client):
+    """The script is sent with EVALSHA, and only loaded again if Redis does not know it."""
+    global _token_bucket_script
+    if _token_bucket_script is None:
+        _token_bucket_script = Script(client, TOKEN_BUCKET_LUA)
+    return _token_bucket_script
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """Per user and per client IP token buckets kept in Redis, checked together in one
+    EVALSHA round trip per request.
+
+    Unlike DRF's default throttles, which read and write a list of request
+    timestamps in the cache, the buckets are updated atomically by a Lua script, so
+    concurrent requests from many workers cannot overshoot the rate, and a request
+    rejected by one bucket does not use up a token of the other.
+
+    The view sets `throttle_scope`, the rates are read from
+    REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']['<throttle_scope>_<scope_suffix>'], e.g.
+    'reserve_user': '10/min' allows bursts of 10 requests, refilled at 10 per minute.
+    Buckets without a configured rate are not checked. If Redis is unavailable,
+    requests are let through.
+    """
+    # 'user' buckets are per user (anonymous requests are keyed by client IP),
+    # 'ip' buckets are per client IP, shared by all users behind that IP
+    scope_suffixes = ('user', 'ip')
+    cache_format = 'throttle_bucket_%(scope)s_%(ident)s'
+
+    def __init__(self):
+        # Rates are resolved per view in allow_request
+        self.wait_seconds = None
+
+    def get_bucket_ident(self, request, scope_suffix):
+        if scope_suffix == 'user' and request.user and request.user.is_authenticated:
+            return request.user.pk
+        return self.get_ident(request)
+
+    def get_buckets(self, request, view):
+        """(cache key, capacity, tokens refilled per second) of each bucket of the view
+        that has a rate.
+        """
+        throttle_scope = getattr(view, 'throttle_scope', None)
+        if not throttle_scope:
+            return []
+        buckets = []
+        for scope_suffix in self.scope_suffixes:
+            scope = f'{throttle_scope}_{scope_suffix}'
+            rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+            if rate is None:
+                continue
+            num_requests, duration = self.parse_rate(rate)
+            key = self.cache_format % {
+                'scope': scope,
+                'ident': self.get_bucket_ident(request, scope_suffix),
+            }
+            buckets.append((cache.make_key(key), num_requests, num_requests / duration))
+        return buckets
+
+    def allow_request(self, request, view):
+        buckets = self.get_buckets(request, view)
+        if not buckets:
+            return True
+
+        keys = [key for key, _, _ in buckets]
+        args = [arg for _, capacity, rate in buckets for arg in (capacity, rate)]
+        try:
+            # Every key lives on the leader, writes always go there
+            client = cache.get_client(keys[0], write=True)
+            allowed, wait = get_token_bucket_script(client)(keys=keys, args=args, client=client)
+        except RedisError as e:
+            logger.error(f"Error calling Redis in {self.__class__.__name__}: {str(e)}")
+            return True
+
+        self.wait_seconds = float(wait)
+        return bool(allowed)
+
+    def wait(self):
+        return self.wait_seconds
@@ -5,8 +5,14 @@ from .views import (
     BookListCreateView,
     UserReservationListView,
     ReserveBookView,
+    BulkReserveBookView,
     ReturnBookView,
+    ReservationStatusView,
+    CacheStatsView,
+    availability_stream,
+    metrics,
     )
+from . import async_views
 
 
 router = DefaultRouter()
@@ -19,10 +25,37 @@ urlpatterns = [
     # Get list of reservations for a specific user (User only)
     path('reservations/', UserReservationListView.as_view(), name='user_reservations'),
 
+    # Status of a reservation, e.g. a pending external one (User only)
+    path('reservations/<int:pk>/status/',
+         ReservationStatusView.as_view(),
+         name='reservation_status'),
+
     # Reserve a book (User only)
     path('reserve/', ReserveBookView.as_view(), name='reserve_book'),
 
+    # Reserve several books at once, e.g. a reading list (User only)
+    path('reserve/bulk/', BulkReserveBookView.as_view(), name='reserve_books_bulk'),
+
     # Return a book
     path('return/', ReturnBookView.as_view(), name='return_book'),
+
+    # Server-Sent Events of availability changes of given ISBNs (ASGI only)
+    path('availability/stream/', availability_stream, name='availability_stream'),
+
+    # Two-tier cache hit ratios of the serving worker (Admin only)
+    path('cache/stats/', CacheStatsView.as_view(), name='cache_stats'),
+
+    # Prometheus metrics of the serving process
+    path('metrics/', metrics, name='metrics'),
+
+    # Async versions of the read-only endpoints, for ASGI servers
+    path('async/books/', async_views.book_list, name='async-book-list'),
+    path('async/books/search_by_isbn/',
+         async_views.book_search_by_isbn,
+         name='async-book-search-by-isbn'),
+    path('async/books/<int:pk>/check_availability/',
+         async_views.book_check_availability,
+         name='async-book-check-availability'),
+    path('async/reservations/', async_views.user_reservations, name='async_user_reservations'),
     ]
 urlpatterns += router.urls
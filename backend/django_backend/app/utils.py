@@ -1,18 +1,323 @@
+import json
+import math
+import time
+import random
+import hashlib
+import secrets
+from django.conf import settings
 from django.core.cache import cache
+from django.http import HttpResponse
+from redis.commands.core import Script
+from rest_framework import status
 from rest_framework.response import Response
 from functools import wraps
+from services.book_search_index import book_search_index
+from services.metrics import registry
+from app.models import Book
 
 
-def cache_api_view(cache_key, timeout):
+CACHE_API_VIEW_REQUESTS = registry.counter(
+    'cache_api_view_requests_total',
+    'Requests of views cached with cache_api_view, by cache key and result '
+    '(hit, miss, refresh, stale, waited).',
+    ('cache_key', 'result'),
+)
+
+
+# Deletes the lock only while it still holds the caller's token, so a request whose
+# lock expired cannot release the lock another request has taken since.
+# KEYS[1]: lock key, ARGV[1]: token
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_release_lock_script = None
+
+
+def acquire_lock(key, timeout):
+    """Take the lock `key` in Redis for timeout seconds (SET NX EX).
+
+    Returns a random token identifying the owner, to pass to release_lock, or None
+    when the lock is held by another request.
+    """
+    token = secrets.token_hex(16)
+    key = cache.make_key(key)
+    if cache.get_client(key, write=True).set(key, token, nx=True, ex=timeout):
+        return token
+    return None
+
+
+def release_lock(key, token):
+    """Release the lock `key` if it is still owned by token, see acquire_lock."""
+    global _release_lock_script
+    key = cache.make_key(key)
+    client = cache.get_client(key, write=True)
+    if _release_lock_script is None:
+        _release_lock_script = Script(client, RELEASE_LOCK_LUA)
+    _release_lock_script(keys=[key], args=[token], client=client)
+
+
+def _should_refresh(entry):
+    """Probabilistic early expiration (XFetch): the closer the entry is to its expiry and
+    the longer it took to compute, the likelier a request refreshes it ahead of time."""
+    beta = settings.CACHE_API_VIEW_EARLY_REFRESH_BETA
+    early = entry['delta'] * beta * math.log(1.0 - random.random())
+    return time.time() - early >= entry['expires_at']
+
+
+def request_cache_key(path=True, query_params=True, user=False, role=False, accept=True):
+    """Build a key function for cache_api_view from parts of the request.
+
+    - path: the request path.
+    - query_params: the query parameters, sorted by name so their order does not matter.
+    - user: the authenticated user's pk, 'anonymous' otherwise.
+    - role: 'staff', 'user' or 'anonymous', for responses that only differ by permissions.
+    - accept: the media type negotiated from the Accept header, responses are stored rendered.
+    """
+    def key_func(request):
+        parts = []
+        if path:
+            parts.append(request.path)
+        if query_params:
+            parts.append(sorted(request.query_params.lists()))
+        if user:
+            parts.append(request.user.pk if request.user.is_authenticated else 'anonymous')
+        if role:
+            if not request.user.is_authenticated:
+                parts.append('anonymous')
+            else:
+                parts.append('staff' if request.user.is_staff else 'user')
+        if accept:
+            parts.append(request.accepted_media_type)
+        return json.dumps(parts, default=str)
+    return key_func
+
+
+def _generation_key(cache_key):
+    return f'{cache_key}:generation'
+
+
+# Time of the last invalidate_cached_view, cleared by app.tasks.warm_invalidated_caches
+CACHE_WARMUP_PENDING_KEY = 'cache_warmup_pending'
+
+
+def invalidate_cached_view(cache_key):
+    """Invalidate every variant cached by cache_api_view under cache_key.
+
+    Variants are not deleted one by one, the generation of cache_key is changed so
+    that all entries stored with the previous one are treated as missing. The
+    warm-up of cached views is marked as pending.
+    """
+    cache.set_many({
+        _generation_key(cache_key): time.time_ns(),
+        CACHE_WARMUP_PENDING_KEY: time.time(),
+    }, None)
+
+
+def _cached_response(entry):
+    return HttpResponse(entry['content'], status=entry['status'], headers=entry['headers'])
+
+
+def cache_api_view(cache_key, timeout, key_func=None):
+    """
+    Cache the rendered response of a DRF view under cache_key for timeout seconds.
+
+    key_func(request) returns the part of the request the response depends on, see
+    request_cache_key (path, query parameters and Accept header by default). Each
+    variant is stored as rendered bytes, status and headers, so a hit is one cache
+    read (the entry and the generation of cache_key) and is written out as is.
+    Use invalidate_cached_view(cache_key) to drop all variants.
+
+    Recomputation is single-flight: the request that takes the `lock:<key>` lock
+    (see acquire_lock) runs the view, concurrent requests serve the previous value or, when
+    there is none (e.g. after invalidation), wait up to CACHE_API_VIEW_WAIT_SECONDS for
+    the new one. Entries are refreshed early with a probability growing towards their
+    expiry, and kept CACHE_API_VIEW_STALE_SECONDS longer to be served during a refresh.
+    """
+    if key_func is None:
+        key_func = request_cache_key()
+    generation_key = _generation_key(cache_key)
+
     def decorator(view_func):
         @wraps(view_func)
         def _wrapped_view(self, request, *args, **kwargs):
-            data = cache.get(cache_key)
-            if data is not None:
-                return Response(data)
-            response = view_func(self, request, *args, **kwargs)
-            # Cache the response data
-            cache.set(cache_key, response.data, timeout)
-            return response
+            digest = hashlib.sha256(key_func(request).encode()).hexdigest()
+            variant_key = f'{cache_key}:{digest}'
+
+            def current_entry():
+                found = cache.get_many([variant_key, generation_key])
+                entry = found.get(variant_key)
+                if entry is not None and entry['generation'] != found.get(generation_key):
+                    # Invalidated, only served again after a rebuild
+                    return None, found.get(generation_key)
+                return entry, found.get(generation_key)
+
+            entry, generation = current_entry()
+            if entry is not None and not _should_refresh(entry):
+                CACHE_API_VIEW_REQUESTS.inc(cache_key, 'hit')
+                return _cached_response(entry)
+
+            lock_key = f'lock:{variant_key}'
+            lock_token = acquire_lock(lock_key, settings.CACHE_API_VIEW_LOCK_SECONDS)
+            if lock_token is not None:
+                CACHE_API_VIEW_REQUESTS.inc(cache_key, 'miss' if entry is None else 'refresh')
+                try:
+                    started = time.monotonic()
+                    response = view_func(self, request, *args, **kwargs)
+                    if response.status_code == status.HTTP_200_OK:
+                        # Render now instead of after the view returns, to store the bytes
+                        response = self.finalize_response(request, response, *args, **kwargs)
+                        response.render()
+                        cache.set(variant_key, {
+                            'content': response.content,
+                            'status': response.status_code,
+                            'headers': dict(response.items()),
+                            # Read before running the view, an invalidation meanwhile wins
+                            'generation': generation,
+                            'expires_at': time.time() + timeout,
+                            'delta': time.monotonic() - started,
+                        }, timeout + settings.CACHE_API_VIEW_STALE_SECONDS)
+                    return response
+                finally:
+                    release_lock(lock_key, lock_token)
+
+            if entry is not None:
+                # Another request is refreshing the entry
+                CACHE_API_VIEW_REQUESTS.inc(cache_key, 'stale')
+                return _cached_response(entry)
+
+            deadline = time.monotonic() + settings.CACHE_API_VIEW_WAIT_SECONDS
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                entry, _ = current_entry()
+                if entry is not None:
+                    CACHE_API_VIEW_REQUESTS.inc(cache_key, 'waited')
+                    return _cached_response(entry)
+            # The rebuild is slow or failed, answer without caching
+            CACHE_API_VIEW_REQUESTS.inc(cache_key, 'miss')
+            return view_func(self, request, *args, **kwargs)
         return _wrapped_view
     return decorator
+
+
+def external_availability_cache_key(isbn):
+    return f'external_availability_{isbn}'
+
+
+def get_external_availability(availability_service, isbn, refresh=False):
+    """Return availability_service.check_book_availability(isbn), cached for
+    EXTERNAL_AVAILABILITY_CACHE_SECONDS.
+
+    Only complete answers are cached, a partial one is asked again by the next request.
+    Used to display availability, reservations always ask the providers directly.
+    refresh=True skips the cached answer, e.g. to warm the cache.
+    """
+    key = external_availability_cache_key(isbn)
+    if not refresh:
+        availability = cache.get(key)
+        if availability is not None:
+            return availability
+    availability = availability_service.check_book_availability(isbn)
+    if not availability['partial']:
+        cache.set(key, availability, settings.EXTERNAL_AVAILABILITY_CACHE_SECONDS)
+    return availability
+
+
+async def aget_external_availability(availability_service, isbn):
+    """Async version of get_external_availability, sharing its cache entries."""
+    key = external_availability_cache_key(isbn)
+    availability = await cache.aget(key)
+    if availability is not None:
+        return availability
+    availability = await availability_service.acheck_book_availability(isbn)
+    if not availability['partial']:
+        await cache.aset(key, availability, settings.EXTERNAL_AVAILABILITY_CACHE_SECONDS)
+    return availability
+
+
+def _request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method} {request.path} {body}'.encode()).hexdigest()
+
+
+def idempotent_request(view_func):
+    """Replay the stored response of a request repeated with the same Idempotency-Key header.
+
+    The first response (except 5xx) is stored under (user, path, key) for
+    IDEMPOTENCY_REPLAY_SECONDS and returned for duplicates without running the view again.
+    Concurrent duplicates wait up to IDEMPOTENCY_WAIT_SECONDS for the first one, which
+    holds a lock expiring after IDEMPOTENCY_LOCK_SECONDS, reusing the key with a
+    different payload is rejected with 422.
+    """
+    @wraps(view_func)
+    def _wrapped_view(self, request, *args, **kwargs):
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if not idempotency_key:
+            return view_func(self, request, *args, **kwargs)
+        if len(idempotency_key) > 255:
+            return Response({'detail': 'Idempotency-Key must be at most 255 characters.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        key_hash = hashlib.sha256(f'{request.path} {idempotency_key}'.encode()).hexdigest()
+        cache_key = f'idempotency_{request.user.pk}_{key_hash}'
+        lock_key = f'{cache_key}_lock'
+        fingerprint = _request_fingerprint(request)
+
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            stored = cache.get(cache_key)
+            if stored is not None:
+                return _replay(stored, fingerprint)
+            lock_token = acquire_lock(lock_key, settings.IDEMPOTENCY_LOCK_SECONDS)
+            if lock_token is not None:
+                break
+            if time.monotonic() >= deadline:
+                return Response({'detail': 'A request with this Idempotency-Key is in progress.'},
+                                status=status.HTTP_409_CONFLICT)
+            time.sleep(0.05)
+
+        try:
+            # The first request may have finished between the lookup and the lock
+            stored = cache.get(cache_key)
+            if stored is not None:
+                return _replay(stored, fingerprint)
+            try:
+                response = view_func(self, request, *args, **kwargs)
+            except Exception as exc:
+                # Store error responses too, e.g. a book that is not available
+                response = self.handle_exception(exc)
+            if response.status_code < 500:
+                cache.set(cache_key, {
+                    'fingerprint': fingerprint,
+                    'status': response.status_code,
+                    'data': response.data,
+                    'headers': {
+                        name: response[name] for name in ('Location',) if name in response
+                    },
+                }, settings.IDEMPOTENCY_REPLAY_SECONDS)
+            return response
+        finally:
+            release_lock(lock_key, lock_token)
+    return _wrapped_view
+
+
+def _replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        return Response({'detail': 'Idempotency-Key was already used with a different request.'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    response = Response(stored['data'], status=stored['status'], headers=stored['headers'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def get_book_search_index():
+    """Return the process-wide search index, (re)building it from the database
+    when it has not been built yet or is older than its max age.
+    """
+    if book_search_index.is_stale():
+        rows = Book.objects.values_list('book_id', 'title', 'author', 'isbn')
+        book_search_index.rebuild(rows.iterator(chunk_size=2000))
+    return book_search_index
@@ -1,18 +1,62 @@
+import uuid
 import logging
 import asyncio
+import contextvars
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from rest_framework import status, permissions, generics, mixins, viewsets
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.views import APIView
 from rest_framework.serializers import ValidationError
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from requests.exceptions import RequestException
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from asgiref.sync import sync_to_async
+from django.urls import reverse
 from django.contrib.auth.models import User
+from django_backend.db_router import (
+    enable_replica_reads,
+    reset_replica_reads,
+    is_pinned_to_primary,
+    pin_to_primary,
+    user_pin_scope,
+    )
 from services.book_availability_service import AvailabilityService
+from services.library_selection import (
+    AmbiguousReservationError,
+    rank_candidates,
+    reserve_with_failover,
+    )
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiExample
 from drf_spectacular.types import OpenApiTypes
-from app.models import Book, Reservation
-from app.utils import cache_api_view
+from app.models import Book, IsbnAvailability, Reservation
+from app.tasks import complete_external_reservation, queue_external_release
+from app.utils import (
+    cache_api_view,
+    get_book_search_index,
+    get_external_availability,
+    idempotent_request,
+    )
+from app.pagination import BookSearchPagination
+from app.signals import availability_events, book_stock_changed
+from services.availability_events import availability_hub, format_sse
+from services.metrics import CONTENT_TYPE, registry
+from app.throttling import TokenBucketThrottle
 from app.serializers import (
+    BookProjection,
     BookSerializer,
+    BulkReservationSerializer,
+    IsbnAvailabilitySerializer,
+    ReservationProjection,
     ReservationSerializer,
+    ReservationStatusSerializer,
     # UserSerializer,
     UserRegistrationSerializer,
     ReturnBookSerializer)
@@ -21,14 +65,47 @@ from app.serializers import (
 logger = logging.getLogger(__name__)
 
 
-class BookViewSet(mixins.ListModelMixin,
+class ReplicaReadMixin:
+    """Serves safe (read-only) requests from a read replica, unless the user or one
+    of `primary_pin_scopes` has recently written to the primary.
+    """
+    primary_pin_scopes = ()
+
+    def get_primary_pin_scopes(self, request):
+        scopes = list(self.primary_pin_scopes)
+        if request.user.is_authenticated:
+            scopes.append(user_pin_scope(request.user))
+        return scopes
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (settings.DATABASE_REPLICAS
+                and request.method in permissions.SAFE_METHODS
+                and not is_pinned_to_primary(*self.get_primary_pin_scopes(request))):
+            self._replica_reads_token = enable_replica_reads()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_reads_token', None)
+        if token is not None:
+            reset_replica_reads(token)
+            self._replica_reads_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class BookViewSet(ReplicaReadMixin,
+                  mixins.ListModelMixin,
                   viewsets.GenericViewSet):
     """Book view accessible to all users.
-    Defines check_availability and search_by_isbn.
+    Defines check_availability, search, search_by_isbn and search_by_isbns.
     """
     queryset = Book.objects.all()
     serializer_class = BookSerializer
     permission_classes = [permissions.AllowAny]
+    # Catalog reads stay on the primary shortly after any Book change, see app.signals
+    primary_pin_scopes = ('books',)
+    # Set per action, see app.throttling
+    throttle_scope = None
+    max_isbns_per_lookup = 100
 
     @extend_schema(
         description="List all books. This list is cached, invalidation is supported by signals",
@@ -37,7 +114,8 @@ class BookViewSet(mixins.ListModelMixin,
     @cache_api_view('books_list', 60 * 5)
     def list(self, request, *args, **kwargs):
         """List all books. This list is cached, invalidation is also supported by signals"""
-        return super().list(request, *args, **kwargs)
+        # Rows are serialized without building Book instances, same output as BookSerializer
+        return Response(BookProjection.serialize(self.filter_queryset(self.get_queryset())))
 
     @extend_schema(
         description="Check availability of a book in internal and external libraries",
@@ -64,7 +142,10 @@ class BookViewSet(mixins.ListModelMixin,
             )
         ]
     )
-    @action(detail=True, methods=['get'])
+    @action(detail=True,
+            methods=['get'],
+            throttle_classes=[TokenBucketThrottle],
+            throttle_scope='check_availability')
     def check_availability(self, request, pk=None):
         """To search for a book in external libraries, it must be defined by ORM
         for proper ISBN enumeration
@@ -74,26 +155,24 @@ class BookViewSet(mixins.ListModelMixin,
             book = self.get_object()
             availability_service = AvailabilityService()
 
-            # Check availability in external libraries
-            external_availability = availability_service.check_book_availability_flask(book.isbn)
+            # Check availability in all external library networks, cached briefly
+            external_availability = get_external_availability(availability_service, book.isbn)
 
-            # Check availability across different objects based on ISBN
-            local_library_network = Book.objects.filter(isbn=book.isbn)
-            if local_library_network:
-                local_availability_data = [
-                        {
-                            'book_id': book.book_id,
-                            'library': book.library,
-                            'count_in_library': book.count_in_library
-                        } for book in local_library_network
-                ]
+            # Copies in all local libraries, their totals come from the indexed summary row
+            local_availability_data = list(Book.objects.filter(isbn=book.isbn).order_by(
+                'pk').values('book_id', 'library', 'count_in_library'))
+            network_summary = IsbnAvailability.objects.filter(isbn=book.isbn).first()
 
             availability_data = {
                 'book_title': book.title,
                 'author': book.author,
                 'isbn': book.isbn,
                 'local_library_network_availability': local_availability_data,
-                'external_availability': external_availability,
+                'local_library_network_summary': (IsbnAvailabilitySerializer(network_summary).data
+                                                  if network_summary else None),
+                'external_availability': external_availability['availability'],
+                # Providers that did not answer in time, their books are missing above
+                'external_availability_partial': external_availability['partial'],
             }
             return Response(availability_data)
         except Exception as e:
@@ -120,13 +199,93 @@ class BookViewSet(mixins.ListModelMixin,
         if isbn is None:
             return Response({"error": "Please provide correct ISBN"}, status=400)
 
-        books = self.queryset.filter(isbn=isbn)  # Already as str
+        books = BookProjection.serialize(self.queryset.filter(isbn=isbn))  # Already as str
 
         if len(books) < 1:
             return Response({"error": "No books found with provided ISBN"}, status=400)
 
-        serializer = self.get_serializer(books, many=True)
-        return Response(serializer.data)
+        return Response(books)
+
+    @extend_schema(
+        description="Ranked search of books by title, author or ISBN prefix",
+        parameters=[
+            OpenApiParameter(name='q', description='Search phrase', required=True, type=str),
+            OpenApiParameter(name='page', description='Page number', required=False, type=int),
+            OpenApiParameter(name='page_size',
+                             description='Results per page',
+                             required=False,
+                             type=int),
+        ],
+        responses={
+            200: OpenApiTypes.OBJECT,
+            400: OpenApiTypes.OBJECT
+        }
+    )
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Search books by title/author words or ISBN prefix using the in-process
+        inverted index. Results are ranked by relevance and paginated.
+        """
+        query = request.query_params.get('q', '').strip()
+
+        if not query:
+            return Response({"error": "Please provide a search phrase"}, status=400)
+
+        ranked = get_book_search_index().search(query)
+        paginator = BookSearchPagination()
+        page = paginator.paginate_queryset(ranked, request, view=self)
+
+        # Stock and library are always read from the database for the current page only
+        books = self.queryset.in_bulk([book_id for book_id, _ in page])
+        network_summaries = IsbnAvailability.objects.in_bulk(
+            {book.isbn for book in books.values()})
+        results = [
+            dict(self.get_serializer(books[book_id]).data,
+                 score=score,
+                 network_copies=(network_summaries[books[book_id].isbn].total_copies
+                                 if books[book_id].isbn in network_summaries else 0))
+            for book_id, score in page if book_id in books
+        ]
+        return paginator.get_paginated_response(results)
+
+    @extend_schema(
+        description="Resolve many ISBNs at once",
+        parameters=[
+            OpenApiParameter(name='isbns',
+                             description='Comma separated list of ISBNs',
+                             required=True,
+                             type=str)
+        ],
+        responses={
+            200: OpenApiTypes.OBJECT,
+            400: OpenApiTypes.OBJECT
+        }
+    )
+    @action(detail=False, methods=['get'])
+    def search_by_isbns(self, request):
+        """Search internally for many ISBNs with a single query, e.g. for a desk
+        scanner resolving a whole stack of books.
+        """
+        isbns = [isbn.strip() for isbn in request.query_params.get('isbns', '').split(',')]
+        isbns = list(dict.fromkeys(isbn for isbn in isbns if isbn))
+
+        if not isbns:
+            return Response({"error": "Please provide correct ISBNs"}, status=400)
+
+        if len(isbns) > self.max_isbns_per_lookup:
+            return Response(
+                {"error": f"At most {self.max_isbns_per_lookup} ISBNs can be resolved at once"},
+                status=400)
+
+        results = {isbn: [] for isbn in isbns}
+        books = self.queryset.filter(isbn__in=isbns).order_by('isbn', 'book_id')
+        for book in self.get_serializer(books, many=True).data:
+            results[book['isbn']].append(book)
+
+        return Response({
+            'results': results,
+            'not_found': [isbn for isbn, found in results.items() if not found],
+        })
 
 
 class ReturnBookView(generics.UpdateAPIView):
@@ -137,6 +296,14 @@ class ReturnBookView(generics.UpdateAPIView):
     @extend_schema(
         description="Return a book",
         request=ReturnBookSerializer,
+        parameters=[
+            OpenApiParameter(name='Idempotency-Key',
+                             location=OpenApiParameter.HEADER,
+                             description='Unique key, a retried request with the same key '
+                                         'replays the first response',
+                             required=False,
+                             type=str)
+        ],
         responses={
             200: OpenApiTypes.OBJECT,
             400: OpenApiTypes.OBJECT
@@ -148,6 +315,7 @@ class ReturnBookView(generics.UpdateAPIView):
             )
         ]
     )
+    @idempotent_request
     def update(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
@@ -163,7 +331,9 @@ class ReturnBookView(generics.UpdateAPIView):
     def perform_update(self, serializer, instance):
         # Using the serializer to update the reservation instance
         logger.info(f"Updating reservation instance ID: {instance.reservation_id}")
-        serializer.update(instance=instance, validated_data=serializer.validated_data)
+        with transaction.atomic():
+            serializer.update(instance=instance, validated_data=serializer.validated_data)
+        pin_to_primary(user_pin_scope(self.request.user))
 
 
 class BookListCreateView(generics.RetrieveUpdateDestroyAPIView,
@@ -191,7 +361,7 @@ class BookListCreateView(generics.RetrieveUpdateDestroyAPIView,
         return super().post(request, *args, **kwargs)
 
 
-class UserReservationListView(generics.ListAPIView):
+class UserReservationListView(ReplicaReadMixin, generics.ListAPIView):
     serializer_class = ReservationSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -202,38 +372,84 @@ class UserReservationListView(generics.ListAPIView):
     def get(self, request, *args, **kwargs):
         return super().get(request, *args, **kwargs)
 
+    def list(self, request, *args, **kwargs):
+        # Same output as ReservationSerializer, usernames are joined in the same query
+        return Response(ReservationProjection.serialize(self.filter_queryset(self.get_queryset())))
+
     def get_queryset(self):
         return Reservation.objects.filter(user=self.request.user)
 
 
-class ReserveBookView(generics.CreateAPIView):
+class BearerTokenMixin:
+    """The user's JWT, forwarded to external libraries."""
+    def extract_jwt_token(self):
+        auth_header = self.request.META.get('HTTP_AUTHORIZATION', '')
+        if not auth_header:
+            raise ValueError("Missing Authorization header")
+
+        try:
+            prefix, token = auth_header.split(' ')
+            if prefix.lower() != 'bearer':
+                raise ValueError("Invalid Authorization header format")
+            return token
+        except ValueError:
+            raise ValueError("Invalid Authorization header format")
+
+
+class ReserveBookView(BearerTokenMixin, generics.CreateAPIView):
     queryset = Reservation.objects.all()
     serializer_class = ReservationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'reserve'
 
     @extend_schema(
-        description="Reserve a book",
+        description="Reserve a book. If the book has to be reserved in an external library "
+                    "and async mode is on (EXTERNAL_RESERVATION_ASYNC or 'Prefer: respond-async' "
+                    "header), a pending reservation is returned with status 202 and a status URL",
         request=ReservationSerializer,
+        parameters=[
+            OpenApiParameter(name='Idempotency-Key',
+                             location=OpenApiParameter.HEADER,
+                             description='Unique key, a retried request with the same key '
+                                         'replays the first response',
+                             required=False,
+                             type=str)
+        ],
         responses={
             201: ReservationSerializer,
+            202: OpenApiTypes.OBJECT,
             400: OpenApiTypes.OBJECT
         }
     )
+    @idempotent_request
     def post(self, request, *args, **kwargs):
         return super().post(request, *args, **kwargs)
 
-    def extract_jwt_token(self):
-        auth_header = self.request.META.get('HTTP_AUTHORIZATION', '')
-        if not auth_header:
-            raise ValueError("Missing Authorization header")
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        reservation = serializer.instance
+
+        if reservation.external_status == Reservation.EXTERNAL_STATUS_PENDING:
+            status_url = reverse('reservation_status', args=[reservation.reservation_id])
+            return Response(
+                {
+                    'reservation_id': reservation.reservation_id,
+                    'external_status': reservation.external_status,
+                    'status_url': request.build_absolute_uri(status_url),
+                },
+                status=status.HTTP_202_ACCEPTED,
+                headers={'Location': status_url}
+            )
 
-        try:
-            prefix, token = auth_header.split(' ')
-            if prefix.lower() != 'bearer':
-                raise ValueError("Invalid Authorization header format")
-            return token
-        except ValueError:
-            raise ValueError("Invalid Authorization header format")
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    def use_async_external_reservation(self):
+        prefer = self.request.headers.get('Prefer', '')
+        return settings.EXTERNAL_RESERVATION_ASYNC or 'respond-async' in prefer
 
     def perform_create(self, serializer):
         book = serializer.validated_data['book']
@@ -244,43 +460,86 @@ class ReserveBookView(generics.CreateAPIView):
             token = self.extract_jwt_token()
             # Apply certain logic: if book is not available in the main library,
             #   then check external ones, and if is available continue with respective library
+            if book.count_in_library < 1 and self.use_async_external_reservation():
+                # Record a pending reservation, the external library is called by a Celery
+                #   task so the request does not wait for it
+                reservation = serializer.save(
+                    user=self.request.user,
+                    reservation_library='',
+                    is_external=True,
+                    external_status=Reservation.EXTERNAL_STATUS_PENDING,
+                    )
+                transaction.on_commit(lambda: complete_external_reservation.delay(
+                    reservation.reservation_id))
+                pin_to_primary(user_pin_scope(self.request.user))
+                return
+
             if book.count_in_library < 1:
                 # Check the availability from the external system using the service
-                external_availability = availability_service.check_book_availability_flask(book.isbn)
+                external_availability = availability_service.check_book_availability(book.isbn)
 
                 # Check book in external libraries
-                if not external_availability:
+                if not external_availability['availability']:
                     raise ValidationError("This book is not available in the \
                                         internal and external library system.")
 
-                # Select book PK from external API, currently uses the first on the list
-                #   API returns libraries with count of books > 0 in libraries
-                selected_book_external_pk, availability_details = list(external_availability.items())[0]
-
-                if not availability_details['count_in_library'] > 0:
-                    # TODO logging here
-                    raise ValidationError("Unexpected error, only available books from \
-                                        external API should be received.")
+                # Reserve book via the provider's endpoint (count - 1) in the best ranked
+                #   library, failing over to the next ones within the time budget
+                request_key = uuid.uuid4()
+                try:
+                    availability_details = reserve_with_failover(
+                        availability_service, external_availability['availability'], token,
+                        idempotency_key=str(request_key))
+                except AmbiguousReservationError as e:
+                    # The library may hold a copy for nobody, give it back in the background
+                    queue_external_release(self.request.user.id, e.candidate['provider'],
+                                           e.candidate['book_id'], request_key)
+                    raise ValidationError("The external library did not confirm the "
+                                          "reservation, please try again.")
+                if availability_details is None:
+                    raise ValidationError(
+                        "This book could not be reserved in any external library.")
 
                 reservation_library = availability_details['library']
-                # Reserve book via Flask endpoint (count - 1)
-                availability_service.reserve_book_external_api(selected_book_external_pk, token)
                 is_external = True
+                external_fields = {
+                    'external_provider': availability_details['provider'],
+                    'external_book_id': availability_details['book_id'],
+                    'external_request_key': request_key,
+                }
 
             else:
                 # Process with a 'Main Library'
                 reservation_library = book.library
-                # Decrease the available copies count and create the reservation
-                book.count_in_library -= 1
-                book.save()
                 is_external = False
-
-            if serializer.is_valid():
-                serializer.save(
-                    user=self.request.user,
-                    reservation_library=reservation_library,
-                    is_external=is_external,
-                    )
+                external_fields = {}
+
+            # Stock, its IsbnAvailability summary and the reservation change together
+            with transaction.atomic():
+                if not is_external:
+                    # Take a copy with a conditional decrement, of concurrent reservations
+                    #   of the last copy only one succeeds and the stock is never overwritten
+                    taken = Book.objects.filter(
+                        book_id=book.book_id, count_in_library__gt=0
+                    ).update(count_in_library=F('count_in_library') - 1)
+                    if not taken:
+                        raise ValidationError("This book is no longer available.")
+                    # Conditional updates bypass the Book signals
+                    isbns = {book.isbn}
+                    IsbnAvailability.objects.refresh(isbns)
+                    transaction.on_commit(
+                        lambda: book_stock_changed.send(sender=Book, isbns=isbns))
+
+                if serializer.is_valid():
+                    serializer.save(
+                        user=self.request.user,
+                        reservation_library=reservation_library,
+                        is_external=is_external,
+                        external_status=(Reservation.EXTERNAL_STATUS_CONFIRMED if is_external
+                                         else Reservation.EXTERNAL_STATUS_NONE),
+                        **external_fields,
+                        )
+            pin_to_primary(user_pin_scope(self.request.user))
         except ValidationError as e:
             logger.error(f"Validation error while reserving book '{book.title}': {str(e)}")
             raise e
@@ -289,6 +548,218 @@ class ReserveBookView(generics.CreateAPIView):
             raise ValidationError("An error occurred while reserving the book")
 
 
+class BulkReserveBookView(BearerTokenMixin, generics.GenericAPIView):
+    """
+    Reserve several books with one request, e.g. a reading list.
+
+    Books out of stock locally are reserved in external libraries first, with one
+    batched call per provider. Then all local books are locked in primary key order,
+    each one is decremented with a conditional UPDATE and all reservations are created
+    with one bulk INSERT in the same transaction.
+    """
+    serializer_class = BulkReservationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'reserve_bulk'
+
+    @extend_schema(
+        description="Reserve up to BULK_RESERVATION_MAX_BOOKS books. The result says for every "
+                    "book whether it was reserved, 201 if at least one was, 400 otherwise",
+        request=BulkReservationSerializer,
+        parameters=[
+            OpenApiParameter(name='Idempotency-Key',
+                             location=OpenApiParameter.HEADER,
+                             description='Unique key, a retried request with the same key '
+                                         'replays the first response',
+                             required=False,
+                             type=str)
+        ],
+        responses={
+            201: OpenApiTypes.OBJECT,
+            400: OpenApiTypes.OBJECT
+        }
+    )
+    @idempotent_request
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        book_ids = serializer.validated_data['book_ids']
+
+        books = Book.objects.in_bulk(book_ids)
+        results = {book_id: {'book_id': book_id, 'reserved': False} for book_id in book_ids}
+        for book_id in book_ids:
+            if book_id not in books:
+                results[book_id]['detail'] = 'Book does not exist'
+
+        out_of_stock = [book for book in books.values() if book.count_in_library < 1]
+        external, token = {}, None
+        if out_of_stock:
+            try:
+                token = self.extract_jwt_token()
+                external = self.reserve_external(out_of_stock, token, results)
+            except ValueError as e:
+                for book in out_of_stock:
+                    results[book.book_id]['detail'] = str(e)
+
+        try:
+            self.reserve(books, external, results)
+        except Exception as e:
+            logger.error(f"Error while reserving books {book_ids}: {str(e)}")
+            self.release_external(external, token)
+            raise ValidationError("An error occurred while reserving the books")
+
+        pin_to_primary(user_pin_scope(request.user))
+        reserved = any(result['reserved'] for result in results.values())
+        response_status = status.HTTP_201_CREATED if reserved else status.HTTP_400_BAD_REQUEST
+        return Response({'results': list(results.values())}, status=response_status)
+
+    def reserve(self, books, external, results):
+        """Take one local copy of every book in stock and create all reservations."""
+        reserved_until = timezone.now() + timedelta(days=30)
+        in_stock = sorted(book.book_id for book in books.values() if book.count_in_library > 0)
+        reservations = []
+        with transaction.atomic():
+            # Locked in primary key order, so concurrent bulk reservations cannot deadlock
+            locked = Book.objects.select_for_update().filter(
+                book_id__in=in_stock).order_by('book_id').values_list('book_id', 'isbn', 'library')
+            changed_isbns = set()
+            for book_id, isbn, library in locked:
+                if Book.objects.filter(book_id=book_id, count_in_library__gt=0).update(
+                        count_in_library=F('count_in_library') - 1):
+                    changed_isbns.add(isbn)
+                    reservations.append(Reservation(user=self.request.user, book_id=book_id,
+                                                    reserved_until=reserved_until,
+                                                    reservation_library=library))
+                else:
+                    results[book_id]['detail'] = 'Book is no longer available'
+            for book_id, details in external.items():
+                reservations.append(Reservation(
+                    user=self.request.user, book_id=book_id,
+                    reserved_until=reserved_until,
+                    reservation_library=details['library'],
+                    is_external=True,
+                    external_status=Reservation.EXTERNAL_STATUS_CONFIRMED,
+                    external_provider=details['provider'],
+                    external_book_id=details['book_id'],
+                    external_request_key=details['request_key']))
+            Reservation.objects.bulk_create(reservations)
+
+            # Conditional updates bypass the Book signals
+            if changed_isbns:
+                IsbnAvailability.objects.refresh(changed_isbns)
+                transaction.on_commit(
+                    lambda: book_stock_changed.send(sender=Book, isbns=changed_isbns))
+
+            if reservations and reservations[0].reservation_id is None:
+                # MySQL does not return the ids of bulk inserted rows
+                ids = dict(Reservation.objects.filter(
+                    user=self.request.user,
+                    reserved_until=reserved_until,
+                    book_id__in=[reservation.book_id for reservation in reservations]
+                ).values_list('book_id', 'reservation_id'))
+                for reservation in reservations:
+                    reservation.reservation_id = ids.get(reservation.book_id)
+
+        for reservation in reservations:
+            results[reservation.book_id].update({
+                'reserved': True,
+                'reservation_id': reservation.reservation_id,
+                'reservation_library': reservation.reservation_library,
+                'is_external': reservation.is_external,
+                'reserved_until': reserved_until,
+            })
+
+    def reserve_external(self, books, token, results):
+        """
+        Reserve books out of local stock in external libraries. Availability of all ISBNs
+        is checked in parallel, each book goes to its best ranked library and the books
+        of one provider are reserved with a single batched call.
+
+        Returns:
+        - dict: book_id -> availability entry of the library holding the reservation.
+        """
+        availability_service = AvailabilityService()
+        isbns = {book.isbn for book in books}
+        max_workers = min(len(isbns), settings.EXTERNAL_PROVIDERS_MAX_WORKERS)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                isbn: executor.submit(contextvars.copy_context().run,
+                                      availability_service.check_book_availability, isbn)
+                for isbn in isbns
+            }
+        availability = {}
+        for isbn, future in futures.items():
+            try:
+                availability[isbn] = future.result()['availability']
+            except (RequestException, KeyError, ValueError) as e:
+                logger.error(f"Error checking external availability of {isbn}: {str(e)}")
+
+        chosen = {}
+        books_per_provider = defaultdict(list)
+        chosen_isbns = set()
+        for book in books:
+            if book.isbn not in availability:
+                results[book.book_id]['detail'] = 'External libraries did not answer'
+            elif not availability[book.isbn]:
+                results[book.book_id]['detail'] = 'Book is not available in any library'
+            elif book.isbn in chosen_isbns:
+                results[book.book_id]['detail'] = 'A copy of this ISBN is already being reserved'
+            else:
+                candidate = rank_candidates(
+                    list(availability[book.isbn].values()),
+                    default_latency=settings.EXTERNAL_PROVIDER_TIMEOUT / 2)[0]
+                # Own key per copy, as single reservations have, so its release is keyed too
+                chosen[book.book_id] = {**candidate, 'request_key': uuid.uuid4()}
+                chosen_isbns.add(book.isbn)
+                books_per_provider[candidate['provider']].append(book.book_id)
+
+        reserved = {}
+        for provider, book_ids in books_per_provider.items():
+            try:
+                outcome = availability_service.reserve_books_external_api(
+                    [chosen[book_id]['book_id'] for book_id in book_ids], token, provider=provider,
+                    idempotency_keys=[chosen[book_id]['request_key'] for book_id in book_ids])
+            except (RequestException, KeyError, ValueError):
+                for book_id in book_ids:
+                    results[book_id]['detail'] = 'External library did not answer'
+                continue
+            for book_id in book_ids:
+                if outcome.get(str(chosen[book_id]['book_id'])):
+                    reserved[book_id] = chosen[book_id]
+                else:
+                    results[book_id]['detail'] = 'External library rejected the reservation'
+        return reserved
+
+    def release_external(self, external, token):
+        """Give back external copies of reservations that could not be saved."""
+        availability_service = AvailabilityService()
+        for details in external.values():
+            try:
+                availability_service.release_book_external_api(
+                    details['book_id'], token, provider=details['provider'],
+                    idempotency_key=details['request_key'])
+            except (RequestException, KeyError, ValueError) as e:
+                logger.error(f"Could not release external book {details['book_id']}: {str(e)}")
+
+
+class ReservationStatusView(ReplicaReadMixin, generics.RetrieveAPIView):
+    """
+    Status of a user's reservation, polled by clients after an async (202) reservation.
+    """
+    serializer_class = ReservationStatusSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    @extend_schema(
+        description="Get status of the current user's reservation",
+        responses={200: ReservationStatusSerializer}
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return Reservation.objects.filter(user=self.request.user)
+
+
 class UserRegistrationView(generics.CreateAPIView):
     """
     View for user registration.
@@ -321,3 +792,65 @@ class UserRegistrationView(generics.CreateAPIView):
             {"status": "User registered successfully"},
             status=status.HTTP_201_CREATED
         )
+
+
+class CacheStatsView(APIView):
+    """
+    View exposing L1/L2 hit ratios of the two-tier cache in the serving process.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(
+        description="Two-tier cache statistics of the worker serving the request",
+        responses={200: OpenApiTypes.OBJECT}
+    )
+    def get(self, request, *args, **kwargs):
+        if not hasattr(cache, 'stats'):
+            return Response({"error": "Cache backend does not expose statistics"},
+                            status=status.HTTP_404_NOT_FOUND)
+        return Response(cache.stats())
+
+
+@require_GET
+async def availability_stream(request):
+    """
+    Server-Sent Events stream of local availability of the ISBNs in ?isbns=a,b.
+    Sends the current summary of each ISBN first, then an event whenever its stock
+    changes. Needs to be served by an ASGI server.
+    """
+    isbns = [isbn.strip() for isbn in request.GET.get('isbns', '').split(',')]
+    isbns = list(dict.fromkeys(isbn for isbn in isbns if isbn))
+    if not isbns:
+        return JsonResponse({"error": "Please provide ISBNs"}, status=400)
+    if len(isbns) > settings.SSE_MAX_ISBNS:
+        return JsonResponse({"error": f"At most {settings.SSE_MAX_ISBNS} ISBNs are allowed"},
+                            status=400)
+
+    async def events():
+        async with availability_hub.subscribe(isbns) as queue:
+            # Subscribed first, so no change between the snapshot and the stream is lost
+            for event in await sync_to_async(availability_events)(isbns):
+                yield format_sse(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(),
+                                                   timeout=settings.SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Disables response buffering in nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_GET
+def metrics(request):
+    """
+    Metrics of the serving process in the Prometheus text exposition format,
+    meant to be scraped from the internal network.
+    """
+    return HttpResponse(registry.expose(), content_type=CONTENT_TYPE)
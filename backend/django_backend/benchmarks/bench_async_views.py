@@ -0,0 +1,187 @@
+"""
+Benchmark of the sync DRF views against their async versions (app.async_views) at high
+concurrency, both served by one uvicorn worker of django_backend.asgi.
+
+Starts a stand-in external library answering after an injected latency and uvicorn with
+benchmarks.settings (no throttling, admission control or external availability cache),
+then sends the same requests to each sync/async pair of endpoints. Sync views run in
+uvicorn's thread pool, async views on the event loop. The sync books list is served by
+cache_api_view, the async one always reads the database.
+
+Needs the app's database and Redis (.env), a book to check and, for the reservations
+pair, a user's credentials.
+
+Usage (from backend/django_backend):
+    python -m benchmarks.bench_async_views --concurrency 200 --requests 2000 --latency 0.1 \
+        --book-id 1 --username user --password password
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import aiohttp
+
+
+def make_provider_handler(latency):
+    class StandInProviderHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            body = json.dumps({
+                '1': {'library': 'Stand-in Library', 'count_in_library': 1},
+            }).encode()
+            try:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, format, *args):
+            pass
+    return StandInProviderHandler
+
+
+def start_provider(latency):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_provider_handler(latency))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_uvicorn(port, provider_port):
+    env = {
+        **os.environ,
+        'DJANGO_SETTINGS_MODULE': 'benchmarks.settings',
+        'FLASK_HOST': '127.0.0.1',
+        'FLASK_PORT': str(provider_port),
+        'EXTERNAL_LIBRARY_PROVIDER_URLS': '',
+    }
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'django_backend.asgi:application',
+         '--port', str(port), '--workers', '1', '--log-level', 'warning'],
+        env=env,
+    )
+
+
+async def wait_until_ready(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f'{base_url}/api/metrics/') as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f'uvicorn did not start within {timeout}s')
+
+
+async def obtain_token(session, base_url, username, password):
+    async with session.post(f'{base_url}/api/token/',
+                            json={'username': username, 'password': password}) as response:
+        response.raise_for_status()
+        return (await response.json())['access']
+
+
+async def load(session, url, headers, requests, concurrency):
+    """Send `requests` GETs with at most `concurrency` in flight.
+    Returns latencies of 2xx answers, number of other answers and total seconds."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                async with session.get(url, headers=headers) as response:
+                    await response.read()
+                    ok = 200 <= response.status < 300
+            except aiohttp.ClientError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def report(label, latencies, errors, duration):
+    if not latencies:
+        print(f'{label:<28} no successful requests, {errors} errors')
+        return
+    latencies = sorted(latencies)
+    p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)]
+    print(f'{label:<28} {len(latencies) / duration:8.1f} req/s   '
+          f'median {statistics.median(latencies) * 1000:8.1f} ms   '
+          f'p95 {p95 * 1000:8.1f} ms   errors {errors}')
+
+
+async def run(args, base_url):
+    pairs = [
+        ('books list', '/api/books/', '/api/async/books/', False),
+        ('search_by_isbn', f'/api/books/search_by_isbn/?isbn={args.isbn}',
+         f'/api/async/books/search_by_isbn/?isbn={args.isbn}', False),
+        ('check_availability', f'/api/books/{args.book_id}/check_availability/',
+         f'/api/async/books/{args.book_id}/check_availability/', False),
+        ('reservations', '/api/reservations/', '/api/async/reservations/', True),
+    ]
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        headers = {}
+        if args.username:
+            token = await obtain_token(session, base_url, args.username, args.password)
+            headers = {'Authorization': f'Bearer {token}'}
+        for name, sync_path, async_path, needs_user in pairs:
+            if needs_user and not headers:
+                print(f'{name:<28} skipped, pass --username and --password')
+                continue
+            for label, path in ((f'{name} (sync)', sync_path), (f'{name} (async)', async_path)):
+                # Warm up connections and the views' first-request work
+                await load(session, base_url + path, headers, args.concurrency, args.concurrency)
+                report(label, *await load(session, base_url + path, headers,
+                                          args.requests, args.concurrency))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--concurrency', type=int, default=200, help='Requests in flight')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per endpoint')
+    parser.add_argument('--latency', type=float, default=0.1,
+                        help='Latency in seconds of the stand-in external library')
+    parser.add_argument('--port', type=int, default=8765, help='Port of the uvicorn server')
+    parser.add_argument('--book-id', type=int, default=1, help='Book of check_availability')
+    parser.add_argument('--isbn', default='1234567890123', help='ISBN of search_by_isbn')
+    parser.add_argument('--username', help='User whose reservations are listed')
+    parser.add_argument('--password')
+    args = parser.parse_args()
+
+    provider = start_provider(args.latency)
+    server = start_uvicorn(args.port, provider.server_port)
+    base_url = f'http://127.0.0.1:{args.port}'
+    try:
+        asyncio.run(wait_until_ready(base_url))
+        print(f'uvicorn, 1 worker, concurrency {args.concurrency}, {args.requests} requests per '
+              f'endpoint, external library latency {args.latency}s')
+        asyncio.run(run(args, base_url))
+    finally:
+        server.terminate()
+        server.wait()
+        provider.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark of AvailabilityService.check_book_availability against local stand-in providers.
+
+Starts one HTTP server per provider answering /books/<isbn>/availability after an injected
+latency, then compares querying the providers one after another with the parallel,
+deadline-bound federated query.
+
+Usage (from backend/django_backend):
+    python -m benchmarks.bench_federated_availability --latencies 0.05,0.1,0.2,1.5 --deadline 0.5
+"""
+import json
+import time
+import argparse
+import statistics
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(EXTERNAL_LIBRARY_PROVIDERS={}, EXTERNAL_PROVIDERS_MAX_WORKERS=16)
+
+from services.book_availability_service import AvailabilityService  # noqa: E402
+
+
+def make_handler(name, latency):
+    class StandInProviderHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            body = json.dumps({
+                '1': {'library': f'{name} Library', 'count_in_library': 1},
+            }).encode()
+            try:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client gave up after the provider's deadline
+                pass
+
+        def log_message(self, format, *args):
+            pass
+    return StandInProviderHandler
+
+
+def start_providers(latencies):
+    servers = []
+    for index, latency in enumerate(latencies):
+        name = f'provider_{index + 1}'
+        server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(name, latency))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append((name, server))
+    return servers
+
+
+def sequential_check(service, isbn):
+    """Baseline, each provider is asked in turn as with a single Flask base URL."""
+    availability = {}
+    for name, provider in service.providers.items():
+        try:
+            for book_id, details in service._fetch_provider_availability(provider, isbn).items():
+                availability[f'{name}:{book_id}'] = details
+        except Exception:
+            pass
+    return availability
+
+
+def measure(func, iterations):
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return timings, result
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    p95 = timings[max(int(len(timings) * 0.95) - 1, 0)]
+    print(f'{label:<12} median {statistics.median(timings) * 1000:8.1f} ms   '
+          f'p95 {p95 * 1000:8.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--latencies', default='0.05,0.1,0.2,1.5',
+                        help='Comma separated latency in seconds of each stand-in provider')
+    parser.add_argument('--deadline', type=float, default=0.5,
+                        help='Per-provider deadline in seconds')
+    parser.add_argument('--iterations', type=int, default=10)
+    args = parser.parse_args()
+
+    latencies = [float(latency) for latency in args.latencies.split(',')]
+    servers = start_providers(latencies)
+    service = AvailabilityService(providers={
+        name: {'base_url': f'http://127.0.0.1:{server.server_port}',
+               # The sequential baseline waits for every provider
+               'timeout': max(latencies) + 1}
+        for name, server in servers
+    })
+    sequential_timings, _ = measure(lambda: sequential_check(service, '1234567890123'),
+                                    args.iterations)
+
+    for name, server in servers:
+        service.register_provider(name, f'http://127.0.0.1:{server.server_port}', args.deadline)
+    federated_timings, result = measure(lambda: service.check_book_availability('1234567890123'),
+                                        args.iterations)
+
+    print(f'{len(servers)} providers, latencies {latencies}s, deadline {args.deadline}s, '
+          f'{args.iterations} iterations')
+    report('sequential', sequential_timings)
+    report('federated', federated_timings)
+    print(f"federated: {len(result['availability'])} results, "
+          f"partial providers: {result['partial']}")
+
+    for _, server in servers:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+"""
+Settings of the app for benchmarks/bench_async_views.py: throttling, admission control and
+the external availability cache are off, so every request does the work being measured.
+"""
+from django_backend.settings import *  # noqa: F401,F403
+from django_backend.settings import REST_FRAMEWORK
+
+REST_FRAMEWORK = {**REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}}
+ADMISSION_CONTROL_ENDPOINTS = {}
+EXTERNAL_AVAILABILITY_CACHE_SECONDS = 0
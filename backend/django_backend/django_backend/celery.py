@@ -1,5 +1,11 @@
 import os
+import time
 from celery import Celery
+from django.conf import settings
+from billiard.process import current_process
+from celery.signals import before_task_publish, task_prerun, task_postrun, worker_process_init
+from services.metrics import registry, start_metrics_server
+from services.tracing import tracer, SPAN_KIND_CONSUMER
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_backend.settings')
 
@@ -11,8 +17,66 @@ celery_app.autodiscover_tasks()
 
 # Celery Beat schedule
 celery_app.conf.beat_schedule = {
-    'check-reservation-deadlines-every-day': {
+    'check-reservation-deadlines-every-15-minutes': {
         'task': 'app.tasks.check_reservation_deadlines',
-        'schedule': 86400,  # once every 24 hours
+        'schedule': 60 * 15,  # small incremental scans instead of one daily burst
+    },
+    'expire-overdue-reservations-every-10-minutes': {
+        'task': 'app.tasks.expire_overdue_reservations',
+        'schedule': 60 * 10,
+    },
+    'warm-invalidated-caches': {
+        'task': 'app.tasks.warm_invalidated_caches',
+        'schedule': settings.CACHE_WARMUP_CHECK_SECONDS,
     },
 }
+
+
+TASK_SECONDS = registry.histogram(
+    'celery_task_duration_seconds',
+    'Duration of Celery tasks by task name and final state.',
+    ('task', 'state'),
+)
+_task_started = {}
+_task_spans = {}
+
+
+@before_task_publish.connect
+def inject_trace_context(headers=None, **kwargs):
+    """Tasks queued during a traced request continue its trace in the worker."""
+    if headers is not None:
+        tracer.inject(headers)
+
+
+@task_prerun.connect
+def record_task_start(task_id=None, task=None, **kwargs):
+    _task_started[task_id] = time.monotonic()
+    span = tracer.begin(f'task {task.name}', SPAN_KIND_CONSUMER,
+                        traceparent=getattr(task.request, 'traceparent', None)
+                        or (task.request.headers or {}).get('traceparent'),
+                        attributes={'celery.task_id': task_id})
+    if span is not None:
+        _task_spans[task_id] = (span, tracer.activate(span))
+
+
+@task_postrun.connect
+def record_task_duration(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_SECONDS.observe(time.monotonic() - started, task.name, state or 'UNKNOWN')
+    span, token = _task_spans.pop(task_id, (None, None))
+    if span is not None:
+        span.set_attribute('celery.state', state or 'UNKNOWN')
+        if state == 'FAILURE':
+            span.set_error('Task failed')
+        tracer.finish(span, token)
+
+
+@worker_process_init.connect
+def start_worker_metrics_server(**kwargs):
+    """Every prefork child has its own metrics, child N serves them on
+    CELERY_METRICS_PORT + N.
+    """
+    port = os.getenv('CELERY_METRICS_PORT')
+    if port:
+        start_metrics_server(int(port) + getattr(current_process(), 'index', 0))
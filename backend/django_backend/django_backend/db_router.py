@@ -0,0 +1,83 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+
+PRIMARY_DB = 'default'
+
+# Set only while a read-only endpoint is being served, see app.views.ReplicaReadMixin
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def replica_reads_enabled():
+    return _replica_reads.get()
+
+
+def enable_replica_reads():
+    """Route reads of the current request/task to replicas. Returns a token for
+    `reset_replica_reads`.
+    """
+    return _replica_reads.set(True)
+
+
+def reset_replica_reads(token):
+    _replica_reads.reset(token)
+
+
+@contextmanager
+def replica_reads():
+    token = enable_replica_reads()
+    try:
+        yield
+    finally:
+        reset_replica_reads(token)
+
+
+def _pin_key(scope):
+    return f'db_primary_pin_{scope}'
+
+
+def user_pin_scope(user):
+    return f'user_{user.pk}'
+
+
+def pin_to_primary(scope):
+    """Keep reads for the given scope (e.g. 'user_<id>' or 'books') on the primary
+    for DATABASE_REPLICA_STICKY_SECONDS, so a client reads its own writes.
+    """
+    if not settings.DATABASE_REPLICAS:
+        return
+    cache.set(_pin_key(scope), True, settings.DATABASE_REPLICA_STICKY_SECONDS)
+
+
+def is_pinned_to_primary(*scopes):
+    if not scopes:
+        return False
+    return bool(cache.get_many([_pin_key(scope) for scope in scopes]))
+
+
+class PrimaryReplicaRouter:
+    """Sends writes to the primary and reads to a random replica, but only for
+    reads explicitly marked as safe via `replica_reads`. Everything else,
+    including read-after-write paths, stays on the primary.
+    """
+    def _choose_replica(self):
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_read(self, model, **hints):
+        if settings.DATABASE_REPLICAS and replica_reads_enabled():
+            return self._choose_replica()
+        return PRIMARY_DB
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY_DB
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY_DB, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY_DB
@@ -1,4 +1,5 @@
 import os
+import math
 from datetime import timedelta
 from pathlib import Path
 from dotenv import load_dotenv
@@ -39,10 +40,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.TracingMiddleware',
+    'app.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'app.middleware.AdmissionControlMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     # 'services.aes_encryption.DecryptJWTMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -89,6 +93,26 @@ DATABASES = {
     }
 }
 
+# Read replicas, comma separated hosts e.g. DATABASE_REPLICA_HOSTS=replica-1,replica-2
+# Only endpoints marked as read-only are routed to replicas, see app.views.ReplicaReadMixin
+DATABASE_REPLICAS = []
+for index, replica_host in enumerate(
+        host for host in os.getenv('DATABASE_REPLICA_HOSTS', '').split(',') if host):
+    replica_alias = f'replica_{index + 1}'
+    DATABASES[replica_alias] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    }
+    DATABASE_REPLICAS.append(replica_alias)
+
+DATABASE_ROUTERS = ['django_backend.db_router.PrimaryReplicaRouter']
+
+# Seconds during which reads stay on the primary after a user's own write
+DATABASE_REPLICA_STICKY_SECONDS = int(os.getenv('DATABASE_REPLICA_STICKY_SECONDS', 5))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -118,6 +142,16 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': (
         'drf_spectacular.openapi.AutoSchema'
         ),
+    # Token bucket rates of views with a throttle_scope, see app.throttling
+    # '<throttle_scope>_user' is per user, '<throttle_scope>_ip' per client IP
+    'DEFAULT_THROTTLE_RATES': {
+        'check_availability_user': '30/min',
+        'check_availability_ip': '120/min',
+        'reserve_user': '10/min',
+        'reserve_ip': '60/min',
+        'reserve_bulk_user': '3/min',
+        'reserve_bulk_ip': '20/min',
+    },
 }
 
 SIMPLE_JWT = {
@@ -164,19 +198,125 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Reservation reminders, see app.tasks.check_reservation_deadlines
+RESERVATION_REMINDER_DAYS = 3
+RESERVATION_REMINDER_CHUNK_SIZE = 200
+RESERVATION_REMINDER_MAX_CHUNKS = 10  # per run, the task runs every 15 minutes
+
+# External library networks queried in parallel by AvailabilityService.check_book_availability,
+# timeout is the provider's deadline in seconds. Partner networks are added as
+# EXTERNAL_LIBRARY_PROVIDER_URLS=name=http://host:port,other=http://host:port
+EXTERNAL_PROVIDER_TIMEOUT = float(os.getenv('EXTERNAL_PROVIDER_TIMEOUT', 2))
+EXTERNAL_LIBRARY_PROVIDERS = {
+    'flask': {
+        'base_url': f"http://{os.getenv('FLASK_HOST')}:{os.getenv('FLASK_PORT')}",
+        'timeout': EXTERNAL_PROVIDER_TIMEOUT,
+    },
+}
+for provider in filter(None, os.getenv('EXTERNAL_LIBRARY_PROVIDER_URLS', '').split(',')):
+    provider_name, provider_url = provider.split('=', 1)
+    EXTERNAL_LIBRARY_PROVIDERS[provider_name.strip()] = {
+        'base_url': provider_url.strip(),
+        'timeout': EXTERNAL_PROVIDER_TIMEOUT,
+    }
+EXTERNAL_PROVIDERS_MAX_WORKERS = 16
+# Connections of the aiohttp session of one async availability check
+EXTERNAL_ASYNC_HTTP_POOL_SIZE = 100
+# Reservations fail over between external libraries ranked by recent latency, error
+# rate and stock (services.library_selection), all attempts share the budget (seconds)
+EXTERNAL_RESERVATION_BUDGET = float(os.getenv('EXTERNAL_RESERVATION_BUDGET', 8))
+EXTERNAL_RESERVATION_ATTEMPT_TIMEOUT = 5
+LIBRARY_STATS_WINDOW = 50  # recent calls kept per library
+LIBRARY_STATS_MAX_AGE = 60 * 5
+
+# Idempotency-Key support for reserve/return, see app.utils.idempotent_request
+IDEMPOTENCY_REPLAY_SECONDS = 60 * 60 * 24
+IDEMPOTENCY_WAIT_SECONDS = 10  # max time a duplicate waits for the first request
+# Lock held by the first request, it must outlive the slowest reservation: the
+# availability check, all failover attempts and the release of an ambiguous one
+IDEMPOTENCY_LOCK_SECONDS = math.ceil(EXTERNAL_PROVIDER_TIMEOUT + EXTERNAL_RESERVATION_BUDGET
+                                     + EXTERNAL_RESERVATION_ATTEMPT_TIMEOUT) + 15
+
+# Books per request of the bulk reservation endpoint, see app.views.BulkReserveBookView
+BULK_RESERVATION_MAX_BOOKS = 20
+
+# Reserve books in external libraries from a Celery task and answer with 202,
+# clients can also ask for it per request with the 'Prefer: respond-async' header
+EXTERNAL_RESERVATION_ASYNC = os.getenv('EXTERNAL_RESERVATION_ASYNC') == 'True'
+
+# Overdue reservations, see app.tasks.expire_overdue_reservations
+RESERVATION_EXPIRY_CHUNK_SIZE = 1000
+RESERVATION_EXPIRY_MAX_CHUNKS = 50  # per run, the task runs every 10 minutes
+
+# Server-Sent Events of availability changes, see app.views.availability_stream
+AVAILABILITY_EVENTS_CHANNEL = 'availability_changes'
+AVAILABILITY_EVENTS_REDIS_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
+SSE_KEEPALIVE_SECONDS = 15
+SSE_MAX_ISBNS = 100
+
+# Admission control, see app.middleware.AdmissionControlMiddleware
+# Endpoint classes by URL name, endpoints of no class are never shed
+ADMISSION_CONTROL_ENDPOINTS = {
+    'book-check-availability': 'external',
+    'async-book-check-availability': 'external',
+    'reserve_book': 'external',
+    'reserve_books_bulk': 'external',
+}
+# Limits per worker process, the limit shrinks while latency (seconds) is above target
+ADMISSION_CONTROL_CLASSES = {
+    'external': {
+        'max_in_flight': int(os.getenv('ADMISSION_CONTROL_EXTERNAL_MAX_IN_FLIGHT', 32)),
+        'min_in_flight': 2,
+        'target_latency': 1.0,
+    },
+}
+ADMISSION_CONTROL_LATENCY_SMOOTHING = 0.2  # weight of the latest request in the latency EWMA
+
+# Tracing, spans are appended to <TRACING_EXPORT_DIR>/django.jsonl (OTLP/JSON lines),
+# see app.middleware.TracingMiddleware and manage.py trace_report. Off when empty.
+TRACING_EXPORT_DIR = os.getenv('TRACING_EXPORT_DIR', '')
+
 # Redis cache configuration
+# Two-tier cache: per-process L1 in front of Redis, kept coherent via Redis pub/sub
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "BACKEND": "services.two_tier_cache.TwoTierRedisCache",
         "LOCATION": [
             f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}",  # leader
             # "redis://127.0.0.1:6378",  # read-replica 1
             # "redis://127.0.0.1:6377",  # read-replica 2
         ],
         "TIMEOUT": 60 * 10,  # in seconds: 60 * 10 (10 minutes)
+        "OPTIONS": {
+            "L1_MAX_ENTRIES": 256,
+            "L1_TIMEOUT": 30,  # in seconds, upper bound of L1 staleness if a message is lost
+            # Values in L1 are shared objects, only keep read-only payloads there
+            "L1_KEY_PREFIXES": ["books_list"],
+            "INVALIDATION_CHANNEL": "cache_invalidation",
+        },
     }
 }
 
+# Single-flight recomputation of cached views, see app.utils.cache_api_view
+CACHE_API_VIEW_LOCK_SECONDS = 30  # upper bound of a rebuild, the lock expires afterwards
+CACHE_API_VIEW_WAIT_SECONDS = 2  # max time a request waits for another one's rebuild
+CACHE_API_VIEW_STALE_SECONDS = 60  # previous value served while a rebuild is running
+CACHE_API_VIEW_EARLY_REFRESH_BETA = 1.0  # > 1 refreshes earlier, < 1 later
+
+# External availability shown by check_availability, see app.utils.get_external_availability
+EXTERNAL_AVAILABILITY_CACHE_SECONDS = 30
+
+# Cache warm-up, see app.tasks.warm_caches and manage.py warm_caches
+# Cached views rebuilt by URL name, requested as application/json
+CACHE_WARMUP_URL_NAMES = ['book-list']
+CACHE_WARMUP_TOP_ISBNS = 50  # most reserved ISBNs whose external availability is fetched
+CACHE_WARMUP_RESERVATION_DAYS = 30  # reservations counted for the most reserved ISBNs
+CACHE_WARMUP_AVAILABILITY_RATE = 2.0  # max availability fetches per second
+# After an invalidation the catalog is rebuilt once no other invalidation came for
+# this many seconds, checked every CACHE_WARMUP_CHECK_SECONDS by Celery beat
+CACHE_WARMUP_DEBOUNCE_SECONDS = 5
+CACHE_WARMUP_CHECK_SECONDS = 10
+
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
 SESSION_CACHE_ALIAS = 'default'
 
@@ -0,0 +1,109 @@
+import json
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.core.cache import cache
+from services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+def publish_events(events):
+    """Publish availability events (dicts with an 'isbn' key) to the Redis channel
+    read by every AvailabilityEventHub, in one round trip.
+    """
+    if not events:
+        return
+    try:
+        client = cache.get_client(write=True)
+        pipeline = client.pipeline(transaction=False)
+        for event in events:
+            pipeline.publish(settings.AVAILABILITY_EVENTS_CHANNEL, json.dumps(event))
+        pipeline.execute()
+    except Exception as e:
+        logger.error(f"Error publishing availability events: {str(e)}")
+
+
+def format_sse(event, event_type='availability'):
+    return f"event: {event_type}\ndata: {json.dumps(event)}\n\n"
+
+
+class AvailabilityEventHub:
+    """Fans availability events out to the SSE connections of this process.
+
+    A single Redis pub/sub subscription per process (started with the first client)
+    serves all connections, each connection gets a bounded queue of the events of the
+    ISBNs it subscribed to. A slow client loses its oldest events, not the others'.
+    """
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)  # isbn -> set of asyncio.Queue
+        self._listener = None
+        self._loop = None
+
+    @asynccontextmanager
+    async def subscribe(self, isbns):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        for isbn in isbns:
+            self._subscribers[isbn].add(queue)
+        self._ensure_listener()
+        try:
+            yield queue
+        finally:
+            for isbn in isbns:
+                queues = self._subscribers.get(isbn)
+                if queues is not None:
+                    queues.discard(queue)
+                    if not queues:
+                        del self._subscribers[isbn]
+
+    @property
+    def connections(self):
+        return len(set().union(*self._subscribers.values())) if self._subscribers else 0
+
+    def dispatch(self, event):
+        for queue in self._subscribers.get(event.get('isbn'), ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def _ensure_listener(self):
+        loop = asyncio.get_running_loop()
+        if self._listener is None or self._listener.done() or self._loop is not loop:
+            self._loop = loop
+            self._listener = loop.create_task(self._listen())
+
+    async def _listen(self):
+        backoff = 0.5
+        while self._subscribers:
+            client = aioredis.from_url(settings.AVAILABILITY_EVENTS_REDIS_URL)
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(settings.AVAILABILITY_EVENTS_CHANNEL)
+                backoff = 0.5
+                while self._subscribers:
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message is not None and message['type'] == 'message':
+                        self.dispatch(json.loads(message['data']))
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Availability events subscriber disconnected: {str(e)}")
+            finally:
+                await pubsub.aclose()
+                await client.aclose()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+
+availability_hub = AvailabilityEventHub()
+
+registry.gauge(
+    'availability_sse_connections',
+    'Open Server-Sent Events connections in this process.',
+    callback=lambda: {(): availability_hub.connections},
+)
@@ -1,20 +1,128 @@
 import os
+import time
 import requests
 import logging
 import asyncio
 import aiohttp
+import threading
+import contextvars
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from django.conf import settings
 from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 from urllib3.util.retry import Retry
 from django.http import JsonResponse
+from services.metrics import registry
+from services.tracing import tracer, SPAN_KIND_CLIENT
+from services.library_selection import library_stats
 
 logger = logging.getLogger(__name__)
 
+# An external library network, see settings.EXTERNAL_LIBRARY_PROVIDERS
+ExternalProvider = namedtuple('ExternalProvider', ['name', 'base_url', 'timeout'])
+
+PROVIDER_OK = 'ok'
+PROVIDER_TIMEOUT = 'timeout'
+PROVIDER_ERROR = 'error'
+
+EXTERNAL_CALL_SECONDS = registry.histogram(
+    'availability_service_call_duration_seconds',
+    'Duration of AvailabilityService calls to external libraries by outcome.',
+    ('operation', 'provider', 'outcome'),
+)
+PROVIDER_RESULTS = registry.counter(
+    'availability_service_provider_results_total',
+    'Provider answers in check_book_availability: ok, timeout or error.',
+    ('provider', 'status'),
+)
+
+_provider_pool = None
+_provider_pool_lock = threading.Lock()
+# Provider name -> requests.Session, shared by the pool threads
+_provider_sessions = {}
+_provider_sessions_lock = threading.Lock()
+
+
+def get_provider_pool():
+    """Process-wide thread pool used to query providers in parallel."""
+    global _provider_pool
+    if _provider_pool is None:
+        with _provider_pool_lock:
+            if _provider_pool is None:
+                _provider_pool = ThreadPoolExecutor(
+                    max_workers=settings.EXTERNAL_PROVIDERS_MAX_WORKERS,
+                    thread_name_prefix='external-provider',
+                )
+    return _provider_pool
+
+
+def get_provider_session(name):
+    """Process-wide requests session of a provider, its connections are kept alive and
+    reused, up to EXTERNAL_PROVIDERS_MAX_WORKERS of them (one per pool thread).
+    """
+    session = _provider_sessions.get(name)
+    if session is None:
+        with _provider_sessions_lock:
+            session = _provider_sessions.get(name)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_maxsize=settings.EXTERNAL_PROVIDERS_MAX_WORKERS)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _provider_sessions[name] = session
+    return session
+
+
+def async_http_session():
+    """New aiohttp session for the async calls of one request, use it with `async with`
+    so it is closed. Its requests share EXTERNAL_ASYNC_HTTP_POOL_SIZE connections.
+    A session is bound to the event loop it was created in, and under WSGI every async
+    view runs in a loop of its own, so sessions are not kept between requests.
+    """
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+        limit=settings.EXTERNAL_ASYNC_HTTP_POOL_SIZE,
+        ttl_dns_cache=300,
+    ))
+
+
+def idempotency_headers(idempotency_key):
+    return {'Idempotency-Key': str(idempotency_key)} if idempotency_key else {}
+
 
 class AvailabilityService:
-    def __init__(self):
+    def __init__(self, providers=None):
+        """
+        Parameters:
+        - providers (dict): provider name -> {'base_url': str, 'timeout': float},
+          defaults to settings.EXTERNAL_LIBRARY_PROVIDERS.
+        """
         self.base_flask_api_url = f"http://{os.getenv('FLASK_HOST')}:{os.getenv('FLASK_PORT')}"
         self.session = self._get_retry_session()
+        # Without retries, used when failing over to another library instead
+        self.single_attempt_session = requests.Session()
+        if providers is None:
+            providers = settings.EXTERNAL_LIBRARY_PROVIDERS
+        self.providers = {}
+        for name, config in providers.items():
+            self.register_provider(name, config['base_url'], config['timeout'])
+
+    def register_provider(self, name, base_url, timeout):
+        """
+        Add an external library network queried by check_book_availability.
+
+        Parameters:
+        - name (str): Unique provider name, part of the merged availability keys.
+        - base_url (str): Base URL of a Flask-compatible library API.
+        - timeout (float): Deadline in seconds for the provider's answer.
+        """
+        self.providers[name] = ExternalProvider(name, base_url.rstrip('/'), timeout)
+
+    def get_provider(self, name):
+        try:
+            return self.providers[name]
+        except KeyError:
+            raise ValueError(f"Unknown external library provider: {name}")
 
     def _get_retry_session(self,
                            retries=3,
@@ -65,19 +173,185 @@ class AvailabilityService:
         try:
             response = self.session.get(request_flask_api_url, timeout=5)
             response.raise_for_status()
-            data = response.json()
-            data = {
-                key:
-                    {
-                        'library': value['library'],
-                        'count_in_library': value['count_in_library']
-                     } for key, value in data.items()
-                     }
-            return data
+            return self._parse_availability(response.json())
         except RequestException as e:
             logger.error(f"Error calling external API in check_book_availability_flask: {str(e)}")
             raise
 
+    @staticmethod
+    def _parse_availability(data):
+        return {
+            key: {
+                'library': value['library'],
+                'count_in_library': value['count_in_library']
+            } for key, value in data.items()
+        }
+
+    def _fetch_provider_availability(self, provider, isbn):
+        # No retries, they would not fit into the provider's deadline
+        started = time.monotonic()
+        outcome = PROVIDER_ERROR
+        try:
+            with tracer.span('GET /books/<isbn>/availability', SPAN_KIND_CLIENT,
+                             attributes={'peer.service': provider.name, 'isbn': isbn}):
+                response = get_provider_session(provider.name).get(
+                    f"{provider.base_url}/books/{isbn}/availability",
+                    timeout=provider.timeout, headers=tracer.inject({}))
+                response.raise_for_status()
+            data = self._parse_availability(response.json())
+            outcome = PROVIDER_OK
+            return data
+        finally:
+            # The real duration, also of answers that arrive after the deadline
+            duration = time.monotonic() - started
+            EXTERNAL_CALL_SECONDS.observe(duration, 'fetch_availability', provider.name, outcome)
+            library_stats.record(provider.name, duration, outcome == PROVIDER_OK)
+
+    def check_book_availability(self, isbn):
+        """
+        Queries all registered providers in parallel and merges their availability.
+
+        Each provider has its own deadline, a provider that fails or does not answer in
+        time is skipped and listed in 'partial', so one slow network does not hold up
+        the others.
+
+        Parameters:
+        - isbn (str): The ISBN of the book to check availability for.
+
+        Returns:
+        - dict: {
+            'availability': {'<provider>:<book_id>': {'provider', 'book_id', 'library',
+                                                      'count_in_library'}},
+            'partial': [names of providers that did not answer],
+            'providers': {name: 'ok' | 'timeout' | 'error'},
+          }
+          Only entries with available copies are returned, in provider order.
+
+        Raises:
+        - RequestException: if no provider answered.
+        """
+        started = time.monotonic()
+        pool = get_provider_pool()
+        futures = {
+            # Pool threads continue the caller's trace
+            name: pool.submit(contextvars.copy_context().run,
+                              self._fetch_provider_availability, provider, isbn)
+            for name, provider in self.providers.items()
+        }
+
+        availability = {}
+        statuses = {}
+        for name, future in futures.items():
+            remaining = started + self.providers[name].timeout - time.monotonic()
+            try:
+                data = future.result(timeout=max(remaining, 0))
+            except FutureTimeoutError:
+                future.cancel()
+                statuses[name] = PROVIDER_TIMEOUT
+                PROVIDER_RESULTS.inc(name, PROVIDER_TIMEOUT)
+                logger.warning(f"Provider {name} missed its deadline in check_book_availability")
+                continue
+            except (RequestException, KeyError, ValueError) as e:
+                statuses[name] = PROVIDER_ERROR
+                PROVIDER_RESULTS.inc(name, PROVIDER_ERROR)
+                logger.error(f"Error calling provider {name} in check_book_availability: {str(e)}")
+                continue
+
+            statuses[name] = PROVIDER_OK
+            PROVIDER_RESULTS.inc(name, PROVIDER_OK)
+            for book_id, details in data.items():
+                if details['count_in_library'] > 0:
+                    availability[f'{name}:{book_id}'] = {
+                        'provider': name, 'book_id': book_id, **details}
+
+        partial = [name for name, status in statuses.items() if status != PROVIDER_OK]
+        outcome = 'partial' if partial else PROVIDER_OK
+        if statuses and PROVIDER_OK not in statuses.values():
+            outcome = PROVIDER_ERROR
+        EXTERNAL_CALL_SECONDS.observe(time.monotonic() - started, 'check_availability', 'all',
+                                      outcome)
+        if outcome == PROVIDER_ERROR:
+            raise RequestException(f"No external library provider answered: {statuses}")
+        return {
+            'availability': availability,
+            'partial': partial,
+            'providers': statuses,
+        }
+
+    async def _afetch_provider_availability(self, session, provider, isbn):
+        started = time.monotonic()
+        outcome = PROVIDER_ERROR
+        try:
+            with tracer.span('GET /books/<isbn>/availability', SPAN_KIND_CLIENT,
+                             attributes={'peer.service': provider.name, 'isbn': isbn}):
+                async with session.get(
+                        f"{provider.base_url}/books/{isbn}/availability",
+                        headers=tracer.inject({})) as response:
+                    response.raise_for_status()
+                    data = self._parse_availability(await response.json())
+            outcome = PROVIDER_OK
+            return data
+        finally:
+            # Also recorded when the request is cancelled at the provider's deadline
+            duration = time.monotonic() - started
+            EXTERNAL_CALL_SECONDS.observe(duration, 'fetch_availability', provider.name, outcome)
+            library_stats.record(provider.name, duration, outcome == PROVIDER_OK)
+
+    async def acheck_book_availability(self, isbn):
+        """
+        Async version of check_book_availability for async views, with the same result
+        and errors. Providers are queried concurrently on the event loop through the
+        connection pool of one async_http_session, a provider's request is cancelled at
+        its deadline.
+        """
+        started = time.monotonic()
+        names = list(self.providers)
+        async with async_http_session() as session:
+            results = await asyncio.gather(*(
+                asyncio.wait_for(
+                    self._afetch_provider_availability(session, self.providers[name], isbn),
+                    timeout=self.providers[name].timeout)
+                for name in names
+            ), return_exceptions=True)
+
+        availability = {}
+        statuses = {}
+        for name, data in zip(names, results):
+            if isinstance(data, asyncio.TimeoutError):
+                statuses[name] = PROVIDER_TIMEOUT
+                PROVIDER_RESULTS.inc(name, PROVIDER_TIMEOUT)
+                logger.warning(f"Provider {name} missed its deadline in acheck_book_availability")
+                continue
+            if isinstance(data, (aiohttp.ClientError, KeyError, ValueError)):
+                statuses[name] = PROVIDER_ERROR
+                PROVIDER_RESULTS.inc(name, PROVIDER_ERROR)
+                logger.error(
+                    f"Error calling provider {name} in acheck_book_availability: {str(data)}")
+                continue
+            if isinstance(data, BaseException):
+                raise data
+
+            statuses[name] = PROVIDER_OK
+            PROVIDER_RESULTS.inc(name, PROVIDER_OK)
+            for book_id, details in data.items():
+                if details['count_in_library'] > 0:
+                    availability[f'{name}:{book_id}'] = {
+                        'provider': name, 'book_id': book_id, **details}
+
+        partial = [name for name, status in statuses.items() if status != PROVIDER_OK]
+        outcome = 'partial' if partial else PROVIDER_OK
+        if statuses and PROVIDER_OK not in statuses.values():
+            outcome = PROVIDER_ERROR
+        EXTERNAL_CALL_SECONDS.observe(time.monotonic() - started, 'check_availability', 'all',
+                                      outcome)
+        if outcome == PROVIDER_ERROR:
+            raise RequestException(f"No external library provider answered: {statuses}")
+        return {
+            'availability': availability,
+            'partial': partial,
+            'providers': statuses,
+        }
+
     async def async_check_book_availability_flask(self, isbn):
         """
         Asynchronously calls Flask API to check book availability in other libraries based on ISBN.
@@ -91,33 +365,38 @@ class AvailabilityService:
           is available and the count in each library.
         """
         request_flask_api_url = f"{self.base_flask_api_url}/books/{isbn}/availability"
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(request_flask_api_url, timeout=5) as response:
+        try:
+            async with async_http_session() as session:
+                async with session.get(request_flask_api_url,
+                                       timeout=aiohttp.ClientTimeout(total=5)) as response:
                     response.raise_for_status()
-                    data = await response.json()
-                    data = {
-                        key: {
-                            'library': value['library'],
-                            'count_in_library': value['count_in_library']
-                        } for key, value in data.items()
-                    }
-                    return data
-            except aiohttp.ClientError as e:
-                logger.error(f"Error calling external API in async_check_book_availability_flask: {str(e)}")
-                raise
-
-    def reserve_book_external_api(self, pk, token):
+                    return self._parse_availability(await response.json())
+        except aiohttp.ClientError as e:
+            logger.error(
+                f"Error calling external API in async_check_book_availability_flask: {str(e)}")
+            raise
+
+    def reserve_book_external_api(self, pk, token, provider=None, timeout=5, retry=True,
+                                  idempotency_key=None):
         """
         Calls Flask API to reserve a book in external library using a unique identifier.
 
         Parameters:
         - pk (int): The primary key or unique identifier of the book to reserve.
+        - provider (str): Name of the provider holding the book, defaults to the Flask API.
+        - timeout (float): Timeout of the request in seconds.
+        - retry (bool): Retry failed requests, disabled when failing over to other libraries.
+        - idempotency_key (str): Sent as Idempotency-Key, a repeated reservation with the
+          same key takes no second copy and release_book_external_api gives back only
+          the copy taken with it.
 
         Returns:
         - bool: True if the reservation is successful, False otherwise.
         """
-        request_flask_api_url = f"{self.base_flask_api_url}/book_reserved_external"
+        base_url = self.get_provider(provider).base_url if provider else self.base_flask_api_url
+        request_flask_api_url = f"{base_url}/book_reserved_external"
+        started = time.monotonic()
+        outcome = PROVIDER_ERROR
         try:
             if not token:
                 # Handle missing Authorization header
@@ -127,15 +406,123 @@ class AvailabilityService:
                 'Authorization': f'Bearer {token}',
                 'Content-Type': 'application/json'
             }
-            session = self.session
+            session = self.session if retry else self.single_attempt_session
             session.headers.update(headers)
-            response = session.post(request_flask_api_url, json={'book_id': pk}, timeout=5)
-            response.raise_for_status()
+            with tracer.span('POST /book_reserved_external', SPAN_KIND_CLIENT,
+                             attributes={'peer.service': provider or 'default', 'book_id': pk}):
+                request_headers = tracer.inject(idempotency_headers(idempotency_key))
+                response = session.post(request_flask_api_url, json={'book_id': pk},
+                                        timeout=timeout, headers=request_headers)
+                response.raise_for_status()
             data = response.json()
-            return data.get('message', '').lower().endswith('reserved successfully')
+            reserved = data.get('message', '').lower().endswith('reserved successfully')
+            outcome = PROVIDER_OK if reserved else 'rejected'
+            return reserved
         except RequestException as e:
             logger.error(f"Error calling external API in reserve_book_external_api: {str(e)}")
             raise
         except (KeyError, ValueError) as e:
             logger.error(f"Unexpected response format in reserve_book_external_api: {str(e)}")
             raise
+        finally:
+            EXTERNAL_CALL_SECONDS.observe(time.monotonic() - started, 'reserve',
+                                          provider or 'default', outcome)
+
+    def reserve_books_external_api(self, pks, token, provider=None, timeout=5,
+                                   idempotency_keys=None):
+        """
+        Calls Flask API to reserve several books of one provider with a single request.
+
+        Parameters:
+        - pks (list): Unique identifiers of the books to reserve.
+        - provider (str): Name of the provider holding the books, defaults to the Flask API.
+        - idempotency_keys (list): Key of the reservation of every book, in the order of
+          pks, lets each copy be released with release_book_external_api exactly once.
+
+        Returns:
+        - dict: str(pk) -> True if that book was reserved.
+        """
+        base_url = self.get_provider(provider).base_url if provider else self.base_flask_api_url
+        request_flask_api_url = f"{base_url}/books_reserved_external"
+        started = time.monotonic()
+        outcome = PROVIDER_ERROR
+        try:
+            if not token:
+                # Handle missing Authorization header
+                raise ValueError("Missing Authorization header")
+
+            headers = tracer.inject({
+                'Authorization': f'Bearer {token}',
+                'Content-Type': 'application/json'
+            })
+            with tracer.span('POST /books_reserved_external', SPAN_KIND_CLIENT,
+                             attributes={'peer.service': provider or 'default',
+                                         'books': len(pks)}):
+                payload = {'book_ids': [int(pk) for pk in pks]}
+                if idempotency_keys is not None:
+                    payload['idempotency_keys'] = [str(key) for key in idempotency_keys]
+                # Not retried, a repeated batch without keys could reserve the books twice
+                response = self.single_attempt_session.post(
+                    request_flask_api_url, json=payload, timeout=timeout, headers=headers)
+                response.raise_for_status()
+            results = response.json()['results']
+            outcome = PROVIDER_OK
+            return {str(pk): bool(results.get(str(pk))) for pk in pks}
+        except RequestException as e:
+            logger.error(f"Error calling external API in reserve_books_external_api: {str(e)}")
+            raise
+        except (KeyError, ValueError) as e:
+            logger.error(f"Unexpected response format in reserve_books_external_api: {str(e)}")
+            raise
+        finally:
+            EXTERNAL_CALL_SECONDS.observe(time.monotonic() - started, 'reserve_bulk',
+                                          provider or 'default', outcome)
+
+    def release_book_external_api(self, pk, token, provider=None, idempotency_key=None):
+        """
+        Calls Flask API to release a book reserved in external library, used to
+        compensate a reservation that could not be completed.
+
+        Parameters:
+        - pk (int): The primary key or unique identifier of the book to release.
+        - provider (str): Name of the provider holding the book, defaults to the Flask API.
+        - idempotency_key (str): Key the book was reserved with, only the copy it holds
+          is given back and releasing it again (or a copy never taken) changes nothing.
+
+        Returns:
+        - bool: True if the release is successful, False otherwise.
+        """
+        base_url = self.get_provider(provider).base_url if provider else self.base_flask_api_url
+        request_flask_api_url = f"{base_url}/book_released_external"
+        started = time.monotonic()
+        outcome = PROVIDER_ERROR
+        try:
+            if not token:
+                # Handle missing Authorization header
+                raise ValueError("Missing Authorization header")
+
+            headers = {
+                'Authorization': f'Bearer {token}',
+                'Content-Type': 'application/json'
+            }
+            session = self.session
+            session.headers.update(headers)
+            with tracer.span('POST /book_released_external', SPAN_KIND_CLIENT,
+                             attributes={'peer.service': provider or 'default', 'book_id': pk}):
+                request_headers = tracer.inject(idempotency_headers(idempotency_key))
+                response = session.post(request_flask_api_url, json={'book_id': pk}, timeout=5,
+                                        headers=request_headers)
+                response.raise_for_status()
+            data = response.json()
+            released = data.get('message', '').lower().endswith('released successfully')
+            outcome = PROVIDER_OK if released else 'rejected'
+            return released
+        except RequestException as e:
+            logger.error(f"Error calling external API in release_book_external_api: {str(e)}")
+            raise
+        except (KeyError, ValueError) as e:
+            logger.error(f"Unexpected response format in release_book_external_api: {str(e)}")
+            raise
+        finally:
+            EXTERNAL_CALL_SECONDS.observe(time.monotonic() - started, 'release',
+                                          provider or 'default', outcome)
@@ -0,0 +1,184 @@
+import re
+import time
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Weights used to rank a single query term against a book
+ISBN_PREFIX_WEIGHT = 5
+TITLE_EXACT_WEIGHT = 3
+TITLE_PREFIX_WEIGHT = 2
+AUTHOR_EXACT_WEIGHT = 2
+AUTHOR_PREFIX_WEIGHT = 1
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text).lower())
+
+
+class BookSearchIndex:
+    """In-process inverted index over Book title, author and ISBN.
+
+    The index is built lazily from the database on the first query and then kept
+    up to date incrementally from Book signals. Changes made by other processes are
+    picked up when the index is rebuilt after `max_age` seconds, which mirrors the
+    staleness already accepted for the cached books list.
+    """
+    def __init__(self, max_age=60 * 5):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._documents = {}  # book_id -> (title, author, isbn)
+        self._postings = {
+            'title': defaultdict(set),
+            'author': defaultdict(set),
+        }
+        self._sorted_tokens = {'title': None, 'author': None}
+        self._isbns = None  # sorted list of (isbn, book_id)
+        self._built_at = None
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def rebuild(self, rows):
+        """Rebuild the whole index from an iterable of
+        (book_id, title, author, isbn) tuples.
+        """
+        with self._lock:
+            self._reset()
+            for book_id, title, author, isbn in rows:
+                self._add(book_id, title, author, isbn)
+            self._built_at = time.monotonic()
+
+    def invalidate(self):
+        """Force a full rebuild on the next query."""
+        with self._lock:
+            self._built_at = None
+
+    def is_stale(self):
+        return (self._built_at is None
+                or time.monotonic() - self._built_at > self.max_age)
+
+    def update(self, book_id, title, author, isbn):
+        """Add or refresh a single book, skipping work if nothing indexed changed."""
+        if not self.is_built:
+            return
+        document = (title, author, str(isbn))
+        with self._lock:
+            if self._documents.get(book_id) == document:
+                return
+            self._remove(book_id)
+            self._add(book_id, title, author, isbn)
+
+    def remove(self, book_id):
+        if not self.is_built:
+            return
+        with self._lock:
+            self._remove(book_id)
+
+    def _add(self, book_id, title, author, isbn):
+        self._documents[book_id] = (title, author, str(isbn))
+        for token in tokenize(title):
+            self._postings['title'][token].add(book_id)
+        for token in tokenize(author):
+            self._postings['author'][token].add(book_id)
+        self._invalidate_sorted()
+
+    def _remove(self, book_id):
+        document = self._documents.pop(book_id, None)
+        if document is None:
+            return
+        title, author, _ = document
+        for field, text in (('title', title), ('author', author)):
+            postings = self._postings[field]
+            for token in tokenize(text):
+                ids = postings.get(token)
+                if ids is not None:
+                    ids.discard(book_id)
+                    if not ids:
+                        del postings[token]
+        self._invalidate_sorted()
+
+    def _invalidate_sorted(self):
+        self._sorted_tokens = {'title': None, 'author': None}
+        self._isbns = None
+
+    def _tokens(self, field):
+        tokens = self._sorted_tokens[field]
+        if tokens is None:
+            tokens = sorted(self._postings[field])
+            self._sorted_tokens[field] = tokens
+        return tokens
+
+    def _isbn_list(self):
+        if self._isbns is None:
+            self._isbns = sorted(
+                (isbn, book_id) for book_id, (_, _, isbn) in self._documents.items()
+                )
+        return self._isbns
+
+    def _match_field(self, field, term, exact_weight, prefix_weight, scores):
+        postings = self._postings[field]
+        tokens = self._tokens(field)
+        position = bisect_left(tokens, term)
+        while position < len(tokens) and tokens[position].startswith(term):
+            token = tokens[position]
+            weight = exact_weight if token == term else prefix_weight
+            for book_id in postings[token]:
+                if weight > scores.get(book_id, 0):
+                    scores[book_id] = weight
+            position += 1
+
+    def _match_isbn(self, term, scores):
+        isbns = self._isbn_list()
+        position = bisect_left(isbns, (term,))
+        while position < len(isbns) and isbns[position][0].startswith(term):
+            book_id = isbns[position][1]
+            scores[book_id] = max(scores.get(book_id, 0), ISBN_PREFIX_WEIGHT)
+            position += 1
+
+    def search(self, query):
+        """Return a list of (book_id, score) ranked by descending relevance.
+
+        Every query term has to match a title word, an author word or the ISBN by
+        prefix. Exact word matches and title matches rank higher than prefix and
+        author matches.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            totals = None
+            for term in terms:
+                term_scores = {}
+                self._match_field('author', term,
+                                  AUTHOR_EXACT_WEIGHT, AUTHOR_PREFIX_WEIGHT, term_scores)
+                title_scores = {}
+                self._match_field('title', term,
+                                  TITLE_EXACT_WEIGHT, TITLE_PREFIX_WEIGHT, title_scores)
+                for book_id, score in title_scores.items():
+                    term_scores[book_id] = term_scores.get(book_id, 0) + score
+                if term.isdigit():
+                    self._match_isbn(term, term_scores)
+
+                if totals is None:
+                    totals = term_scores
+                else:
+                    totals = {book_id: score + term_scores[book_id]
+                              for book_id, score in totals.items()
+                              if book_id in term_scores}
+                if not totals:
+                    return []
+
+            documents = self._documents
+            return sorted(totals.items(),
+                          key=lambda item: (-item[1], documents[item[0]][0].lower(), item[0]))
+
+
+book_search_index = BookSearchIndex()
@@ -0,0 +1,178 @@
+import time
+import logging
+import threading
+from collections import deque
+from django.conf import settings
+from requests.exceptions import RequestException
+
+logger = logging.getLogger(__name__)
+
+
+class LibraryStats:
+    """Rolling window of recent call latencies and outcomes per external library.
+
+    Keys are '<provider>:<library>' for reservations and '<provider>' for availability
+    checks, a library without reservations of its own is judged by its provider.
+    Samples are kept per process, the last LIBRARY_STATS_WINDOW calls not older than
+    LIBRARY_STATS_MAX_AGE seconds.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def record(self, key, duration, ok):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=settings.LIBRARY_STATS_WINDOW)
+            samples.append((time.monotonic(), duration, ok))
+
+    def summary(self, key):
+        """(mean latency in seconds, error rate) of the recent calls, None without samples."""
+        oldest = time.monotonic() - settings.LIBRARY_STATS_MAX_AGE
+        with self._lock:
+            samples = [sample for sample in self._samples.get(key, ()) if sample[0] >= oldest]
+        if not samples:
+            return None
+        latency = sum(duration for _, duration, _ in samples) / len(samples)
+        error_rate = sum(1 for _, _, ok in samples if not ok) / len(samples)
+        return latency, error_rate
+
+    def reset(self):
+        with self._lock:
+            self._samples = {}
+
+
+library_stats = LibraryStats()
+
+
+def library_key(candidate):
+    return f"{candidate['provider']}:{candidate['library']}"
+
+
+def candidate_score(candidate, default_latency, stats=library_stats):
+    """Expected cost of reserving at a candidate library, lower is better.
+
+    The mean latency is divided by the success rate (expected time until a call succeeds)
+    and raised for low stock, since the last copies are the likeliest to be gone.
+    """
+    summary = stats.summary(library_key(candidate)) or stats.summary(candidate['provider'])
+    latency, error_rate = summary if summary is not None else (default_latency, 0.0)
+    success_rate = max(1.0 - error_rate, 0.1)
+    return latency / success_rate * (1 + 1 / max(candidate['count_in_library'], 1))
+
+
+def rank_candidates(candidates, default_latency=1.0, stats=library_stats):
+    """Candidate libraries (availability entries) ordered from the best to the worst."""
+    return sorted(candidates, key=lambda candidate: (
+        candidate_score(candidate, default_latency, stats), -candidate['count_in_library']))
+
+
+def _is_client_error(error):
+    response = getattr(error, 'response', None)
+    return response is not None and 400 <= response.status_code < 500
+
+
+class AmbiguousReservationError(RequestException):
+    """A reservation attempt ended without a clear answer (a timeout, a server error or an
+    unreadable response) and its copy could not be released, the library may hold it.
+    """
+    def __init__(self, candidate, error):
+        super().__init__(f"Reservation in library {library_key(candidate)} may have "
+                         f"succeeded: {str(error)}")
+        self.candidate = candidate
+
+
+def release_ambiguous_attempt(availability_service, candidate, token, idempotency_key, error):
+    """Give back the copy an ambiguous attempt may have taken, before another library is
+    tried. Only done with an idempotency key, the release then frees nothing if the copy
+    was never taken.
+
+    Raises:
+    - AmbiguousReservationError: without a key or if the release failed.
+    """
+    if not idempotency_key:
+        raise AmbiguousReservationError(candidate, error)
+    try:
+        availability_service.release_book_external_api(
+            candidate['book_id'], token, provider=candidate['provider'],
+            idempotency_key=idempotency_key)
+    except (RequestException, KeyError, ValueError) as e:
+        logger.error(f"Releasing the copy of library {library_key(candidate)} failed: {str(e)}")
+        raise AmbiguousReservationError(candidate, error) from e
+
+
+def reserve_with_failover(availability_service, availability, token, budget=None,
+                          idempotency_key=None, before_attempt=None):
+    """
+    Reserves a copy in the best ranked external library, failing over to the next one
+    when a library rejects the reservation, fails or does not answer in time.
+
+    All attempts share one time budget, each attempt is given at most the time left and
+    is not retried (the next library is the retry). Outcomes and latencies of the
+    attempts feed library_stats.
+
+    An attempt that failed without a clear answer may still have taken a copy. Its copy
+    is released (with the idempotency key) before the next library is tried, without a
+    key or if the release fails the failover stops with AmbiguousReservationError, so a
+    second copy is never taken.
+
+    Parameters:
+    - availability_service (AvailabilityService): Service used to call the providers.
+    - availability (dict): The 'availability' of check_book_availability.
+    - token (str): JWT of the user, forwarded to the provider.
+    - budget (float): Seconds for all attempts, defaults to EXTERNAL_RESERVATION_BUDGET.
+    - idempotency_key (str): Sent with every reservation and release, see
+      AvailabilityService.reserve_book_external_api.
+    - before_attempt (callable): Called with the candidate before its library is asked,
+      e.g. to record where a copy may be held.
+
+    Returns:
+    - dict: The availability entry of the library that reserved a copy, None if every
+      attempted library rejected the reservation.
+
+    Raises:
+    - AmbiguousReservationError: an attempt's outcome is unknown and its copy may be held.
+    - RequestException: the last network or server error, if no library reserved a copy
+      and at least one of them failed for such a reason (worth retrying later).
+    """
+    if not token:
+        raise ValueError("Missing Authorization header")
+    deadline = time.monotonic() + (budget or settings.EXTERNAL_RESERVATION_BUDGET)
+    last_error = None
+    candidates = rank_candidates(list(availability.values()),
+                                 default_latency=settings.EXTERNAL_PROVIDER_TIMEOUT / 2)
+    for attempt, candidate in enumerate(candidates):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning(f"Reservation budget exhausted after {attempt} of "
+                           f"{len(candidates)} libraries")
+            break
+        if before_attempt is not None:
+            before_attempt(candidate)
+        started = time.monotonic()
+        reserved = False
+        try:
+            reserved = availability_service.reserve_book_external_api(
+                candidate['book_id'], token, provider=candidate['provider'],
+                timeout=min(remaining, settings.EXTERNAL_RESERVATION_ATTEMPT_TIMEOUT),
+                retry=False, idempotency_key=idempotency_key)
+            if not reserved:
+                logger.warning(f"Library {library_key(candidate)} rejected the reservation")
+        except RequestException as e:
+            logger.warning(f"Reservation in library {library_key(candidate)} failed: {str(e)}")
+            if not _is_client_error(e):
+                release_ambiguous_attempt(availability_service, candidate, token,
+                                          idempotency_key, e)
+                last_error = e
+        except (KeyError, ValueError) as e:
+            logger.warning(f"Unexpected response of library {library_key(candidate)}: {str(e)}")
+            release_ambiguous_attempt(availability_service, candidate, token, idempotency_key, e)
+        finally:
+            library_stats.record(library_key(candidate), time.monotonic() - started,
+                                 bool(reserved))
+        if reserved:
+            return candidate
+    if last_error is not None:
+        raise last_error
+    return None
@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import secrets
+import threading
+import contextvars
+from contextlib import contextmanager
+from django.conf import settings
+
+SERVICE_NAME = 'django'
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+SPAN_KIND_PRODUCER = 4
+SPAN_KIND_CONSUMER = 5
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    def __init__(self, name, kind, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def traceparent(self):
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, description):
+        self.status = STATUS_ERROR
+        self.attributes['error.message'] = description
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            'status': {'code': self.status or STATUS_OK},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def parse_traceparent(header):
+    """Trace id and parent span id of a W3C traceparent header, None if it is invalid."""
+    parts = (header or '').strip().split('-')
+    if len(parts) < 4 or len(parts[0]) != 2 or parts[0] == 'ff':
+        return None
+    trace_id, parent_id = parts[1].lower(), parts[2].lower()
+    if len(trace_id) != 32 or len(parent_id) != 16:
+        return None
+    try:
+        int(trace_id, 16), int(parent_id, 16)
+    except ValueError:
+        return None
+    if trace_id == '0' * 32 or parent_id == '0' * 16:
+        return None
+    return trace_id, parent_id
+
+
+class FileSpanExporter:
+    """Appends finished spans to a file, one OTLP/JSON `resourceSpans` document per line.
+
+    The format of the OpenTelemetry Collector's file exporter, so the files can be read
+    by `manage.py trace_report` or replayed into any OTLP backend.
+    """
+    def __init__(self, path, service_name=SERVICE_NAME):
+        self.path = path
+        self.resource = {'attributes': [_otlp_attribute('service.name', service_name)]}
+        self._lock = threading.Lock()
+        self._file = None
+
+    def export(self, span):
+        line = json.dumps({'resourceSpans': [{
+            'resource': self.resource,
+            'scopeSpans': [{'scope': {'name': 'optimo'}, 'spans': [span.to_otlp()]}],
+        }]})
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                self._file = open(self.path, 'a', buffering=1)
+            self._file.write(line + '\n')
+
+
+class InMemorySpanExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+class Tracer:
+    """Creates spans and propagates W3C trace context.
+
+    Tracing is off unless TRACING_EXPORT_DIR is set (or an exporter is set explicitly),
+    spans are then written to <TRACING_EXPORT_DIR>/django.jsonl.
+    """
+    def __init__(self):
+        self._exporter = None
+        self._lock = threading.Lock()
+
+    @property
+    def exporter(self):
+        if self._exporter is None and settings.TRACING_EXPORT_DIR:
+            with self._lock:
+                if self._exporter is None:
+                    self._exporter = FileSpanExporter(
+                        os.path.join(settings.TRACING_EXPORT_DIR, f'{SERVICE_NAME}.jsonl'))
+        return self._exporter
+
+    def set_exporter(self, exporter):
+        self._exporter = exporter
+
+    def current_span(self):
+        return _current_span.get()
+
+    def begin(self, name, kind=SPAN_KIND_INTERNAL, traceparent=None, attributes=None):
+        """Start a span, a child of the remote `traceparent` or of the current span.
+        Returns None while tracing is off.
+        """
+        if self.exporter is None:
+            return None
+        remote = parse_traceparent(traceparent) if traceparent else None
+        if remote is not None:
+            trace_id, parent_id = remote
+        else:
+            parent = _current_span.get()
+            trace_id = parent.trace_id if parent else secrets.token_hex(16)
+            parent_id = parent.span_id if parent else None
+        return Span(name, kind, trace_id, parent_id, attributes)
+
+    def activate(self, span):
+        return _current_span.set(span)
+
+    def finish(self, span, token=None):
+        if token is not None:
+            _current_span.reset(token)
+        if span is None:
+            return
+        span.end_ns = time.time_ns()
+        exporter = self.exporter
+        if exporter is not None:
+            exporter.export(span)
+
+    @contextmanager
+    def span(self, name, kind=SPAN_KIND_INTERNAL, traceparent=None, attributes=None):
+        """Run the block in a new current span, exceptions mark it as failed."""
+        span = self.begin(name, kind, traceparent, attributes)
+        if span is None:
+            yield None
+            return
+        token = self.activate(span)
+        try:
+            yield span
+        except Exception as e:
+            span.set_error(str(e))
+            raise
+        finally:
+            self.finish(span, token)
+
+    def inject(self, headers):
+        """Add the traceparent header of the current span to outbound request headers."""
+        span = _current_span.get()
+        if span is not None:
+            headers['traceparent'] = span.traceparent
+        return headers
+
+
+tracer = Tracer()
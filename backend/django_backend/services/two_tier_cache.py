@@ -0,0 +1,350 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.redis import RedisCache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LocalLRUCache:
+    """Size-bounded in-process LRU cache with a per-entry TTL.
+
+    Values are kept as live Python objects (not pickled), so callers must treat
+    them as read-only.
+    """
+    def __init__(self, max_entries=256, timeout=30):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=_MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        """Store value for min(timeout, self.timeout) seconds, timeout None means
+        the L1 maximum.
+        """
+        ttl = self.timeout if timeout is None else min(timeout, self.timeout)
+        if ttl <= 0:
+            self.delete(key)
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class LocalTier:
+    """Process-wide L1 state shared by every TwoTierRedisCache instance of one cache
+    alias (Django creates a cache instance per thread).
+
+    Holds the LRU cache, hit statistics and the pub/sub subscriber thread that evicts
+    keys changed by other processes.
+    """
+    def __init__(self, channel, max_entries, timeout, get_client):
+        self.channel = channel
+        self.cache = LocalLRUCache(max_entries=max_entries, timeout=timeout)
+        self.origin = uuid.uuid4().hex
+        self.get_client = get_client
+        self.subscribed = threading.Event()
+        # Bumped on every invalidation, guards against storing a value in L1 that
+        # was invalidated while it was being fetched from L2
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._stats = {'l1_hits': 0, 'l2_hits': 0, 'misses': 0}
+        self._subscriber = None
+        self._pid = os.getpid()
+
+    def is_ready(self):
+        """Start the subscriber if needed, L1 is used only while it is subscribed."""
+        if self._pid != os.getpid():
+            # Forked worker, the parent's subscriber thread does not exist here
+            with self._lock:
+                self._pid = os.getpid()
+                self._subscriber = None
+                self.subscribed.clear()
+                self.cache.clear()
+        if self._subscriber is None or not self._subscriber.is_alive():
+            with self._lock:
+                if self._subscriber is None or not self._subscriber.is_alive():
+                    self._subscriber = threading.Thread(target=self._listen,
+                                                        name='two-tier-cache-invalidation',
+                                                        daemon=True)
+                    self._subscriber.start()
+        return self.subscribed.is_set()
+
+    def count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['l1_hits'] + stats['l2_hits'] + stats['misses']
+        l2_lookups = stats['l2_hits'] + stats['misses']
+        stats.update({
+            'l1_entries': len(self.cache),
+            'l1_hit_ratio': stats['l1_hits'] / lookups if lookups else 0.0,
+            'l2_hit_ratio': stats['l2_hits'] / l2_lookups if l2_lookups else 0.0,
+            'subscribed': self.subscribed.is_set(),
+        })
+        return stats
+
+    def invalidate(self, keys=None):
+        """Drop the given keys, or everything when keys is None."""
+        with self._lock:
+            self.generation += 1
+        if keys is None:
+            self.cache.clear()
+        else:
+            for key in keys:
+                self.cache.delete(key)
+
+    def publish(self, keys=None):
+        """Announce changed keys to other processes, or a full clear when keys is None."""
+        message = json.dumps({'origin': self.origin, 'keys': keys})
+        try:
+            self.get_client().publish(self.channel, message)
+        except Exception as e:
+            logger.error(f"Error publishing cache invalidation: {str(e)}")
+
+    def _listen(self):
+        backoff = 0.5
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.get_client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Anything cached before the subscription may have been missed
+                self.invalidate()
+                self.subscribed.set()
+                backoff = 0.5
+                for message in pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    payload = json.loads(message['data'])
+                    if payload['origin'] != self.origin:
+                        self.invalidate(payload['keys'])
+            except Exception as e:
+                logger.error(f"Cache invalidation subscriber disconnected: {str(e)}")
+            finally:
+                self.subscribed.clear()
+                self.invalidate()
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+
+_local_tiers = {}
+_local_tiers_lock = threading.Lock()
+
+
+class TwoTierRedisCache(RedisCache):
+    """RedisCache with an in-process L1 tier in front of it.
+
+    Every write or delete goes to Redis (L2) and is announced on a pub/sub channel.
+    Each process runs a subscriber thread that evicts announced keys from its own L1,
+    so the tiers stay coherent. Until the subscriber is connected, or after it loses
+    its connection, L1 is bypassed and flushed.
+
+    Extra OPTIONS:
+    - L1_MAX_ENTRIES (int): maximum number of entries held in each process.
+    - L1_TIMEOUT (int): maximum seconds an entry lives in L1.
+    - L1_KEY_PREFIXES (list of str): only keys starting with one of these prefixes
+      are kept in L1, None keeps every key.
+    - INVALIDATION_CHANNEL (str): Redis pub/sub channel name.
+    """
+    def __init__(self, server, params):
+        params = dict(params)
+        options = dict(params.get('OPTIONS', {}))
+        l1_max_entries = options.pop('L1_MAX_ENTRIES', 256)
+        l1_timeout = options.pop('L1_TIMEOUT', 30)
+        l1_key_prefixes = options.pop('L1_KEY_PREFIXES', None)
+        channel = options.pop('INVALIDATION_CHANNEL', 'cache_invalidation')
+        params['OPTIONS'] = options
+        super().__init__(server, params)
+
+        # Prefixes are compared against full cache keys (KEY_PREFIX and VERSION applied)
+        self._l1_key_prefixes = tuple(
+            self.make_key(prefix) for prefix in l1_key_prefixes
+            ) if l1_key_prefixes else None
+        tier_key = (tuple(self._servers), channel)
+        with _local_tiers_lock:
+            if tier_key not in _local_tiers:
+                _local_tiers[tier_key] = LocalTier(
+                    channel,
+                    l1_max_entries,
+                    l1_timeout,
+                    lambda: self.get_client(write=True),
+                    )
+            self._tier = _local_tiers[tier_key]
+        self._l1 = self._tier.cache
+
+    def _is_l1_key(self, key):
+        return self._l1_key_prefixes is None or key.startswith(self._l1_key_prefixes)
+
+    def _uses_l1(self, key):
+        return self._is_l1_key(key) and self._tier.is_ready()
+
+    def stats(self):
+        """Hit statistics of both tiers in this process."""
+        return self._tier.stats()
+
+    def get_client(self, key=None, write=False):
+        """redis-py client of the Redis server (L2) for key, for commands the cache API
+        does not cover (Lua scripts, pub/sub, pipelines). Keys written through it are not
+        evicted from L1, use it only for keys outside L1_KEY_PREFIXES.
+        """
+        return self._cache.get_client(key, write=write)
+
+    # Cache API
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        use_l1 = self._uses_l1(key)
+        if use_l1:
+            value = self._l1.get(key)
+            if value is not _MISSING:
+                self._tier.count('l1_hits')
+                return value
+            generation = self._tier.generation
+
+        value = self._cache.get(key, _MISSING)
+        if value is _MISSING:
+            self._tier.count('misses')
+            return default
+
+        self._tier.count('l2_hits')
+        if use_l1 and generation == self._tier.generation:
+            self._l1.set(key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        key_map = {self.make_and_validate_key(key, version=version): key for key in keys}
+        found = {}
+        l2_keys = []
+        for key in key_map:
+            value = self._l1.get(key) if self._uses_l1(key) else _MISSING
+            if value is _MISSING:
+                l2_keys.append(key)
+            else:
+                self._tier.count('l1_hits')
+                found[key_map[key]] = value
+
+        if l2_keys:
+            generation = self._tier.generation
+            l2_values = self._cache.get_many(l2_keys)
+            for key in l2_keys:
+                if key not in l2_values:
+                    self._tier.count('misses')
+                    continue
+                self._tier.count('l2_hits')
+                found[key_map[key]] = l2_values[key]
+                if self._uses_l1(key) and generation == self._tier.generation:
+                    self._l1.set(key, l2_values[key])
+        return found
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        backend_timeout = self.get_backend_timeout(timeout)
+        self._cache.set(key, value, backend_timeout)
+        self._after_write([key], {key: value}, backend_timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        backend_timeout = self.get_backend_timeout(timeout)
+        added = self._cache.add(key, value, backend_timeout)
+        if added:
+            self._after_write([key], {key: value}, backend_timeout)
+        return added
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        if not data:
+            return []
+        safe_data = {
+            self.make_and_validate_key(key, version=version): value
+            for key, value in data.items()
+        }
+        backend_timeout = self.get_backend_timeout(timeout)
+        self._cache.set_many(safe_data, backend_timeout)
+        self._after_write(list(safe_data), safe_data, backend_timeout)
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        result = super().touch(key, timeout=timeout, version=version)
+        self._after_write([self.make_and_validate_key(key, version=version)])
+        return result
+
+    def delete(self, key, version=None):
+        result = super().delete(key, version=version)
+        self._after_write([self.make_and_validate_key(key, version=version)])
+        return result
+
+    def delete_many(self, keys, version=None):
+        if not keys:
+            return
+        super().delete_many(keys, version=version)
+        self._after_write([self.make_and_validate_key(key, version=version) for key in keys])
+
+    def incr(self, key, delta=1, version=None):
+        result = super().incr(key, delta=delta, version=version)
+        self._after_write([self.make_and_validate_key(key, version=version)])
+        return result
+
+    def clear(self):
+        result = super().clear()
+        self._tier.invalidate()
+        self._tier.publish()
+        return result
+
+    def _after_write(self, keys, values=None, timeout=None):
+        """Refresh this process' L1 with the written values and tell the other
+        processes to drop the keys. Keys outside L1_KEY_PREFIXES are in no L1, they
+        are not announced.
+        """
+        keys = [key for key in keys if self._is_l1_key(key)]
+        if not keys:
+            return
+        self._tier.invalidate(keys)
+        if values and timeout != 0:
+            generation = self._tier.generation
+            for key, value in values.items():
+                if self._uses_l1(key) and generation == self._tier.generation:
+                    self._l1.set(key, value, timeout)
+        self._tier.publish(keys)
@@ -1,27 +1,111 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from utils.db_init import initialize_database
-from utils.config import Config, log_config_handler
-from views.views import library_manage_blueprint
-from flasgger import Swagger
+import time
+IMPORT_STARTED_AT = time.time()
+
+import json  # noqa: E402
+import click  # noqa: E402
+from functools import wraps  # noqa: E402
+from flask import Flask, request  # noqa: E402
+from utils.db_init import initialize_database  # noqa: E402
+from utils.config import Config, log_config_handler  # noqa: E402
+from views.views import library_manage_blueprint  # noqa: E402
+from models.models import db  # noqa: E402
+from services.inventory import Inventory, DatabaseInventory, generate_books  # noqa: E402
+from test.mock_data import MOCK_BOOK_DATA  # noqa: E402
+from flasgger import Swagger  # noqa: E402
+
+IMPORT_SECONDS = time.time() - IMPORT_STARTED_AT
+
+REQUIRED_TABLES = ['flask_logs', 'flask_external_books', 'flask_external_holds']
+
+
+def cache_spec_view(view):
+    """Build the Swagger UI page and spec on first access and serve the same response
+    afterwards, flasgger would otherwise parse every swag_from spec on each request.
+    """
+    responses = {}
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.path not in responses:
+            response = view(*args, **kwargs)
+            if not hasattr(response, 'get_data'):
+                return response
+            responses[request.path] = (response.get_data(), response.status_code,
+                                       response.mimetype)
+        data, status_code, mimetype = responses[request.path]
+        return data, status_code, {'Content-Type': mimetype}
+    return wrapper
+
+
+def register_commands(app):
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create missing tables, run once before starting workers in fast start mode."""
+        initialize_database(app, db, REQUIRED_TABLES)
+
+    @app.cli.command('load-inventory')
+    @click.option('--file', 'path', type=click.Path(exists=True),
+                  help='JSON list of books (title, author, isbn, library, count_in_library)')
+    @click.option('--generate', type=int, default=0, help='Number of generated books to load')
+    @click.option('--replace', is_flag=True, help='Empty the inventory first')
+    def load_inventory_command(path, generate, replace):
+        """Bulk load the external inventory, the mock data by default."""
+        if path:
+            with open(path) as f:
+                books = json.load(f)
+        elif generate:
+            books = generate_books(generate)
+        else:
+            books = MOCK_BOOK_DATA
+        loaded = app.extensions['inventory'].load(books, replace=replace)
+        click.echo("Loaded {} books.".format(loaded))
+
+
+def init_inventory(app):
+    if app.config['INVENTORY_BACKEND'] == 'memory':
+        app.extensions['inventory'] = Inventory(MOCK_BOOK_DATA)
+        return
+    inventory = app.extensions['inventory'] = DatabaseInventory(
+        db, app.config['INVENTORY_CACHE_TTL'], app.config['INVENTORY_CACHE_MAX_ISBNS'])
+    # A new database starts with the mock data, as the in-memory inventory did
+    if not app.config.get('FAST_START'):
+        inventory.seed(MOCK_BOOK_DATA)
 
 
 # Factory function
 def create_app(config_class=Config):
+    """
+    With FAST_START the schema check is skipped, tables are expected to be created
+    beforehand with `flask init-db`, so workers can be started and recycled cheaply.
+    """
+    started_at = time.time()
     app = Flask(__name__, instance_relative_config=True)
-    swagger = Swagger(app)
     app.config.from_object(config_class)
     config_class.init_app(app)
+    Swagger(app, decorators=[cache_spec_view])
+
+    # Single SQLAlchemy instance, the one models are declared with
+    db.init_app(app)
+    # Logs are written by the SQLAlchemy handler outside of app context as well
+    db.app = app
 
-    # Initialize tables
     with app.app_context():  # Ensure an application context is active
-        app.config['SQLALCHEMY_DATABASE_URI'] = Config.SQLALCHEMY_DATABASE_URI
-        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-        db = SQLAlchemy(app)
-        initialize_database(app, db, ['flask_logs'])
+        if not app.config.get('FAST_START'):
+            # Initialize tables
+            initialize_database(app, db, REQUIRED_TABLES)
         log_config_handler(db, app)
+        init_inventory(app)
 
     # Register blueprints
     app.register_blueprint(library_manage_blueprint)
+    register_commands(app)
+
+    app.config['STARTUP_TIMINGS'] = {
+        'import_seconds': round(IMPORT_SECONDS, 4),
+        'create_app_seconds': round(time.time() - started_at, 4),
+    }
+    app.logger.info('Startup timings: import %ss, create_app %ss',
+                    app.config['STARTUP_TIMINGS']['import_seconds'],
+                    app.config['STARTUP_TIMINGS']['create_app_seconds'])
 
     return app
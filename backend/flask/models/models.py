@@ -14,3 +14,35 @@ class Log(db.Model):
 
     def __repr__(self):
         return "<Log {}: {}...>".format(self.level, self.message[:20])
+
+
+class ExternalBook(db.Model):
+    """Copies of a book held by an external library, see services.inventory.DatabaseInventory."""
+    __tablename__ = 'flask_external_books'
+    __table_args__ = (
+        db.CheckConstraint('count_in_library >= 0',
+                           name='flask_external_books_count_not_negative'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(255), nullable=False)
+    author = db.Column(db.String(255), nullable=False)
+    isbn = db.Column(db.String(20), nullable=False, index=True)
+    library = db.Column(db.String(255), nullable=False)
+    count_in_library = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<ExternalBook {}: {} in {}>".format(self.id, self.isbn, self.library)
+
+
+class ExternalHold(db.Model):
+    """Copies taken by a reservation with an idempotency key, see services.inventory."""
+    __tablename__ = 'flask_external_holds'
+
+    key = db.Column(db.String(64), primary_key=True)
+    book_id = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=1)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return "<ExternalHold {}: {} of {}>".format(self.key, self.count, self.book_id)
@@ -1,14 +1,29 @@
-from marshmallow import Schema, fields
+from marshmallow import Schema, ValidationError, fields, validate, validates_schema
 
 
 class ReservationSchema(Schema):
     book_id = fields.Integer(required=True)
 
 
+class BulkReservationSchema(Schema):
+    book_ids = fields.List(fields.Integer(), required=True,
+                           validate=validate.Length(min=1, max=100))
+    # Idempotency key of every book, in the order of book_ids
+    idempotency_keys = fields.List(fields.Str(validate=validate.Length(min=1, max=64)))
+
+    @validates_schema
+    def validate_idempotency_keys(self, data):
+        keys = data.get('idempotency_keys')
+        if keys is not None and len(keys) != len(data.get('book_ids') or ()):
+            raise ValidationError(u'One idempotency key is required per book',
+                                  'idempotency_keys')
+
+
 class LoginSchema(Schema):
     username = fields.Str(required=True)
     password = fields.Str(required=True)
 
 
 reservation_schema = ReservationSchema()
+bulk_reservation_schema = BulkReservationSchema()
 login_schema = LoginSchema()
@@ -0,0 +1,363 @@
+import time
+import random
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import and_, select
+from sqlalchemy.exc import IntegrityError
+from models.models import ExternalBook, ExternalHold
+from test.mock_data import MOCK_BOOK_DATA
+
+DEFAULT_STRIPES = 64
+
+BOOK_COLUMNS = ('title', 'author', 'isbn', 'library', 'count_in_library')
+
+
+class Inventory(object):
+    """Copies of books in external libraries, safe to change from many request threads.
+
+    Writers lock only the stripe of their book (book id modulo the number of stripes),
+    so reservations of unrelated books never wait for each other. Book records are
+    copy-on-write: a change publishes a new record instead of modifying the old one,
+    readers take the current records without a lock and never see a half-updated book.
+
+    Reservations made with an idempotency key are remembered as holds (key -> book and
+    copies) until released, so a retried request never takes a second copy and a
+    release gives back exactly what its key took. Holds are striped the same way by
+    key, a keyed reservation waits only for keys of its own stripe.
+    """
+    def __init__(self, books=None, stripes=DEFAULT_STRIPES):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        # Stripe of a key -> {key: (book_id, count)}, each stripe guarded by its own lock
+        self._holds = [{} for _ in range(stripes)]
+        self._hold_locks = [threading.Lock() for _ in range(stripes)]
+        self.load(books or {})
+
+    def load(self, books):
+        """Replace the whole inventory, records of books are copied."""
+        records = dict((book_id, dict(book)) for book_id, book in books.items())
+        by_isbn = {}
+        for book_id, book in records.items():
+            by_isbn.setdefault(str(book['isbn']), []).append(book_id)
+        # Both swapped by one assignment each, readers use either the old or the new state
+        self._books = records
+        self._by_isbn = dict((isbn, tuple(sorted(ids))) for isbn, ids in by_isbn.items())
+
+    def _lock(self, book_id):
+        return self._locks[hash(book_id) % len(self._locks)]
+
+    def _hold_stripe(self, key):
+        """Lock and holds of the stripe of a key. The lock of a book's stripe is only
+        ever taken inside it, never the other way round.
+        """
+        stripe = hash(key) % len(self._hold_locks)
+        return self._hold_locks[stripe], self._holds[stripe]
+
+    def get(self, book_id):
+        """Record of a book (a copy), None if the book is unknown."""
+        book = self._books.get(book_id)
+        return dict(book) if book is not None else None
+
+    def snapshot(self):
+        """Records of all books as of one moment, without locking writers out."""
+        books = self._books.copy()
+        return dict((book_id, dict(book)) for book_id, book in books.items())
+
+    def available(self, isbn):
+        """Records of books with the given ISBN that have at least one copy left."""
+        books = self._books
+        available = {}
+        for book_id in self._by_isbn.get(str(isbn), ()):
+            book = books.get(book_id)
+            if book is not None and book['count_in_library'] >= 1:
+                available[book_id] = dict(book)
+        return available
+
+    def reserve(self, book_id, count=1, key=None):
+        """Take count copies if that many are left (compare-and-decrement).
+
+        Returns True if the copies were taken, False if the book is unknown or has
+        fewer copies left; the count never goes below zero. With a key, a repeated
+        call returns True without taking more copies, a key already holding another
+        book returns False.
+        """
+        if key is None:
+            return self._take(book_id, count)
+        lock, holds = self._hold_stripe(key)
+        with lock:
+            hold = holds.get(key)
+            if hold is not None:
+                return hold[0] == book_id
+            if not self._take(book_id, count):
+                return False
+            holds[key] = (book_id, count)
+            return True
+
+    def release(self, book_id, count=1, key=None):
+        """Give copies back. Returns False if the book is unknown.
+
+        With a key, the copies held by the key are given back once; releasing a key
+        that holds nothing (never reserved or already released) changes nothing.
+        """
+        if key is None:
+            return self._give_back(book_id, count)
+        lock, holds = self._hold_stripe(key)
+        with lock:
+            hold = holds.get(key)
+            if hold is None or hold[0] != book_id:
+                return book_id in self._books
+            del holds[key]
+            return self._give_back(book_id, hold[1])
+
+    def _take(self, book_id, count):
+        with self._lock(book_id):
+            book = self._books.get(book_id)
+            if book is None or book['count_in_library'] < count:
+                return False
+            self._publish(book_id, book, book['count_in_library'] - count)
+            return True
+
+    def _give_back(self, book_id, count):
+        with self._lock(book_id):
+            book = self._books.get(book_id)
+            if book is None:
+                return False
+            self._publish(book_id, book, book['count_in_library'] + count)
+            return True
+
+    def _publish(self, book_id, book, count_in_library):
+        record = dict(book)
+        record['count_in_library'] = count_in_library
+        self._books[book_id] = record
+
+
+class IsbnCache(object):
+    """Books of the most recently read ISBNs, at most max_isbns of them, each kept for
+    ttl seconds. Also maps the ids of the cached books to their ISBN, so a change of
+    one book drops its ISBN; ids leave the map together with their ISBN.
+    """
+    def __init__(self, max_isbns, ttl):
+        self.max_isbns = max_isbns
+        self.ttl = ttl
+        self._entries = OrderedDict()  # isbn -> (expires_at, books), oldest first
+        self._isbn_of = {}
+        self._lock = threading.Lock()
+
+    def get(self, isbn):
+        with self._lock:
+            entry = self._entries.pop(isbn, None)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                self._forget(isbn, entry[1])
+                return None
+            self._entries[isbn] = entry
+            return entry[1]
+
+    def set(self, isbn, books):
+        with self._lock:
+            self._drop(isbn)
+            self._entries[isbn] = (time.time() + self.ttl, books)
+            for book_id in books:
+                self._isbn_of[book_id] = isbn
+            while len(self._entries) > self.max_isbns:
+                oldest, (_, oldest_books) = self._entries.popitem(last=False)
+                self._forget(oldest, oldest_books)
+
+    def invalidate(self, book_id):
+        with self._lock:
+            isbn = self._isbn_of.get(book_id)
+            if isbn is not None:
+                self._drop(isbn)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._isbn_of.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, isbn):
+        entry = self._entries.pop(isbn, None)
+        if entry is not None:
+            self._forget(isbn, entry[1])
+
+    def _forget(self, isbn, books):
+        for book_id in books:
+            if self._isbn_of.get(book_id) == isbn:
+                del self._isbn_of[book_id]
+
+
+class DatabaseInventory(object):
+    """Copies of books in external libraries kept in the `flask_external_books` table.
+
+    A reservation is a single conditional UPDATE (`count_in_library >= count`), the
+    database decides which of concurrent requests gets the last copy, also across
+    workers. Availability reads go through a read-through cache of the books of an
+    ISBN, kept for cache_ttl seconds for at most cache_max_isbns ISBNs; a worker drops
+    the entry of an ISBN when it changes one of its books, other workers may serve it
+    until it expires.
+
+    Holds of reservations made with an idempotency key are rows of `flask_external_holds`
+    written in the same transaction as the stock, see Inventory.
+    """
+    def __init__(self, db, cache_ttl=5, cache_max_isbns=1024):
+        self.db = db
+        self.table = ExternalBook.__table__
+        self.holds = ExternalHold.__table__
+        self._cache = IsbnCache(cache_max_isbns, cache_ttl)
+
+    @property
+    def cache_ttl(self):
+        return self._cache.ttl
+
+    @cache_ttl.setter
+    def cache_ttl(self, ttl):
+        self._cache.ttl = ttl
+        self._cache.clear()
+
+    def _record(self, row):
+        return dict((column, row[column]) for column in BOOK_COLUMNS)
+
+    def get(self, book_id):
+        with self.db.engine.connect() as connection:
+            row = connection.execute(
+                select([self.table]).where(self.table.c.id == book_id)).first()
+        return self._record(row) if row is not None else None
+
+    def is_empty(self):
+        with self.db.engine.connect() as connection:
+            return connection.execute(select([self.table.c.id]).limit(1)).first() is None
+
+    def snapshot(self):
+        with self.db.engine.connect() as connection:
+            rows = connection.execute(select([self.table])).fetchall()
+        return dict((row['id'], self._record(row)) for row in rows)
+
+    def _books_of_isbn(self, isbn):
+        books = self._cache.get(isbn)
+        if books is not None:
+            return books
+        with self.db.engine.connect() as connection:
+            rows = connection.execute(
+                select([self.table]).where(self.table.c.isbn == isbn)).fetchall()
+        books = dict((row['id'], self._record(row)) for row in rows)
+        self._cache.set(isbn, books)
+        return books
+
+    def available(self, isbn):
+        books = self._books_of_isbn(str(isbn))
+        return dict((book_id, dict(book)) for book_id, book in books.items()
+                    if book['count_in_library'] >= 1)
+
+    def invalidate(self, book_id):
+        self._cache.invalidate(book_id)
+
+    def _update(self, connection, condition, count_in_library):
+        result = connection.execute(
+            self.table.update().where(condition).values(count_in_library=count_in_library))
+        return result.rowcount == 1
+
+    def _held_book(self, connection, key):
+        return connection.execute(
+            select([self.holds.c.book_id]).where(self.holds.c.key == key)).scalar()
+
+    def reserve(self, book_id, count=1, key=None):
+        count_in_library = self.table.c.count_in_library
+        condition = and_(self.table.c.id == book_id, count_in_library >= count)
+        try:
+            with self.db.engine.begin() as connection:
+                if key is not None:
+                    held_book = self._held_book(connection, key)
+                    if held_book is not None:
+                        return held_book == book_id
+                if not self._update(connection, condition, count_in_library - count):
+                    return False
+                if key is not None:
+                    connection.execute(self.holds.insert().values(
+                        key=key, book_id=book_id, count=count, created_at=datetime.utcnow()))
+        except IntegrityError:
+            # A concurrent request with the same key took the copies, ours are rolled back
+            with self.db.engine.connect() as connection:
+                return self._held_book(connection, key) == book_id
+        self.invalidate(book_id)
+        return True
+
+    def release(self, book_id, count=1, key=None):
+        with self.db.engine.begin() as connection:
+            if key is not None:
+                hold = connection.execute(select([self.holds.c.count]).where(and_(
+                    self.holds.c.key == key, self.holds.c.book_id == book_id))).first()
+                if hold is None:
+                    return connection.execute(select([self.table.c.id]).where(
+                        self.table.c.id == book_id)).first() is not None
+                connection.execute(self.holds.delete().where(self.holds.c.key == key))
+                count = hold['count']
+            released = self._update(connection, self.table.c.id == book_id,
+                                    self.table.c.count_in_library + count)
+        if released:
+            self.invalidate(book_id)
+        return released
+
+    def load(self, books, replace=False, batch_size=1000):
+        """Bulk insert books ({id: record}, or records without ids) with one
+        multi-row INSERT per batch. With replace the table is emptied first."""
+        items = books.items() if isinstance(books, dict) else ((None, book) for book in books)
+        loaded = 0
+        with self.db.engine.begin() as connection:
+            if replace:
+                connection.execute(self.table.delete())
+            batch = []
+            for book_id, book in items:
+                row = dict((column, book[column]) for column in BOOK_COLUMNS)
+                row['isbn'] = str(row['isbn'])
+                if book_id is not None:
+                    row['id'] = book_id
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    connection.execute(self.table.insert(), batch)
+                    loaded += len(batch)
+                    batch = []
+            if batch:
+                connection.execute(self.table.insert(), batch)
+                loaded += len(batch)
+        self._cache.clear()
+        return loaded
+
+    def seed(self, books):
+        """Load books into an empty table, safe to run from several workers at once:
+        a worker that loses the race keeps the rows of the one that won."""
+        if not self.is_empty():
+            return 0
+        try:
+            return self.load(books)
+        except IntegrityError:
+            # Another worker inserted the same ids first, our rows are rolled back
+            return 0
+
+
+def generate_books(count, isbns=None, seed=0):
+    """Synthetic inventory for load tests and benchmarks, by default 5 libraries hold each ISBN."""
+    rng = random.Random(seed)
+    isbns = isbns or max(count // 5, 1)
+    for index in xrange(count):
+        isbn = 9780000000000 + index % isbns
+        yield {
+            'title': u'Generated Book {}'.format(isbn),
+            'author': u'Generated Author',
+            'isbn': isbn,
+            'library': u'Library {}'.format(index // isbns + 1),
+            'count_in_library': rng.randint(0, 5),
+        }
+
+
+# Served by this process, loaded from the mock data of the external libraries
+inventory = Inventory(MOCK_BOOK_DATA)
+
+
+def current_inventory():
+    """Inventory of the current app: the one set up by create_app (INVENTORY_BACKEND),
+    the in-memory inventory otherwise."""
+    return current_app.extensions.get('inventory', inventory)
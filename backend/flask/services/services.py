@@ -1,9 +1,38 @@
+import time
 import requests
 from flask import current_app, jsonify
 from marshmallow import ValidationError
 from werkzeug.exceptions import Unauthorized, BadRequest
-from models.schemas import reservation_schema
-from test.mock_data import MOCK_BOOK_DATA
+from models.schemas import reservation_schema, bulk_reservation_schema
+from .inventory import current_inventory
+from utils.metrics import registry
+from utils.tracing import tracer, SPAN_KIND_CLIENT
+
+DJANGO_CALL_SECONDS = registry.histogram(
+    'flask_django_call_duration_seconds',
+    'Duration of calls to the Django API by operation and status code.',
+    ('operation', 'status'),
+)
+
+
+def post_to_django(operation, url, **kwargs):
+    """POST to the Django API in a client span, Django continues the trace."""
+    started_at = time.time()
+    status = 'error'
+    span = tracer.begin(u'POST {}'.format(operation), SPAN_KIND_CLIENT,
+                        attributes={'http.url': url})
+    kwargs['headers'] = tracer.inject(dict(kwargs.get('headers') or {}), span)
+    try:
+        response = requests.post(url, **kwargs)
+        status = response.status_code
+        return response
+    finally:
+        DJANGO_CALL_SECONDS.observe(time.time() - started_at, (operation, status))
+        if span is not None:
+            span.attributes['http.status_code'] = status
+            if status == 'error':
+                span.set_error(u'Request failed')
+            tracer.finish(span)
 
 
 def reserve_book(reservation_data, headers):
@@ -34,7 +63,8 @@ def make_reservation_request(reservation_data, jwt_token):
         'Content-Type': 'application/json',
         'Authorization': u'Bearer {}'.format(jwt_token)
     }
-    response = requests.post(
+    response = post_to_django(
+        'reserve',
         reservation_url,
         json=reservation_data,
         headers=headers,
@@ -55,15 +85,13 @@ def handle_successful_reservation(response, book_id):
     }, response.status_code
 
 
-def reserve_book_external(reservation_data, headers):
-    """Reserve a book in external library"""
+def verify_token(headers):
+    """Verify the JWT token from Authorization header in Django"""
     django_verification_url = u'{}/api/token/verify/'.format(current_app.config['DJANGO_API_URL'])
-    validated_data = validate_reservation_data(reservation_data)
-    book_id = validated_data.get('book_id')
     jwt_token = get_jwt_token(headers)
 
-    # Verify token in Django
-    verification_response = requests.post(
+    verification_response = post_to_django(
+        'verify_token',
         django_verification_url,
         json={"token": jwt_token}
     )
@@ -71,11 +99,55 @@ def reserve_book_external(reservation_data, headers):
     if verification_response.status_code != 200:
         raise Unauthorized(u"Invalid token")
 
-    # Reserve a book in external library (mock data)
-    book = MOCK_BOOK_DATA.get(book_id)
 
-    if not book or book['count_in_library'] < 1:
+def reserve_book_external(reservation_data, headers):
+    """Reserve a book in external library"""
+    validated_data = validate_reservation_data(reservation_data)
+    book_id = validated_data.get('book_id')
+
+    # Verify token in Django
+    verify_token(headers)
+
+    # Reserve a book in external library, a retry with the same key takes no second copy
+    if not current_inventory().reserve(book_id, key=headers.get('Idempotency-Key')):
         raise BadRequest(u"Book {} not available in external library".format(book_id))
 
-    book['count_in_library'] -= 1
     return {"message": u"Book with id {} reserved successfully".format(book_id)}
+
+
+def reserve_books_external(reservation_data, headers):
+    """Reserve several books in external library with a single token verification,
+    every book is reserved independently, with its own idempotency key if given.
+    Returns {"results": {book_id: reserved}}"""
+    result = bulk_reservation_schema.load(reservation_data or {})
+    if result.errors:
+        current_app.logger.error(u'Validation error: %s', result.errors)
+        raise ValidationError(result.errors)
+
+    # Verify token in Django
+    verify_token(headers)
+
+    book_ids = result.data['book_ids']
+    # With keys, a retried batch takes no second copy and every copy can be released once
+    keys = result.data.get('idempotency_keys') or [None] * len(book_ids)
+    inventory = current_inventory()
+    results = {}
+    for book_id, key in zip(book_ids, keys):
+        results[str(book_id)] = inventory.reserve(book_id, key=key)
+    return {"results": results}
+
+
+def release_book_external(reservation_data, headers):
+    """Release a book reserved in external library, used by Django to compensate
+    a reservation that could not be completed"""
+    validated_data = validate_reservation_data(reservation_data)
+    book_id = validated_data.get('book_id')
+
+    # Verify token in Django
+    verify_token(headers)
+
+    # With a key, only the copy taken by that key is given back, at most once
+    if not current_inventory().release(book_id, key=headers.get('Idempotency-Key')):
+        raise BadRequest(u"Book {} not found in external library".format(book_id))
+
+    return {"message": u"Book with id {} released successfully".format(book_id)}
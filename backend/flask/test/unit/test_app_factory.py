@@ -0,0 +1,71 @@
+import pytest
+from mock import patch
+from flasgger.base import APISpecsView
+from app import create_app
+from utils.config import Config
+from services.inventory import DatabaseInventory, current_inventory
+from test.mock_data import MOCK_BOOK_DATA
+
+
+class FastStartConfig(Config):
+    FLASK_SECRET = 'secret'
+    DJANGO_HOST = 'localhost'
+    DJANGO_PORT = '8000'
+    DB_HOST = 'localhost'
+    DB_PORT = '3306'
+    DB_USER = 'user'
+    DB_PASSWORD = 'password'
+    DB_NAME = 'test'
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    FAST_START = True
+    INVENTORY_BACKEND = 'memory'
+
+
+@pytest.fixture
+def fast_app():
+    with patch('app.initialize_database') as mock_initialize_database:
+        app = create_app(FastStartConfig)
+    app.mock_initialize_database = mock_initialize_database
+    return app
+
+
+def test_fast_start_skips_schema_check(fast_app):
+    fast_app.mock_initialize_database.assert_not_called()
+    assert set(fast_app.config['STARTUP_TIMINGS']) == {'import_seconds', 'create_app_seconds'}
+
+
+def test_schema_is_checked_without_fast_start():
+    class CheckedConfig(FastStartConfig):
+        FAST_START = False
+
+    with patch('app.initialize_database') as mock_initialize_database:
+        create_app(CheckedConfig)
+    assert mock_initialize_database.call_count == 1
+
+
+def test_swagger_spec_is_built_once(fast_app):
+    client = fast_app.test_client()
+    with patch.object(APISpecsView, 'get', autospec=True,
+                      side_effect=APISpecsView.get) as mock_get:
+        first = client.get('/apispec_1.json')
+        second = client.get('/apispec_1.json')
+    assert first.status_code == 200
+    assert second.data == first.data
+    assert second.mimetype == 'application/json'
+    assert '/book_released_external' in first.json['paths']
+    assert mock_get.call_count == 1
+
+
+def test_database_inventory_is_seeded(tmpdir):
+    class DatabaseConfig(FastStartConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'.format(tmpdir.join('flask.db'))
+        FAST_START = False
+        INVENTORY_BACKEND = 'database'
+
+    app = create_app(DatabaseConfig)
+    with app.app_context():
+        inventory = current_inventory()
+        assert isinstance(inventory, DatabaseInventory)
+        assert set(inventory.available(MOCK_BOOK_DATA[1]['isbn'])) == set(
+            pk for pk, book in MOCK_BOOK_DATA.items()
+            if book['isbn'] == MOCK_BOOK_DATA[1]['isbn'] and book['count_in_library'] > 0)
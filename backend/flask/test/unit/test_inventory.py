@@ -0,0 +1,199 @@
+import threading
+import pytest
+from flask import Flask
+from models.models import db
+from services.inventory import Inventory, DatabaseInventory, IsbnCache, generate_books
+
+BOOKS = {
+    1: {"title": "Title Book", "author": "Test Author", "isbn": 123123,
+        "library": "Library 1", "count_in_library": 50},
+    2: {"title": "Title Book", "author": "Test Author", "isbn": 123123,
+        "library": "Library 2", "count_in_library": 0},
+    3: {"title": "Title Book 3", "author": "Test Author 3", "isbn": 12312333,
+        "library": "Library 3", "count_in_library": 7},
+}
+
+
+def run_threads(target, count):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_reserve_is_compare_and_decrement():
+    inventory = Inventory(BOOKS)
+    assert inventory.reserve(3, count=7)
+    assert not inventory.reserve(3)
+    assert not inventory.reserve(99)
+    assert inventory.get(3)['count_in_library'] == 0
+    assert inventory.release(3)
+    assert inventory.get(3)['count_in_library'] == 1
+    assert not inventory.release(99)
+    # The source data is copied, not changed
+    assert BOOKS[3]['count_in_library'] == 7
+
+
+def test_keyed_reserve_and_release_happen_once():
+    inventory = Inventory(BOOKS)
+    assert inventory.reserve(3, key='reservation-1')
+    # A retried request holds the same copy, another book is refused for the key
+    assert inventory.reserve(3, key='reservation-1')
+    assert not inventory.reserve(1, key='reservation-1')
+    assert inventory.get(3)['count_in_library'] == 6
+    assert inventory.release(3, key='reservation-1')
+    assert inventory.release(3, key='reservation-1')
+    # Nothing held by the key, nothing is given back
+    assert inventory.release(3, key='reservation-2')
+    assert inventory.get(3)['count_in_library'] == 7
+
+
+def test_concurrent_keyed_reservations_take_once_per_key():
+    inventory = Inventory(BOOKS, stripes=4)
+    keys = ['reservation-%d' % number for number in range(20)]
+
+    def reserve():
+        for key in keys:
+            inventory.reserve(3, key=key)
+
+    run_threads(reserve, 8)
+    assert inventory.get(3)['count_in_library'] == 0
+
+    def release():
+        for key in keys:
+            inventory.release(3, key=key)
+
+    run_threads(release, 8)
+    assert inventory.get(3)['count_in_library'] == 7
+
+
+def test_available_by_isbn():
+    inventory = Inventory(BOOKS)
+    assert list(inventory.available('123123')) == [1]
+    assert inventory.available(404) == {}
+    # Records handed out are copies
+    inventory.available(123123)[1]['count_in_library'] = 0
+    assert inventory.get(1)['count_in_library'] == 50
+
+
+def test_concurrent_reservations_never_oversell():
+    inventory = Inventory(BOOKS, stripes=2)
+    reserved = []
+    negative = []
+
+    def reserve():
+        for _ in range(100):
+            for book_id in (1, 3):
+                if inventory.reserve(book_id):
+                    reserved.append(book_id)
+
+    def read():
+        for _ in range(200):
+            for book in inventory.snapshot().values():
+                if book['count_in_library'] < 0:
+                    negative.append(book)
+
+    threads = [threading.Thread(target=reserve) for _ in range(16)]
+    threads += [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert reserved.count(1) == 50
+    assert reserved.count(3) == 7
+    assert negative == []
+    assert inventory.get(1)['count_in_library'] == 0
+    assert inventory.get(3)['count_in_library'] == 0
+
+
+def test_concurrent_reserve_and_release_keep_count():
+    inventory = Inventory(BOOKS)
+
+    def churn():
+        for _ in range(500):
+            if inventory.reserve(3):
+                inventory.release(3)
+
+    run_threads(churn, 16)
+    assert inventory.get(3)['count_in_library'] == 7
+
+
+@pytest.fixture
+def database_inventory(tmpdir):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(tmpdir.join('inventory.db'))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        inventory = DatabaseInventory(db, cache_ttl=60)
+        inventory.load(BOOKS)
+        yield inventory
+
+
+def test_database_reserve_is_conditional_update(database_inventory):
+    assert database_inventory.reserve(3, count=7)
+    assert not database_inventory.reserve(3)
+    assert not database_inventory.reserve(99)
+    assert database_inventory.get(3)['count_in_library'] == 0
+    assert database_inventory.release(3)
+    assert not database_inventory.release(99)
+    assert database_inventory.get(3)['count_in_library'] == 1
+
+
+def test_database_keyed_reserve_and_release_happen_once(database_inventory):
+    assert database_inventory.reserve(3, key='reservation-1')
+    assert database_inventory.reserve(3, key='reservation-1')
+    assert not database_inventory.reserve(1, key='reservation-1')
+    assert database_inventory.get(3)['count_in_library'] == 6
+    assert database_inventory.release(3, key='reservation-1')
+    assert database_inventory.release(3, key='reservation-1')
+    assert database_inventory.release(3, key='reservation-2')
+    assert not database_inventory.release(99, key='reservation-2')
+    assert database_inventory.get(3)['count_in_library'] == 7
+
+
+def test_database_availability_is_cached_until_a_book_changes(database_inventory):
+    assert list(database_inventory.available(123123)) == [1]
+    # Changed behind the inventory's back, the cached books are served
+    with db.engine.begin() as connection:
+        connection.execute(database_inventory.table.update().values(count_in_library=3))
+    assert list(database_inventory.available(123123)) == [1]
+
+    assert database_inventory.reserve(1)
+    available = database_inventory.available('123123')
+    assert sorted(available) == [1, 2]
+    assert available[1]['count_in_library'] == 2
+
+
+def test_database_seed_tolerates_a_concurrent_seed(database_inventory):
+    assert database_inventory.seed(BOOKS) == 0
+    # Another worker found the table empty too and inserts the same ids
+    database_inventory.is_empty = lambda: True
+    assert database_inventory.seed(BOOKS) == 0
+    assert database_inventory.get(3)['count_in_library'] == 7
+
+
+def test_isbn_cache_is_bounded():
+    cache = IsbnCache(max_isbns=2, ttl=60)
+    cache.set('a', {1: {}})
+    cache.set('b', {2: {}})
+    cache.get('a')
+    cache.set('c', {3: {}})
+    assert cache.get('b') is None
+    assert cache.get('a') == {1: {}}
+    assert len(cache) == 2
+    # Ids of dropped ISBNs are dropped too
+    assert sorted(cache._isbn_of) == [1, 3]
+    cache.invalidate(3)
+    assert cache.get('c') is None
+
+
+def test_database_bulk_load(database_inventory):
+    assert database_inventory.load(generate_books(2500), replace=True, batch_size=1000) == 2500
+    books = database_inventory.snapshot()
+    assert len(books) == 2500
+    assert all(book['count_in_library'] >= 0 for book in books.values())
+    assert len(set(book['isbn'] for book in books.values())) == 500
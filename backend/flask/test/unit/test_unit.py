@@ -135,3 +135,129 @@ def test_book_reserved_external_validation_error(client):
                                content_type='application/json')
         assert response.status_code == 400
         assert 'Validation error' in response.json['error']
+
+
+@patch('views.views.release_book_external')
+def test_book_released_external_success(mock_release_book_external, client):
+    mock_release_book_external.return_value = {"message": "Book with id 2 released successfully"}
+    response = client.post('/book_released_external',
+                           data=json.dumps({"book_id": 2}),
+                           content_type='application/json')
+    assert response.status_code == 200
+    assert response.json['message'].endswith('released successfully')
+
+
+def test_book_released_external_bad_request(client):
+    with patch('views.views.release_book_external', side_effect=BadRequest('Not found')):
+        response = client.post('/book_released_external',
+                               data=json.dumps({"book_id": 9999}),
+                               content_type='application/json')
+        assert response.status_code == 400
+        assert 'Bad Request' in response.json['error']
+
+
+def test_metrics_endpoint(client):
+    client.get('/health')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    body = response.get_data(as_text=True)
+    assert '# TYPE flask_http_request_duration_seconds histogram' in body
+    assert ('flask_http_request_duration_seconds_count'
+            '{endpoint="library_manage.health_check",method="GET",status="200"}') in body
+
+
+def test_metrics_histogram_buckets():
+    from utils.metrics import MetricsRegistry
+    registry = MetricsRegistry()
+    histogram = registry.histogram('test_seconds', 'Test.', ('op',), buckets=(0.1, 1.0))
+    histogram.observe(0.05, ('a',))
+    histogram.observe(0.5, ('a',))
+    histogram.observe(5, ('a',))
+    lines = registry.expose().splitlines()
+    assert 'test_seconds_bucket{op="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{op="a",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{op="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{op="a"} 3' in lines
+
+
+@patch('services.services.requests.post')
+def test_trace_context_is_propagated(mock_post, client):
+    from utils.tracing import tracer, InMemorySpanExporter
+    exporter = InMemorySpanExporter()
+    tracer.set_exporter(exporter)
+    mock_post.return_value = MagicMock(status_code=200)
+    trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+    traceparent = '00-{}-00f067aa0ba902b7-01'.format(trace_id)
+    try:
+        response = client.post('/book_reserved_external',
+                               data=json.dumps({"book_id": 2}),
+                               content_type='application/json',
+                               headers={'Authorization': 'Bearer token',
+                                        'traceparent': traceparent})
+    finally:
+        tracer.set_exporter(None)
+    assert response.status_code == 200
+
+    client_span, server_span = exporter.spans
+    assert server_span.trace_id == trace_id
+    assert server_span.parent_id == '00f067aa0ba902b7'
+    assert client_span.parent_id == server_span.span_id
+    # The token verification in Django continues the trace
+    assert mock_post.call_args[1]['headers']['traceparent'] == client_span.traceparent
+
+
+@patch('views.views.reserve_books_external')
+def test_books_reserved_external_success(mock_reserve_books_external, client):
+    mock_reserve_books_external.return_value = {"results": {"1": True, "2": False}}
+    response = client.post('/books_reserved_external',
+                           data=json.dumps({"book_ids": [1, 2]}),
+                           content_type='application/json')
+    assert response.status_code == 200
+    assert response.json['results'] == {"1": True, "2": False}
+
+
+@patch('services.services.verify_token')
+def test_reserve_books_external_reserves_each_book(mock_verify_token, app):
+    from services.services import reserve_books_external
+    from services.inventory import inventory
+    available_id = next(pk for pk, book in MOCK_BOOK_DATA.items() if book['count_in_library'] > 0)
+    count = MOCK_BOOK_DATA[available_id]['count_in_library']
+    with app.app_context():
+        result = reserve_books_external({"book_ids": [available_id, 99999]}, {})
+    assert result == {"results": {str(available_id): True, "99999": False}}
+    assert inventory.get(available_id)['count_in_library'] == count - 1
+    inventory.release(available_id)
+    mock_verify_token.assert_called_once_with({})
+
+
+@patch('services.services.verify_token')
+def test_reserve_books_external_with_keys_takes_once(mock_verify_token, app):
+    from services.services import reserve_books_external, release_book_external
+    from services.inventory import inventory
+    available_id = next(pk for pk, book in MOCK_BOOK_DATA.items() if book['count_in_library'] > 0)
+    count = MOCK_BOOK_DATA[available_id]['count_in_library']
+    data = {"book_ids": [available_id], "idempotency_keys": ["bulk-1"]}
+    with app.app_context():
+        assert reserve_books_external(data, {}) == {"results": {str(available_id): True}}
+        # A retried batch holds the same copy
+        assert reserve_books_external(data, {}) == {"results": {str(available_id): True}}
+        assert inventory.get(available_id)['count_in_library'] == count - 1
+        release_book_external({"book_id": available_id}, {'Idempotency-Key': 'bulk-1'})
+        release_book_external({"book_id": available_id}, {'Idempotency-Key': 'bulk-1'})
+    assert inventory.get(available_id)['count_in_library'] == count
+
+
+def test_books_reserved_external_needs_a_key_per_book(client):
+    response = client.post('/books_reserved_external',
+                           data=json.dumps({"book_ids": [1, 2], "idempotency_keys": ["a"]}),
+                           content_type='application/json')
+    assert response.status_code == 400
+    assert 'idempotency_keys' in response.get_data(as_text=True)
+
+
+def test_books_reserved_external_validation_error(client):
+    response = client.post('/books_reserved_external',
+                           data=json.dumps({"book_ids": []}),
+                           content_type='application/json')
+    assert response.status_code == 400
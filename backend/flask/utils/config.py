@@ -20,6 +20,19 @@ class Config(object):
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Skip the table check on boot, tables are created with `flask init-db`
+    FAST_START = os.environ.get('FLASK_FAST_START') == 'True'
+
+    # Spans are appended to <TRACING_EXPORT_DIR>/flask.jsonl, tracing is off when empty
+    TRACING_EXPORT_DIR = os.environ.get('TRACING_EXPORT_DIR', '')
+
+    # 'database' keeps the external inventory in flask_external_books, 'memory' in the process
+    INVENTORY_BACKEND = os.environ.get('FLASK_INVENTORY_BACKEND', 'database')
+    # Seconds availability reads of an ISBN are served from the worker's cache
+    INVENTORY_CACHE_TTL = float(os.environ.get('FLASK_INVENTORY_CACHE_TTL', 5))
+    # ISBNs each worker keeps in that cache, the least recently read are dropped first
+    INVENTORY_CACHE_MAX_ISBNS = int(os.environ.get('FLASK_INVENTORY_CACHE_MAX_ISBNS', 1024))
+
     SQLALCHEMY_DATABASE_URI = 'mysql+pymysql://{}:{}@{}:{}/{}?charset=utf8mb4'.format(
         DB_USER,
         DB_PASSWORD,
@@ -14,7 +14,8 @@ class SQLAlchemyHandler(logging.Handler):
         self.db_session = db_session
 
     def emit(self, record):
-        from models import Log  # Lazy import / factory pattern / to avoid circular reference
+        # Lazy import / factory pattern / to avoid circular reference
+        from models.models import Log
         try:
             log_entry = Log(
                 timestamp=datetime.fromtimestamp(record.created),
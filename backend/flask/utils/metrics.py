@@ -0,0 +1,201 @@
+import bisect
+import itertools
+import threading
+
+# Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Shards per sharded metric, see ShardedMetric
+SHARDS = 16
+
+_thread_slots = itertools.count()
+_thread_local = threading.local()
+
+
+def _thread_slot():
+    """Number of the current thread, assigned on first use."""
+    slot = getattr(_thread_local, 'slot', None)
+    if slot is None:
+        # next() of itertools.count is atomic under the GIL
+        slot = _thread_local.slot = next(_thread_slots)
+    return slot
+
+
+def _escape(value):
+    return u'{}'.format(value).replace(u'\\', u'\\\\').replace(u'\n', u'\\n').replace(u'"', u'\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [u'{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    pairs += [u'{}="{}"'.format(name, value) for name, value in extra]
+    return u'{' + u','.join(pairs) + u'}' if pairs else u''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return u'+Inf'
+    return repr(float(value)) if isinstance(value, float) else u'{}'.format(value)
+
+
+class ShardedMetric(object):
+    """Updates go to one of SHARDS shards (label values -> value), each with its own lock,
+    a thread always uses the same one. The number of shards does not grow with the
+    number of threads, shards are summed when the metrics are collected."""
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = [({}, threading.Lock()) for _ in range(SHARDS)]
+
+    def _shard(self):
+        return self._shards[_thread_slot() % len(self._shards)]
+
+    def _snapshot(self):
+        snapshot = []
+        for shard, lock in self._shards:
+            with lock:
+                snapshot.append(dict((labelvalues, value[:] if isinstance(value, list) else value)
+                                     for labelvalues, value in shard.items()))
+        return snapshot
+
+    def clear(self):
+        for shard, lock in self._shards:
+            with lock:
+                shard.clear()
+
+
+class Counter(ShardedMetric):
+    type = 'counter'
+
+    def inc(self, labelvalues=(), amount=1):
+        shard, lock = self._shard()
+        with lock:
+            shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def collect(self):
+        totals = {}
+        for shard in self._snapshot():
+            for labelvalues, value in shard.items():
+                totals[labelvalues] = totals.get(labelvalues, 0) + value
+        return totals
+
+    def expose(self):
+        return [u'{}{} {}'.format(self.name, _format_labels(self.labelnames, labelvalues),
+                                  _format_value(value))
+                for labelvalues, value in sorted(self.collect().items())]
+
+
+class Histogram(ShardedMetric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labelvalues=()):
+        bucket = bisect.bisect_left(self.buckets, value)
+        shard, lock = self._shard()
+        with lock:
+            series = shard.get(labelvalues)
+            if series is None:
+                # Per bucket counts (the last one is +Inf), then sum
+                series = shard[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bucket] += 1
+            series[-1] += value
+
+    def collect(self):
+        totals = {}
+        for shard in self._snapshot():
+            for labelvalues, series in shard.items():
+                total = totals.setdefault(labelvalues, [0] * len(series))
+                for index, value in enumerate(series):
+                    total[index] += value
+        return totals
+
+    def expose(self):
+        lines = []
+        for labelvalues, series in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues,
+                                        [('le', _format_value(bound))])
+                lines.append(u'{}_bucket{} {}'.format(self.name, labels, cumulative))
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(u'{}_sum{} {}'.format(self.name, labels, _format_value(series[-1])))
+            lines.append(u'{}_count{} {}'.format(self.name, labels, cumulative))
+        return lines
+
+
+class Gauge(object):
+    """A value set from the code, or read from `callback` (label values -> value)."""
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._values = {}
+
+    def set(self, value, labelvalues=()):
+        self._values[labelvalues] = value
+
+    def collect(self):
+        if self.callback is not None:
+            return self.callback()
+        return self._values.copy()
+
+    def expose(self):
+        return [u'{}{} {}'.format(self.name, _format_labels(self.labelnames, labelvalues),
+                                  _format_value(value))
+                for labelvalues, value in sorted(self.collect().items())]
+
+    def clear(self):
+        self._values.clear()
+
+
+class MetricsRegistry(object):
+    """Metrics of this process. Registering a name twice returns the existing metric."""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self._register(Gauge, name, documentation, labelnames, callback=callback)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def expose(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(u'# HELP {} {}'.format(name, metric.documentation))
+            lines.append(u'# TYPE {} {}'.format(name, metric.type))
+            lines.extend(metric.expose())
+        return u'\n'.join(lines) + u'\n'
+
+    def clear(self):
+        for metric in list(self._metrics.values()):
+            metric.clear()
+
+
+registry = MetricsRegistry()
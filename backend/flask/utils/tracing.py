@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import binascii
+import threading
+from flask import current_app, g, has_request_context
+
+SERVICE_NAME = 'flask'
+
+# OTLP span kinds
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def _random_id(size):
+    return binascii.hexlify(os.urandom(size)).decode('ascii')
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, (int, long)):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': u'{}'.format(value)}}
+
+
+def parse_traceparent(header):
+    """Trace id and parent span id of a W3C traceparent header, None if it is invalid."""
+    parts = (header or '').strip().split('-')
+    if len(parts) < 4 or len(parts[0]) != 2 or parts[0] == 'ff':
+        return None
+    trace_id, parent_id = parts[1].lower(), parts[2].lower()
+    if len(trace_id) != 32 or len(parent_id) != 16:
+        return None
+    try:
+        int(trace_id, 16), int(parent_id, 16)
+    except ValueError:
+        return None
+    if trace_id == '0' * 32 or parent_id == '0' * 16:
+        return None
+    return trace_id, parent_id
+
+
+class Span(object):
+    def __init__(self, name, kind, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = _random_id(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = None
+        self.start_ns = int(time.time() * 1e9)
+        self.end_ns = None
+
+    @property
+    def traceparent(self):
+        return '00-{}-{}-01'.format(self.trace_id, self.span_id)
+
+    def set_error(self, description):
+        self.status = STATUS_ERROR
+        self.attributes['error.message'] = description
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            'status': {'code': self.status or STATUS_OK},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+class FileSpanExporter(object):
+    """Appends finished spans to a file, one OTLP/JSON `resourceSpans` document per line,
+    next to the Django ones so `manage.py trace_report` shows both services."""
+    def __init__(self, path, service_name=SERVICE_NAME):
+        self.path = path
+        self.resource = {'attributes': [_otlp_attribute('service.name', service_name)]}
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps({'resourceSpans': [{
+            'resource': self.resource,
+            'scopeSpans': [{'scope': {'name': 'optimo'}, 'spans': [span.to_otlp()]}],
+        }]})
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+
+class InMemorySpanExporter(object):
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+class Tracer(object):
+    """Spans of the current request are kept in flask.g. Tracing is off unless
+    TRACING_EXPORT_DIR is configured (or an exporter is set explicitly)."""
+    def __init__(self):
+        self._exporter = None
+
+    @property
+    def exporter(self):
+        if self._exporter is None and current_app.config.get('TRACING_EXPORT_DIR'):
+            self._exporter = FileSpanExporter(
+                os.path.join(current_app.config['TRACING_EXPORT_DIR'], SERVICE_NAME + '.jsonl'))
+        return self._exporter
+
+    def set_exporter(self, exporter):
+        self._exporter = exporter
+
+    def current_span(self):
+        return g.get('span') if has_request_context() else None
+
+    def begin(self, name, kind, traceparent=None, attributes=None):
+        if self.exporter is None:
+            return None
+        remote = parse_traceparent(traceparent) if traceparent else None
+        if remote is not None:
+            trace_id, parent_id = remote
+        else:
+            parent = self.current_span()
+            trace_id = parent.trace_id if parent else _random_id(16)
+            parent_id = parent.span_id if parent else None
+        return Span(name, kind, trace_id, parent_id, attributes)
+
+    def finish(self, span):
+        if span is None or span.end_ns is not None:
+            return
+        span.end_ns = int(time.time() * 1e9)
+        exporter = self.exporter
+        if exporter is not None:
+            exporter.export(span)
+
+    def inject(self, headers, span=None):
+        """Add the traceparent of span (default: the request's span) to outbound headers."""
+        span = span or self.current_span()
+        if span is not None:
+            headers['traceparent'] = span.traceparent
+        return headers
+
+
+tracer = Tracer()
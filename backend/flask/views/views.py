@@ -1,21 +1,76 @@
+import time
 import requests
-import copy
-from flask import jsonify, request, current_app, Blueprint
+from flask import jsonify, request, current_app, Blueprint, g
 from marshmallow import ValidationError
 from werkzeug.exceptions import BadRequest, Unauthorized
 # from utils.aes_encryption import SimpleAES, encrypt_payload
 from requests.exceptions import HTTPError
 from utils.utils import error_response
+from utils.metrics import CONTENT_TYPE, registry
+from utils.tracing import tracer, SPAN_KIND_SERVER
 from services.services import (
     reserve_book,
     reserve_book_external,
+    reserve_books_external,
+    release_book_external,
 )
 from services.auth_services import login_user
-from test.mock_data import MOCK_BOOK_DATA
+from services.inventory import current_inventory
 from flasgger import swag_from
 
 library_manage_blueprint = Blueprint('library_manage', __name__)
 
+HTTP_REQUEST_SECONDS = registry.histogram(
+    'flask_http_request_duration_seconds',
+    'Duration of requests by endpoint, method and status code.',
+    ('endpoint', 'method', 'status'),
+)
+
+
+@library_manage_blueprint.before_request
+def start_request_timer():
+    g.request_started_at = time.time()
+    # Continues the trace of the Django request calling this API
+    g.span = tracer.begin(u'{} {}'.format(request.method, request.endpoint), SPAN_KIND_SERVER,
+                          traceparent=request.headers.get('traceparent'),
+                          attributes={'http.method': request.method, 'http.target': request.path})
+
+
+@library_manage_blueprint.after_request
+def record_request_duration(response):
+    started_at = getattr(g, 'request_started_at', None)
+    if started_at is not None:
+        HTTP_REQUEST_SECONDS.observe(time.time() - started_at,
+                                     (request.endpoint, request.method, response.status_code))
+    span = g.get('span')
+    if span is not None:
+        span.attributes['http.status_code'] = response.status_code
+        if response.status_code >= 500:
+            span.set_error(u'HTTP {}'.format(response.status_code))
+        tracer.finish(span)
+    return response
+
+
+@library_manage_blueprint.teardown_request
+def finish_failed_request_span(exc):
+    # after_request is skipped for unhandled exceptions
+    span = g.get('span')
+    if span is not None and span.end_ns is None:
+        span.set_error(unicode(exc))
+        tracer.finish(span)
+
+
+@library_manage_blueprint.route('/metrics', methods=['GET'])
+@swag_from({
+    'responses': {
+        200: {
+            'description': 'Metrics of this process in the Prometheus text exposition format'
+        }
+    }
+})
+def metrics():
+    return registry.expose(), 200, {'Content-Type': CONTENT_TYPE}
+
 
 @library_manage_blueprint.route('/health', methods=['GET'])
 @swag_from({
@@ -86,10 +141,7 @@ def check_availability(isbn):
     """
     # External API logic should be applied here.
     # Instead, I simulate it with mock
-    books = copy.deepcopy(MOCK_BOOK_DATA)
-
-    books = {key: value for key, value in books.items()
-             if str(value['isbn']) == str(isbn) and int(value['count_in_library']) >= 1}
+    books = current_inventory().available(isbn)
 
     if not books:
         return jsonify({'error': 'Not found books based on ISBN'}), 400
@@ -137,7 +189,7 @@ def get_book_details(pk):
     """
     Endpoint to get details about a book.
     """
-    book = MOCK_BOOK_DATA.get(pk)
+    book = current_inventory().get(pk)
     if book:
         return jsonify({
             'title': book.get('title'),
@@ -269,6 +321,13 @@ def reserve():
                 },
                 'required': ['book_id']
             }
+        },
+        {
+            'name': 'Idempotency-Key',
+            'in': 'header',
+            'type': 'string',
+            'required': False,
+            'description': 'Key of the reservation, repeated calls with it have no further effect'
         }
     ],
     'responses': {
@@ -299,3 +358,107 @@ def book_reserved_external():
         current_app.logger.error(u'External reservation exception in /book_reserved_external \
                                  for request %s: %s', request.json, unicode(e))
         return error_response(u"An error occurred during external reservation", 500)
+
+
+@library_manage_blueprint.route('/books_reserved_external', methods=['POST'])
+@swag_from({
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'book_ids': {'type': 'array', 'items': {'type': 'integer'}},
+                    'idempotency_keys': {
+                        'type': 'array', 'items': {'type': 'string'},
+                        'description': 'Key of the reservation of every book, in the order '
+                                       'of book_ids, as the Idempotency-Key of a single one'
+                    },
+                },
+                'required': ['book_ids']
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Reservation result of every book, '
+                           'e.g. {"results": {"1": true, "2": false}}'
+        },
+        400: {
+            'description': 'Validation error'
+        },
+        500: {
+            'description': 'An error occurred during external reservation'
+        }
+    }
+})
+def books_reserved_external():
+    """Endpoint to reserve several books in external library with one request
+    """
+    try:
+        result = reserve_books_external(request.json, request.headers)
+        return jsonify(result), 200
+    except ValidationError as e:
+        return error_response(u"Validation error", 400, unicode(e))
+    except Unauthorized as e:
+        return error_response('Unauthorized', 400, e.message)
+    except Exception as e:
+        current_app.logger.error(u'External reservation exception in /books_reserved_external \
+                                 for request %s: %s', request.json, unicode(e))
+        return error_response(u"An error occurred during external reservation", 500)
+
+
+@library_manage_blueprint.route('/book_released_external', methods=['POST'])
+@swag_from({
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'book_id': {'type': 'integer'},
+                },
+                'required': ['book_id']
+            }
+        },
+        {
+            'name': 'Idempotency-Key',
+            'in': 'header',
+            'type': 'string',
+            'required': False,
+            'description': 'Key of the reservation, repeated calls with it have no further effect'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Book released successfully in external library'
+        },
+        400: {
+            'description': 'Validation error'
+        },
+        500: {
+            'description': 'An error occurred during external release'
+        }
+    }
+})
+def book_released_external():
+    """Endpoint to release a book reserved in external library, compensates
+    a reservation that could not be completed in Django
+    """
+    try:
+        result = release_book_external(request.json, request.headers)
+        return jsonify(result), 200
+    except ValidationError as e:
+        return error_response(u"Validation error", 400, unicode(e))
+    except Unauthorized as e:
+        return error_response('Unauthorized', 400, e.message)
+    except BadRequest as e:
+        return error_response('Bad Request', 400, unicode(e))
+    except Exception as e:
+        current_app.logger.error(u'External release exception in /book_released_external \
+                                 for request %s: %s', request.json, unicode(e))
+        return error_response(u"An error occurred during external release", 500)
@@ -0,0 +1,4 @@
+from app import create_app
+
+# WSGI entry point, e.g. for gunicorn: FLASK_FAST_START=True gunicorn wsgi:app
+app = create_app()
@@ -13,4 +13,22 @@ CREATE TABLE IF NOT EXISTS flask_logs (
     level VARCHAR(10) NOT NULL,
     message TEXT NOT NULL
 );
+
+CREATE TABLE IF NOT EXISTS flask_external_books (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    title VARCHAR(255) NOT NULL,
+    author VARCHAR(255) NOT NULL,
+    isbn VARCHAR(20) NOT NULL,
+    library VARCHAR(255) NOT NULL,
+    count_in_library INT NOT NULL DEFAULT 0,
+    CONSTRAINT flask_external_books_count_not_negative CHECK (count_in_library >= 0),
+    INDEX ix_flask_external_books_isbn (isbn)
+);
+
+CREATE TABLE IF NOT EXISTS flask_external_holds (
+    `key` VARCHAR(64) PRIMARY KEY,
+    book_id INT NOT NULL,
+    count INT NOT NULL DEFAULT 1,
+    created_at DATETIME NOT NULL
+);
 FLUSH PRIVILEGES;